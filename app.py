@@ -1,9 +1,22 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
 import re
 import json
 import os
-from chatbot import diamond_chatbot, load_data_and_index, extract_constraints_from_query
-from groq import Groq
+import atexit
+import hmac
+import threading
+import time
+from chatbot import batch_chatbot, load_data_and_index, load_catalog
+from catalog_snapshot import SNAPSHOT_DIR, snapshot_version
+from catalog_ingest import ingest_file
+from llm_pipeline import generate_chat_response, stream_chat_response, configure_executor
+from query_analysis import analyze_query
+from embedding_cache import EmbeddingCache, CachedEncoder
+from encoder_service import BatchingEncoder
+from response_cache import ResponseCache
+from llm_gateway import LLMGateway, CircuitBreaker, pooled_groq_client
+from sessions import SessionStore, SearchSession, PendingSearch, follow_up_kind, conversation_search
+from metrics import REGISTRY, REQUEST_SECONDS, SEARCH_OUTCOMES, Gauge, span, start_request, server_timing_header
 from dotenv import load_dotenv
 
 def convert_markdown_to_html(text):
@@ -23,58 +36,295 @@ MODEL_PATH = 'sentence_transformer_model'
 # Load environment variables
 load_dotenv()
 
-# Initialize Groq client
-client = Groq()
-
-# Load data, embeddings, FAISS index, and model at startup
-try:
-    df, embeddings, faiss_index, model = load_data_and_index(
-        EMBEDDING_FILE_PATH,
-        FAISS_INDEX_FILE,
-        DATAFRAME_FILE,
-        MODEL_PATH
-    )
-    print("Successfully loaded diamond data and models")
-except Exception as e:
-    print(f"Error loading data: {e}")
-    raise
+# Query embedding cache (set EMBEDDING_CACHE_FILE to persist it across restarts)
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", "0")) or None
+EMBEDDING_CACHE_FILE = os.getenv("EMBEDDING_CACHE_FILE")
+
+# Micro-batching of concurrent query encodes (ENCODER_MAX_BATCH_SIZE=1 disables it)
+ENCODER_MAX_BATCH_SIZE = int(os.getenv("ENCODER_MAX_BATCH_SIZE", "16"))
+ENCODER_MAX_WAIT_MS = float(os.getenv("ENCODER_MAX_WAIT_MS", "5"))
+
+# LLM_MODE: "concurrent" issues the response and expert analysis calls in parallel,
+# "single" asks for both in one completion. LLM_TIMEOUT is the deadline of each completion
+# (seconds, queueing and retries included); past it the rows are described by a template.
+LLM_MODE = os.getenv("LLM_MODE", "concurrent")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+
+# LLM gateway (see llm_gateway.py): concurrent completions per worker and how many more may
+# queue for a slot (and for how long), retries on upstream errors, and the circuit breaker
+# (consecutive failures to open it, seconds before trying the upstream again)
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "32"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "2"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+
+# Cache of LLM completions keyed on the result set (RESPONSE_CACHE_FILE enables the SQLite backend)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600")) or None
+RESPONSE_CACHE_FILE = os.getenv("RESPONSE_CACHE_FILE")
+
+# Largest number of queries accepted by one /search/batch request
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "10000"))
+
+# SERVER_TIMING_HEADER=1 adds a Server-Timing header with the per-stage durations of each request
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "0") == "1"
+
+# Initialize the Groq client behind the LLM gateway
+client = LLMGateway(
+    pooled_groq_client(LLM_MAX_IN_FLIGHT),
+    timeout=LLM_TIMEOUT,
+    max_in_flight=LLM_MAX_IN_FLIGHT,
+    max_queue=LLM_MAX_QUEUE,
+    queue_timeout=LLM_QUEUE_TIMEOUT,
+    retries=LLM_RETRIES,
+    breaker=CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET),
+)
+# One LLM thread for every call the gateway may run or queue
+configure_executor(LLM_MAX_IN_FLIGHT + LLM_MAX_QUEUE)
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_FILE)
+
+# Incremental inventory ingest via POST /admin/ingest (disabled unless ADMIN_TOKEN is set)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+INVENTORY_FEED_FILE = os.getenv("INVENTORY_FEED_FILE", "diamonds.csv")
+ingest_lock = threading.Lock()
+
+# With several worker processes an ingest only swaps the catalog of the worker that ran it;
+# the others pick up the new snapshot, checking for one at most every CATALOG_RELOAD_INTERVAL seconds
+CATALOG_RELOAD_INTERVAL = float(os.getenv("CATALOG_RELOAD_INTERVAL", "5"))
+
+# CATALOG_LOAD: "background" loads the catalog and model in a thread so the server starts
+# answering (and reporting readiness on /ready) immediately; "eager" loads before serving.
+CATALOG_LOAD = os.getenv("CATALOG_LOAD", "background")
+
+# Per-conversation search state, so follow-ups ("show more", "cheaper ones", "vs1 only")
+# refine the last search instead of starting over. SESSION_EVICTION: "lru" or "fifo".
+SESSION_MAX_SIZE = int(os.getenv("SESSION_MAX_SIZE", "1000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800")) or None
+SESSION_EVICTION = os.getenv("SESSION_EVICTION", "lru")
+session_store = SessionStore(SESSION_MAX_SIZE, SESSION_TTL, SESSION_EVICTION)
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL, EMBEDDING_CACHE_FILE)
+if EMBEDDING_CACHE_FILE:
+    atexit.register(embedding_cache.save)
+
+# (df, embeddings, faiss_index, model) once loaded; replaced as a whole (by /admin/ingest)
+# so every request sees a consistent catalog
+catalog = None
+catalog_ready = threading.Event()
+catalog_error = None
+catalog_version = None  # snapshot_version() the catalog was loaded from
+next_reload_check = 0.0
+
+def load_catalog_and_model():
+    """
+    Load data, embeddings, FAISS index, and model (from the catalog snapshot when present).
+    """
+    global catalog, catalog_error, catalog_version
+    try:
+        version = snapshot_version(SNAPSHOT_DIR)
+        df, embeddings, faiss_index, model = load_data_and_index(
+            EMBEDDING_FILE_PATH,
+            FAISS_INDEX_FILE,
+            DATAFRAME_FILE,
+            MODEL_PATH
+        )
+        if ENCODER_MAX_BATCH_SIZE > 1:
+            model = BatchingEncoder(model, ENCODER_MAX_BATCH_SIZE, ENCODER_MAX_WAIT_MS)
+        model = CachedEncoder(model, embedding_cache)
+        catalog = (df, embeddings, faiss_index, model)
+        catalog_version = version or snapshot_version(SNAPSHOT_DIR)
+        catalog_ready.set()
+        print("Successfully loaded diamond data and models")
+    except Exception as e:
+        catalog_error = e
+        print(f"Error loading data: {e}")
+        raise
+
+def reload_catalog_if_changed():
+    """
+    Swap in the catalog snapshot if another process has written a newer one.
+    """
+    global catalog, catalog_version, next_reload_check
+    now = time.monotonic()
+    if now < next_reload_check or not catalog_ready.is_set():
+        return
+    next_reload_check = now + CATALOG_RELOAD_INTERVAL
+    version = snapshot_version(SNAPSHOT_DIR)
+    if version is None or version == catalog_version or not ingest_lock.acquire(blocking=False):
+        return
+    try:
+        df, embeddings, faiss_index = load_catalog(EMBEDDING_FILE_PATH, FAISS_INDEX_FILE, DATAFRAME_FILE, SNAPSHOT_DIR)
+        catalog = (df, embeddings, faiss_index, catalog[3])
+        catalog_version = version
+        session_store.clear()
+    except Exception as e:
+        print(f"Error reloading catalog snapshot: {e}")
+    finally:
+        ingest_lock.release()
+
+if CATALOG_LOAD == "eager":
+    load_catalog_and_model()
+else:
+    threading.Thread(target=load_catalog_and_model, name="catalog-loader", daemon=True).start()
+
+def cache_counts(attribute):
+    caches = {("embedding",): embedding_cache, ("response",): response_cache}
+    return {labels: getattr(cache, attribute) for labels, cache in caches.items() if cache is not None}
+
+REGISTRY.register(Gauge("gemma_cache_hits_total", "Cache hits", lambda: cache_counts("hits"), ("cache",), type="counter"))
+REGISTRY.register(Gauge("gemma_cache_misses_total", "Cache misses", lambda: cache_counts("misses"), ("cache",), type="counter"))
+REGISTRY.register(Gauge("gemma_sessions", "Conversations held in the session store", lambda: {(): len(session_store)}))
+REGISTRY.register(Gauge("gemma_llm_in_flight", "LLM completions in flight", lambda: {(): client.in_flight}))
+REGISTRY.register(Gauge("gemma_llm_queued", "LLM completions waiting for a slot", lambda: {(): client.queued}))
+REGISTRY.register(Gauge("gemma_llm_circuit_open", "1 while the LLM circuit breaker is open", lambda: {(): int(client.breaker.is_open)}))
+
+@app.before_request
+def start_request_timing():
+    g.request_start = time.perf_counter()
+    g.stage_timings = start_request()
+    g.session_id = None
+
+@app.after_request
+def record_request_timing(response):
+    elapsed = time.perf_counter() - g.request_start
+    REQUEST_SECONDS.observe(elapsed, request.endpoint or "unknown", str(response.status_code))
+    if SERVER_TIMING_HEADER:
+        response.headers['Server-Timing'] = server_timing_header(g.stage_timings, elapsed)
+    if g.session_id:
+        response.headers['X-Session-Id'] = g.session_id
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """
+    Prometheus metrics: stage and request latency histograms, search outcomes, LLM
+    fallbacks and cache hit/miss counters (per worker process).
+    """
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
-def generate_expert_analysis(user_query, diamond_data):
-    """
-    Generate expert analysis using Groq.
-    """
-    diamond_str = "\n".join([str(diamond) for diamond in diamond_data])
-    
-    prompt = f"""
-    You are a diamond expert with years of experience in the industry.
-    Based on the user query and the diamonds found, provide a brief 2-3 line expert recommendation.
-    Please highlight the important attributes such as Carat, Clarity, Color, Cut, etc.
-    Focus on what makes these particular diamonds a good match for the customer's needs.
-    Be concise but insightful.
-    
-    User Query: {user_query}
-    
-    Diamonds Found:
-    {diamond_str}
-    
-    Your expert analysis (2-3 lines only):
-    """
-    
+@app.route('/ready')
+def ready():
+    """
+    Readiness probe: 200 once the catalog and model are loaded, 503 while loading.
+    """
+    if catalog_ready.is_set():
+        return jsonify({'status': 'ready', 'diamonds': len(catalog[0])})
+    if catalog_error is not None:
+        return jsonify({'status': 'error', 'error': str(catalog_error)}), 500
+    return jsonify({'status': 'loading'}), 503
+
+@app.route('/admin/ingest', methods=['POST'])
+def admin_ingest():
+    """
+    Applies an inventory feed to the live catalog: only new or changed stones are embedded,
+    and the updated catalog replaces the current one without interrupting searches.
+    """
+    global catalog, catalog_version
+    # Constant-time comparison, so response times do not reveal how much of the token matched
+    authorization = request.headers.get('Authorization', '').encode()
+    if not ADMIN_TOKEN or not hmac.compare_digest(authorization, f"Bearer {ADMIN_TOKEN}".encode()):
+        return jsonify({'error': 'unauthorized'}), 403
+    if not catalog_ready.is_set():
+        return jsonify({'error': 'catalog is still loading'}), 503
+    feed_file = (request.get_json(silent=True) or {}).get('feed', INVENTORY_FEED_FILE)
+    if not ingest_lock.acquire(blocking=False):
+        return jsonify({'error': 'an ingest is already running'}), 409
     try:
-        chat_completion = client.chat.completions.create(
-            messages=[{"role": "system", "content": prompt}],
-            model="llama-3.3-70b-versatile",
-            temperature=0.7,
-            max_tokens=150
-        )
-        return chat_completion.choices[0].message.content
+        df, embeddings, faiss_index, model = catalog
+        df, embeddings, faiss_index, stats = ingest_file(feed_file, df, embeddings, faiss_index, model)
+        catalog = (df, embeddings, faiss_index, model)
+        catalog_version = snapshot_version(SNAPSHOT_DIR)
+        session_store.clear()
+        return jsonify({'status': 'ok', 'diamonds': len(df), **stats})
     except Exception as e:
-        print(f"Error generating expert analysis: {e}")
-        return "These diamonds match your criteria and offer excellent value. Consider factors like cut quality and color which significantly impact a diamond's brilliance."
+        print(f"Error ingesting {feed_file}: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        ingest_lock.release()
+
+ERROR_REPLY = "I apologize, but I encountered an error. Please try your request again."
+
+def search_chat_message(user_query, session_id=None, pending_query=None):
+    """
+    Parses and searches a chat message (shared by /chat and /chat/stream) within the
+    conversation `session_id`: follow-ups are answered from the conversation's last search,
+    and the answer to the style question from the message it asked about (`pending_query`,
+    sent back by the client, is only used when that message is not in the session).
+    Returns (reply, status, query, parsed_query, top_5): `reply` is the complete response
+    body when the message is answered without the LLM (style question, greeting, no
+    matches, ...), otherwise None, and top_5 holds the diamonds to describe for `query`
+    (the conversation's query so far). The session id is returned in the X-Session-Id header.
+    """
+    if not user_query:
+        return {
+            'response': "I'm your diamond assistant. How can I help you find the perfect diamond today?"
+        }, 200, user_query, None, None
+
+    reload_catalog_if_changed()
+    current = catalog
+    session = session_store.get(session_id)
+    if isinstance(session, SearchSession) and (current is None or session.index is not current[2]):
+        session = None
+    if pending_query and not isinstance(session, PendingSearch):
+        # The style question's session is gone (another worker, or evicted): search its message with the style added
+        user_query = f"{pending_query} {user_query}"
+
+    # Parse the query once; the result is passed down through the chatbot and search.
+    with span("parse"):
+        parsed_query = analyze_query(user_query)
+    kind = follow_up_kind(parsed_query, session)
+
+    # Check for style preference if constraints are provided or ordering keywords are present, but no Style is detected.
+    # Follow-ups inherit the style of the conversation.
+    constraints = parsed_query.constraints
+    if (kind is None and
+        "Style" not in constraints and 
+        not parsed_query.is_greeting and 
+        (len(constraints) > 0 or parsed_query.has_ordering_keywords)):
+        SEARCH_OUTCOMES.inc("needs_style")
+        # Keep the message so the answer (just a Style) is merged into it
+        g.session_id = session_id or session_store.new_id()
+        session_store.put(g.session_id, PendingSearch(user_query, parsed_query))
+        return {
+            'response': "Would you prefer a lab-grown or natural diamond? Lab-grown diamonds are eco-friendly and more affordable, while natural diamonds are mined from the earth and traditionally valued.",
+            'needs_style': True
+        }, 200, user_query, parsed_query, None
+
+    if not catalog_ready.is_set():
+        return {
+            'response': "I'm still getting the diamond catalog ready. Please try again in a moment."
+        }, 503, user_query, parsed_query, None
+    df, embeddings, faiss_index, model = current
+
+    # Search for diamonds; canned replies (greeting, no matches, ...) skip the LLM
+    reply, top_5, session = conversation_search(kind, user_query, parsed_query, session, df, embeddings, faiss_index, model)
+    if session is not None:
+        g.session_id = session_id or session_store.new_id()
+        session_store.put(g.session_id, session)
+    if reply is not None:
+        return {'response': convert_markdown_to_html(reply), 'expert_analysis': ""}, 200, user_query, parsed_query, None
+    return None, 200, session.query, session.parsed_query, top_5
+
+def finish_response(response, expert_analysis):
+    """
+    Attach the expert analysis after the diamond data rendered from the search results and
+    convert markdown to HTML for display on the frontend.
+    """
+    response = response.replace('</diamond-data>', f'</diamond-data>\n\n<expert-analysis>{expert_analysis}</expert-analysis>')
+    return {
+        'response': convert_markdown_to_html(response),
+        'expert_analysis': expert_analysis
+    }
+
+def server_sent_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
 
 @app.route('/chat', methods=['POST'])
 def chat():
@@ -85,57 +335,109 @@ def chat():
         data = request.get_json()
         user_query = data.get('message', '').strip()
 
-        if not user_query:
-            return jsonify({
-                'response': "I'm your diamond assistant. How can I help you find the perfect diamond today?"
-            })
-
-        # Check for style preference if constraints are provided or ordering keywords are present, but no Style is detected.
-        constraints = extract_constraints_from_query(user_query)
-        ordering_keywords = ["maximum", "minimum", "lowest", "highest", "largest", "smallest", "cheapest","lowest price", "affordable", "low budget","most expensive", "highest price", "priciest", "expensive", "high budget"]
-        if ("Style" not in constraints and 
-            user_query.lower() not in ["hi", "hello"] and 
-            (len(constraints) > 0 or any(keyword in user_query.lower() for keyword in ordering_keywords))):
-            return jsonify({
-                'response': "Would you prefer a lab-grown or natural diamond? Lab-grown diamonds are eco-friendly and more affordable, while natural diamonds are mined from the earth and traditionally valued.",
-                'needs_style': True
-            })
-
-        # Call the chatbot function and get the response
-        response = diamond_chatbot(user_query, df, faiss_index, model, client)
-
-        # Fallback response if nothing is returned
-        if not response:
-            response = "I'm having trouble understanding your request. Could you please provide more details about the diamond you're looking for?"
-
-        # Extract structured diamond data (if available)
-        diamond_data_match = re.search(r'<diamond-data>([\s\S]*?)</diamond-data>', response)
-        diamond_data = None
-        if diamond_data_match:
-            try:
-                diamond_data = json.loads(diamond_data_match.group(1))
-            except json.JSONDecodeError:
-                print("Error decoding diamond data JSON")
-
-        # Generate expert analysis if valid diamond data exists
-        expert_analysis = ""
-        if diamond_data and isinstance(diamond_data, list) and len(diamond_data) > 0:
-            expert_analysis = generate_expert_analysis(user_query, diamond_data)
-            response = response.replace('</diamond-data>', f'</diamond-data>\n\n<expert-analysis>{expert_analysis}</expert-analysis>')
-
-        # Convert markdown to HTML for display on the frontend
-        response_html = convert_markdown_to_html(response)
-
-        return jsonify({
-            'response': response_html,
-            'expert_analysis': expert_analysis
-        })
+        reply, status, query, parsed_query, top_5 = search_chat_message(user_query, data.get('session_id'), data.get('pending_query'))
+        if reply is not None:
+            return jsonify(reply), status
+
+        # The response and expert analysis only depend on the top diamonds, so both
+        # completions are requested together
+        response, expert_analysis = generate_chat_response(
+            query, top_5, client, LLM_MODE, LLM_TIMEOUT,
+            cache=response_cache, constraints=parsed_query.constraints
+        )
+        return jsonify(finish_response(response, expert_analysis))
 
     except Exception as e:
         print(f"Error in chat endpoint: {e}")
-        return jsonify({
-            'response': "I apologize, but I encountered an error. Please try your request again."
-        }), 500
+        return jsonify({'response': ERROR_REPLY}), 500
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Streaming variant of /chat. Replies that need no LLM are returned as JSON, exactly like
+    /chat. Otherwise the response is a text/event-stream: a "results" event with the diamonds
+    as soon as the search returns, "introduction" and "analysis" events with text as Groq
+    produces it, and a final "done" event carrying the same body /chat would return.
+    """
+    try:
+        data = request.get_json()
+        user_query = data.get('message', '').strip()
+        reply, status, query, parsed_query, top_5 = search_chat_message(user_query, data.get('session_id'), data.get('pending_query'))
+        if reply is not None:
+            return jsonify(reply), status
+    except Exception as e:
+        print(f"Error in chat stream endpoint: {e}")
+        return jsonify({'response': ERROR_REPLY}), 500
+
+    def events():
+        try:
+            for event, payload in stream_chat_response(
+                query, top_5, client, LLM_TIMEOUT,
+                cache=response_cache, constraints=parsed_query.constraints
+            ):
+                if event == "done":
+                    payload = finish_response(payload['response'], payload['expert_analysis'])
+                yield server_sent_event(event, payload)
+        except Exception as e:
+            print(f"Error in chat stream endpoint: {e}")
+            yield server_sent_event("error", {'response': ERROR_REPLY})
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # keep reverse proxies from buffering the stream
+    })
+
+def batch_queries():
+    """
+    Queries of a /search/batch request and whether to run the LLM: a JSON body
+    {"queries": [...], "llm": false}, or JSON lines ({"query": ...} or a JSON string per
+    line) with ?llm=1.
+    """
+    if request.mimetype == 'application/json':
+        data = request.get_json()
+        return [str(query) for query in data.get('queries', [])], bool(data.get('llm', False))
+    queries = []
+    for line in request.get_data(as_text=True).splitlines():
+        if line.strip():
+            item = json.loads(line)
+            queries.append(str(item['query'] if isinstance(item, dict) else item))
+    return queries, request.args.get('llm', '0') == '1'
+
+@app.route('/search/batch', methods=['POST'])
+def search_batch():
+    """
+    Searches many queries in one request for offline jobs (merchandising, recommendation
+    emails). Results stream back as JSON lines, one per query and in order: {"query",
+    "reply"} when there is nothing to show, otherwise {"query", "diamonds"}, plus the LLM
+    "response" and "expert_analysis" when requested. Queries are encoded and searched in
+    batches (see chatbot.batch_search); the style question of /chat is not asked.
+    """
+    try:
+        queries, with_llm = batch_queries()
+    except Exception as e:
+        return jsonify({'error': f'invalid batch: {e}'}), 400
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify({'error': f'at most {BATCH_MAX_QUERIES} queries per batch'}), 413
+    if not catalog_ready.is_set():
+        return jsonify({'error': 'catalog is still loading'}), 503
+    reload_catalog_if_changed()
+    df, _, faiss_index, model = catalog
+
+    def lines():
+        try:
+            for record in batch_chatbot(
+                (query.strip() for query in queries), df, faiss_index, model,
+                client if with_llm else None, mode=LLM_MODE, timeout=LLM_TIMEOUT, cache=response_cache
+            ):
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+        except Exception as e:
+            print(f"Error in batch search endpoint: {e}")
+            yield json.dumps({'error': ERROR_REPLY}) + "\n"
+
+    return Response(stream_with_context(lines()), mimetype='application/x-ndjson', headers={
+        'X-Accel-Buffering': 'no'
+    })
 
 if __name__ == '__main__':
+    # Development server; in production run `gunicorn app:app` (see gunicorn.conf.py)
     app.run(debug=True, host='0.0.0.0', port=5505)
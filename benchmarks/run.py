@@ -0,0 +1,252 @@
+"""
+Offline benchmark of the search and chat pipeline. Needs no network: the catalog is
+synthesized from diamonds.csv, the SentenceTransformer and Groq are replaced by the stubs
+in benchmarks/stubs.py.
+
+    python -m benchmarks.run --rows 10000 --out bench_10k.json
+    python -m benchmarks.run --rows 10000 --compare bench_10k.json   # exit status 1 on regression
+
+Reports p50/p95/p99 latency and throughput per stage (query parsing, encoding,
+hybrid_search, /chat), the throughput of concurrent /chat requests, the cold start time
+and peak RSS of a serving process, and the catalog build time.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.stubs import StubEncoder, StubGroq
+from benchmarks.synthetic_catalog import synthesize_catalog
+
+QUERY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'queries.txt')
+
+# Latency metrics compared against a baseline; a stage regresses when it is slower by more
+# than the tolerance and by more than NOISE_FLOOR_MS
+LATENCY_METRICS = ["p50_ms", "p95_ms", "p99_ms"]
+NOISE_FLOOR_MS = 0.25
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+def summarize(latencies_ms, elapsed_seconds):
+    latencies = np.asarray(latencies_ms)
+    return {
+        "count": len(latencies),
+        "mean_ms": round(float(latencies.mean()), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 4),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 4),
+        "throughput_qps": round(len(latencies) / elapsed_seconds, 2),
+    }
+
+def time_stage(fn, inputs, before_each=None):
+    latencies = []
+    start = time.perf_counter()
+    for item in inputs:
+        if before_each:
+            before_each()
+        t = time.perf_counter()
+        fn(item)
+        latencies.append((time.perf_counter() - t) * 1000)
+    return summarize(latencies, time.perf_counter() - start)
+
+def load_queries(path=QUERY_FILE):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+def stub_environment(workdir, encoder_latency_ms=0.0):
+    """Settings for importing app.py offline against the catalog in workdir."""
+    os.chdir(workdir)
+    os.environ.setdefault("GROQ_API_KEY", "benchmark")
+    os.environ["CATALOG_LOAD"] = "eager"
+    import chatbot
+    chatbot.load_model = lambda model_path: StubEncoder(latency_ms=encoder_latency_ms)
+
+# ------------------- Catalog Build -------------------
+def build_catalog(workdir, seed_file, rows, index_variant):
+    """Synthesize the catalog and write it as the snapshot app.py loads. Returns seconds taken."""
+    from chatbot import prepare_catalog
+    from catalog_snapshot import SNAPSHOT_DIR, write_snapshot
+    from index_variants import build_index, embedding_dtype, search_options
+
+    start = time.perf_counter()
+    df = prepare_catalog(synthesize_catalog(pd.read_csv(seed_file), rows))
+    embeddings = StubEncoder().encode(df['combined_text'].tolist())
+    index = build_index(embeddings, index_variant)
+    write_snapshot(os.path.join(workdir, SNAPSHOT_DIR), df, embeddings.astype(embedding_dtype(index_variant)), index,
+                   search_options(index_variant))
+    return time.perf_counter() - start
+
+# ------------------- Startup Probe -------------------
+def probe_startup(workdir):
+    """Run in a fresh process: import app.py (eager catalog load) and report its footprint."""
+    stub_environment(workdir)
+    start = time.perf_counter()
+    import app
+    print(json.dumps({
+        "import_and_load_seconds": time.perf_counter() - start,
+        "peak_rss_mb": peak_rss_mb(),
+        "diamonds": len(app.catalog[0]),
+    }))
+
+def measure_startup(workdir):
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.run", "--probe-startup", workdir],
+        cwd=REPO_ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    wall = time.perf_counter() - start
+    probe = json.loads(output.strip().splitlines()[-1])
+    return {
+        "process_seconds": round(wall, 3),
+        "import_and_load_seconds": round(probe["import_and_load_seconds"], 3),
+        "peak_rss_mb": round(probe["peak_rss_mb"], 1),
+    }
+
+# ------------------- Pipeline Stages -------------------
+def run_stages(workdir, queries, repeat, concurrency, llm_latency_ms, encoder_latency_ms):
+    stub_environment(workdir, encoder_latency_ms)
+    import app
+    from chatbot import extract_constraints_from_query, hybrid_search
+    from query_analysis import _analyze_normalized
+
+    # Caches off and the raw encoder in place, so repeated passes measure the pipeline
+    df, embeddings, faiss_index, _ = app.catalog
+    encoder = StubEncoder(latency_ms=encoder_latency_ms)
+    app.catalog = (df, embeddings, faiss_index, encoder)
+    app.client.client = StubGroq(latency_ms=llm_latency_ms)  # behind the app's LLM gateway
+    app.response_cache = None
+    client = app.app.test_client()
+    corpus = queries * repeat
+
+    def chat(query):
+        response = client.post('/chat', json={'message': query})
+        if response.status_code != 200:
+            raise RuntimeError(f"/chat returned {response.status_code} for {query!r}")
+
+    stages = {
+        "parse": time_stage(extract_constraints_from_query, corpus, before_each=_analyze_normalized.cache_clear),
+        "encode": time_stage(encoder.encode, corpus),
+        "hybrid_search": time_stage(lambda q: hybrid_search(q, df, faiss_index, encoder), corpus),
+        "chat": time_stage(chat, corpus),
+    }
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(chat, corpus))
+    concurrent_qps = len(corpus) / (time.perf_counter() - start)
+    return stages, round(concurrent_qps, 2)
+
+# ------------------- Baseline Comparison -------------------
+def compare(current, baseline, tolerance):
+    """Return a list of regression messages (empty when within tolerance)."""
+    regressions = []
+    for stage, base in baseline["stages"].items():
+        now = current["stages"].get(stage)
+        if now is None:
+            continue
+        for metric in LATENCY_METRICS:
+            if now[metric] > base[metric] * (1 + tolerance) and now[metric] - base[metric] > NOISE_FLOOR_MS:
+                regressions.append(f"{stage} {metric}: {base[metric]:.3f} -> {now[metric]:.3f}")
+    if current["concurrent_chat_qps"] < baseline["concurrent_chat_qps"] * (1 - tolerance):
+        regressions.append(f"concurrent /chat throughput: {baseline['concurrent_chat_qps']} -> {current['concurrent_chat_qps']} qps")
+    for key in ["process_seconds", "peak_rss_mb"]:
+        base, now = baseline["startup"][key], current["startup"][key]
+        if now > base * (1 + tolerance):
+            regressions.append(f"startup {key}: {base} -> {now}")
+    return regressions
+
+def print_results(results):
+    print(f"{'stage':<14} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'qps':>10}")
+    for stage, stats in results["stages"].items():
+        print(f"{stage:<14} {stats['p50_ms']:>9.3f} {stats['p95_ms']:>9.3f} {stats['p99_ms']:>9.3f} {stats['throughput_qps']:>10.1f}")
+    print(f"concurrent /chat: {results['concurrent_chat_qps']} qps")
+    startup = results["startup"]
+    print(f"startup: {startup['process_seconds']}s (catalog load {startup['import_and_load_seconds']}s), peak RSS {startup['peak_rss_mb']} MB")
+    print(f"catalog build: {results['build_seconds']}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the search and chat pipeline")
+    parser.add_argument("--rows", type=int, default=10000, help="synthetic catalog size (e.g. 10000, 100000, 1000000)")
+    parser.add_argument("--seed-file", default=os.path.join(REPO_ROOT, "diamonds.csv"))
+    parser.add_argument("--index-variant", default="flat")
+    parser.add_argument("--queries", default=QUERY_FILE)
+    parser.add_argument("--repeat", type=int, default=5, help="passes over the query corpus per stage")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--encoder-latency-ms", type=float, default=0.0)
+    parser.add_argument("--workdir", help="where to write the catalog (default: a temporary directory)")
+    parser.add_argument("--out", help="write the results as JSON")
+    parser.add_argument("--compare", help="baseline JSON; exit with status 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed slowdown vs the baseline (0.15 = 15%%)")
+    parser.add_argument("--probe-startup", metavar="WORKDIR", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe_startup:
+        probe_startup(args.probe_startup)
+        return
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="gemma-bench-"))
+    os.makedirs(workdir, exist_ok=True)
+    build_seconds = build_catalog(workdir, args.seed_file, args.rows, args.index_variant)
+    startup = measure_startup(workdir)
+    stages, concurrent_qps = run_stages(
+        workdir, load_queries(args.queries), args.repeat, args.concurrency,
+        args.llm_latency_ms, args.encoder_latency_ms
+    )
+
+    results = {
+        "meta": {
+            "rows": args.rows,
+            "index_variant": args.index_variant,
+            "queries": len(load_queries(args.queries)),
+            "repeat": args.repeat,
+            "concurrency": args.concurrency,
+            "llm_latency_ms": args.llm_latency_ms,
+            "encoder_latency_ms": args.encoder_latency_ms,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "build_seconds": round(build_seconds, 3),
+        "startup": startup,
+        "stages": stages,
+        "concurrent_chat_qps": concurrent_qps,
+        "benchmark_peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    print_results(results)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["meta"]["rows"] != args.rows:
+            print(f"Warning: baseline was run with {baseline['meta']['rows']} rows")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import re
+import time
+import types
+import zlib
+
+import numpy as np
+
+
+# ------------------- Stub Encoder -------------------
+class StubEncoder:
+    """
+    Offline stand-in for the SentenceTransformer: each text is the normalized sum of fixed
+    random vectors of its (hashed) tokens, so texts sharing attributes land close together
+    and searches behave like they do on real embeddings. Deterministic across runs.
+    `latency_ms` adds a fixed cost per encode() call to mimic the model.
+    """
+
+    TOKEN_PATTERN = re.compile(r"[a-z0-9.]+")
+
+    def __init__(self, dimension=768, buckets=4096, latency_ms=0.0, seed=0):
+        self.dimension = dimension
+        self.latency = latency_ms / 1000.0
+        self.table = np.random.default_rng(seed).standard_normal((buckets, dimension)).astype('float32')
+
+    def _encode_one(self, text):
+        tokens = self.TOKEN_PATTERN.findall(text.lower())
+        if not tokens:
+            return np.zeros(self.dimension, dtype='float32')
+        vector = self.table[[zlib.crc32(token.encode()) % len(self.table) for token in tokens]].sum(axis=0)
+        return vector / np.linalg.norm(vector)
+
+    def encode(self, sentences, convert_to_numpy=True, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        if isinstance(sentences, str):
+            return self._encode_one(sentences)
+        if not len(sentences):
+            return np.zeros((0, self.dimension), dtype='float32')
+        return np.stack([self._encode_one(text) for text in sentences])
+
+    def save(self, path):
+        pass
+
+# ------------------- Stub Groq Client -------------------
+class StubGroq:
+    """
+    Offline stand-in for groq.Groq: chat.completions.create() returns a canned completion
+    (streamed word by word with stream=True) after `latency_ms`.
+    """
+
+    REPLY = ("I found some beautiful diamonds that match what you are looking for. "
+             "Carat: 1.0, Clarity: VS1 and an Excellent cut give these stones a great balance of sparkle and value.")
+
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000.0
+        self.calls = 0
+        self.chat = types.SimpleNamespace(completions=self)
+
+    def create(self, messages, model=None, temperature=None, max_tokens=None, stream=False, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if stream:
+            return (
+                types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=word + " "))])
+                for word in self.REPLY.split(" ")
+            )
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=self.REPLY))])
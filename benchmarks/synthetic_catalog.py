@@ -0,0 +1,35 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+
+# ------------------- Synthetic Catalog -------------------
+def synthesize_catalog(seed_df, rows, seed=0):
+    """
+    Scale a seed inventory (diamonds.csv) to `rows` stones. Stones are resampled from the
+    seed, which keeps its mix of Style, Shape, Clarity, Color, ... and the correlations
+    between them; Carat is then jittered log-normally, with Price following it
+    (price ~ carat^1.8) and the dimensions by the cube root, so numeric ranges stay
+    continuous rather than repeating the seed values.
+    """
+    rng = np.random.default_rng(seed)
+    df = seed_df.iloc[rng.integers(0, len(seed_df), rows)].reset_index(drop=True)
+
+    carat = pd.to_numeric(df['Carat'], errors='coerce')
+    new_carat = (carat * np.exp(rng.normal(0.0, 0.08, rows))).round(2).clip(lower=0.01)
+    ratio = (new_carat / carat).fillna(1.0)
+    df['Carat'] = new_carat
+    if 'Price' in df.columns:
+        price = pd.to_numeric(df['Price'], errors='coerce')
+        df['Price'] = (price * ratio ** 1.8 * np.exp(rng.normal(0.0, 0.05, rows))).round(2)
+    for column in ['Length', 'Height', 'Breadth']:
+        if column in df.columns:
+            df[column] = (pd.to_numeric(df[column], errors='coerce') * ratio ** (1 / 3)).round(2)
+    return df
+
+if __name__ == '__main__':
+    # Usage: python -m benchmarks.synthetic_catalog diamonds.csv 100000 diamonds_100k.csv
+    seed_file, rows, out_file = sys.argv[1], int(sys.argv[2]), sys.argv[3]
+    synthesize_catalog(pd.read_csv(seed_file), rows).to_csv(out_file, index=False)
+    print(f"Wrote {rows} synthetic diamonds to {out_file}")
@@ -0,0 +1,130 @@
+import sys
+
+import numpy as np
+import pandas as pd
+import faiss
+
+from catalog_snapshot import SNAPSHOT_DIR, DERIVED_COLUMNS, write_snapshot
+from chatbot import prepare_catalog, compact_catalog, load_catalog, load_model
+from search_index import DiamondSearchIndex
+
+# Feed column carrying a supplier stone id; without it stones are identified by their attributes
+STONE_ID_COLUMN = 'StoneId'
+
+# Attributes that may change without making it a different stone
+MUTABLE_COLUMNS = ['Price']
+
+# Rows encoded per model.encode() call when embedding new or changed stones
+INGEST_BATCH_SIZE = 256
+
+
+# ------------------- Stone Identity -------------------
+def _hash_rows(frame):
+    """uint64 hash per row of the given columns, independent of column order and numeric dtype."""
+    canonical = {}
+    for name in sorted(frame.columns):
+        series = frame[name]
+        if pd.api.types.is_numeric_dtype(series.dtype):
+            canonical[name] = series.astype('float64')
+        else:
+            canonical[name] = series.astype(str)
+    return pd.util.hash_pandas_object(pd.DataFrame(canonical), index=False).to_numpy()
+
+def _content_columns(df):
+    return [name for name in df.columns if name not in DERIVED_COLUMNS]
+
+def stone_ids(df):
+    """
+    Stable id per stone: the StoneId column when the feed has one, otherwise a hash of the
+    attributes that do not change for a stone (everything but Price), numbered by
+    occurrence so identical stones stay distinct.
+    """
+    if STONE_ID_COLUMN in df.columns:
+        return _hash_rows(df[[STONE_ID_COLUMN]])
+    identity = _hash_rows(df[[c for c in _content_columns(df) if c not in MUTABLE_COLUMNS]])
+    occurrence = pd.Series(identity).groupby(identity).cumcount().to_numpy()
+    return _hash_rows(pd.DataFrame({'identity': identity, 'occurrence': occurrence}))
+
+def row_keys(df, ids=None):
+    """Hash of stone id and full content: equal keys mean the stored row and vector can be kept."""
+    ids = stone_ids(df) if ids is None else ids
+    return _hash_rows(pd.DataFrame({'id': ids, 'content': _hash_rows(df[_content_columns(df)])}))
+
+# ------------------- Incremental Ingest -------------------
+def diff_catalog(df, feed):
+    """
+    Compare the stored catalog with a prepared feed. Returns (keep_mask, add_mask, stats):
+    keep_mask marks stored rows that are unchanged, add_mask marks feed rows that are
+    new or changed.
+    """
+    old_ids, new_ids = stone_ids(df), stone_ids(feed)
+    old_keys, new_keys = row_keys(df, old_ids), row_keys(feed, new_ids)
+    keep_mask = np.isin(old_keys, new_keys)
+    add_mask = ~np.isin(new_keys, old_keys)
+
+    known = np.isin(new_ids, old_ids)
+    stats = {
+        'unchanged': int(keep_mask.sum()),
+        'added': int((add_mask & ~known).sum()),
+        'changed': int((add_mask & known).sum()),
+        'removed': int((~np.isin(old_ids, new_ids)).sum()),
+    }
+    return keep_mask, add_mask, stats
+
+def ingest_feed(feed, df, embeddings, faiss_index, model, batch_size=INGEST_BATCH_SIZE):
+    """
+    Apply an inventory feed (a raw DataFrame, as read from diamonds.csv) to the catalog.
+    Only new or changed stones are embedded; their stale vectors are removed from a copy
+    of the FAISS index and the new ones appended, keeping FAISS ids equal to DataFrame row
+    positions. The inputs are left untouched so searches can keep using them until the
+    caller swaps in the result.
+    Returns (df, embeddings, DiamondSearchIndex, stats).
+    """
+    feed = prepare_catalog(feed)
+    texts = feed['combined_text']
+    feed = compact_catalog(feed)
+    keep_mask, add_mask, stats = diff_catalog(df, feed)
+    added = feed[add_mask]
+    print(f"Ingest: {stats['added']} new, {stats['changed']} changed, {stats['removed']} removed, {stats['unchanged']} unchanged")
+
+    dimension = faiss_index.d
+    new_embeddings = np.empty((len(added), dimension), dtype='float32')
+    texts = texts[add_mask].tolist()
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        new_embeddings[start:start + len(batch)] = model.encode(batch, convert_to_numpy=True, batch_size=len(batch))
+
+    # FAISS flat indexes compact on remove_ids, so the surviving vectors keep the order
+    # of the surviving rows and the appended ones line up with the appended rows.
+    # Copy through serialization: clone_index would share a memory-mapped (read-only) store.
+    index = faiss.deserialize_index(faiss.serialize_index(faiss_index.faiss_index))
+    df = compact_catalog(pd.concat([df[keep_mask], added], ignore_index=True))
+    stored_dtype = np.asarray(embeddings).dtype
+    embeddings = np.concatenate([np.asarray(embeddings)[keep_mask], new_embeddings]).astype(stored_dtype)
+    if faiss.try_extract_index_ivf(index) is not None:
+        # IVF indexes store explicit ids and do not compact on removal: refill the trained
+        # index from the stored embeddings instead (no re-encoding needed)
+        index.reset()
+        index.add(np.ascontiguousarray(embeddings, dtype='float32'))
+    else:
+        removed_positions = np.flatnonzero(~keep_mask).astype('int64')
+        if len(removed_positions):
+            index.remove_ids(faiss.IDSelectorBatch(removed_positions))
+        if len(new_embeddings):
+            index.add(new_embeddings)
+
+    if index.ntotal != len(df):
+        raise RuntimeError(f"Index has {index.ntotal} vectors for {len(df)} diamonds after ingest")
+    return df, embeddings, DiamondSearchIndex(df, index, embeddings, **faiss_index.search_options), stats
+
+def ingest_file(feed_file, df, embeddings, faiss_index, model, snapshot_dir=SNAPSHOT_DIR):
+    """Ingest a feed CSV and persist the result as the new catalog snapshot."""
+    df, embeddings, faiss_index, stats = ingest_feed(pd.read_csv(feed_file), df, embeddings, faiss_index, model)
+    write_snapshot(snapshot_dir, df, embeddings, faiss_index.faiss_index, faiss_index.search_options)
+    return df, embeddings, faiss_index, stats
+
+if __name__ == '__main__':
+    # Usage: python catalog_ingest.py [feed.csv]
+    feed_file = sys.argv[1] if len(sys.argv) > 1 else 'diamonds.csv'
+    df, embeddings, faiss_index = load_catalog('diamond_embeddings.npy', 'diamond_faiss_index.faiss', 'diamond_dataframe.csv')
+    ingest_file(feed_file, df, embeddings, faiss_index, load_model('sentence_transformer_model'))
@@ -0,0 +1,166 @@
+import os
+import sys
+import json
+import shutil
+
+import numpy as np
+import pandas as pd
+import faiss
+
+# Bump when the on-disk layout changes; older snapshots are rejected and rebuilt
+SNAPSHOT_VERSION = 1
+SNAPSHOT_DIR = 'catalog_snapshot'
+
+MANIFEST_FILE = 'manifest.json'
+EMBEDDINGS_FILE = 'embeddings.npy'
+INDEX_FILE = 'index.faiss'
+COLUMNS_DIR = 'columns'
+
+# Columns derived from the others when needed rather than stored
+DERIVED_COLUMNS = ['combined_text']
+
+# Fields (in order) that make up the combined_text embedded for each diamond
+COMBINED_TEXT_FIELDS = ["Style", "Carat", "Clarity", "Color", "Cut", "Shape", "Price", "Lab", "Polish", "Symmetry"]
+
+# Read the flat index codes through mmap when this faiss build supports it
+_INDEX_MMAP_FLAGS = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def _format_number(field, value):
+    value = float(value)
+    # Whole prices read as integers ("2186", not "2186.0") whatever the column dtype
+    if field == "Price" and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def _field_text(df, field):
+    series = df[field]
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        return series.map(lambda value: _format_number(field, value))
+    return series.astype(str)
+
+def build_combined_text(df):
+    """
+    Builds the "Style: ..., Carat: ..., ..." description embedded for each diamond.
+    Carat and Price are rendered from their values, so the text is the same whether the
+    columns come from the feed, the snapshot or an ingest that changed their dtype.
+    """
+    parts = [f"{field}: " + _field_text(df, field) for field in COMBINED_TEXT_FIELDS]
+    combined_text = parts[0]
+    for part in parts[1:]:
+        combined_text = combined_text + ", " + part
+    return combined_text
+
+# ------------------- Snapshot Writing -------------------
+def _code_dtype(cardinality):
+    if cardinality < 2 ** 7:
+        return 'int8'
+    if cardinality < 2 ** 15:
+        return 'int16'
+    return 'int32'
+
+def write_snapshot(snapshot_dir, df, embeddings, faiss_index, search_options=None):
+    """
+    Write the catalog as a versioned binary snapshot: one .npy per column (numeric columns
+    in their own dtype, text columns as integer codes plus a category list in the
+    manifest), the embeddings as a raw .npy (float16 if given as float16, else float32),
+    the FAISS index and the DiamondSearchIndex `search_options` it is meant to be searched
+    with. The snapshot is built in a temporary directory and renamed into place, so
+    readers never see a partial one.
+    """
+    tmp_dir = snapshot_dir.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(os.path.join(tmp_dir, COLUMNS_DIR))
+
+    columns = []
+    for name in df.columns:
+        if name in DERIVED_COLUMNS:
+            continue
+        series = df[name]
+        path = os.path.join(tmp_dir, COLUMNS_DIR, f'{name}.npy')
+        if pd.api.types.is_numeric_dtype(series.dtype):
+            np.save(path, series.to_numpy())
+            columns.append({'name': name, 'kind': 'numeric', 'dtype': str(series.dtype)})
+        else:
+            codes, categories = pd.factorize(series)
+            np.save(path, codes.astype(_code_dtype(len(categories))))
+            columns.append({'name': name, 'kind': 'categorical', 'categories': [str(c) for c in categories]})
+
+    dtype = 'float16' if embeddings.dtype == np.float16 else 'float32'
+    embeddings = np.ascontiguousarray(embeddings, dtype=dtype)
+    np.save(os.path.join(tmp_dir, EMBEDDINGS_FILE), embeddings)
+    faiss.write_index(faiss_index, os.path.join(tmp_dir, INDEX_FILE))
+
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'rows': int(len(df)),
+        'dimension': int(embeddings.shape[1]),
+        'columns': columns,
+        'search': search_options or {},
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    old_dir = snapshot_dir.rstrip('/') + '.old'
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(snapshot_dir):
+        os.replace(snapshot_dir, old_dir)
+    os.replace(tmp_dir, snapshot_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    print(f"Catalog snapshot with {len(df)} rows written to {snapshot_dir}")
+
+# ------------------- Snapshot Loading -------------------
+def read_manifest(snapshot_dir):
+    with open(os.path.join(snapshot_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported catalog snapshot version {manifest.get('version')} in {snapshot_dir}")
+    return manifest
+
+def snapshot_exists(snapshot_dir):
+    return os.path.exists(os.path.join(snapshot_dir, MANIFEST_FILE))
+
+def snapshot_version(snapshot_dir):
+    """Changes whenever a new snapshot is written to snapshot_dir (None if there is none)."""
+    try:
+        return os.stat(os.path.join(snapshot_dir, MANIFEST_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def load_snapshot(snapshot_dir):
+    """
+    Load a catalog snapshot. Returns (df, embeddings, faiss_index): text columns come back
+    as pandas categoricals over the stored codes, the embeddings are a read-only memory
+    map and the FAISS index is memory-mapped where faiss supports it, so load time does
+    not grow with the size of the vectors. Derived columns such as combined_text are not
+    part of the snapshot.
+    """
+    manifest = read_manifest(snapshot_dir)
+    data = {}
+    for column in manifest['columns']:
+        values = np.load(os.path.join(snapshot_dir, COLUMNS_DIR, f"{column['name']}.npy"))
+        if column['kind'] == 'categorical':
+            # Code -1 is a missing value
+            values = pd.Categorical.from_codes(values, column['categories'])
+        data[column['name']] = values
+    df = pd.DataFrame(data)
+
+    embeddings = np.load(os.path.join(snapshot_dir, EMBEDDINGS_FILE), mmap_mode='r')
+    index_path = os.path.join(snapshot_dir, INDEX_FILE)
+    try:
+        faiss_index = faiss.read_index(index_path, _INDEX_MMAP_FLAGS)
+    except RuntimeError:
+        faiss_index = faiss.read_index(index_path)
+    return df, embeddings, faiss_index
+
+# ------------------- Conversion -------------------
+def convert_legacy_files(dataframe_file, embedding_file, faiss_index_file, snapshot_dir=SNAPSHOT_DIR):
+    """Build a snapshot from the CSV/.npy/.faiss files written by earlier versions."""
+    df = pd.read_csv(dataframe_file)
+    df["Carat"] = pd.to_numeric(df["Carat"], errors="coerce")
+    write_snapshot(snapshot_dir, df, np.load(embedding_file), faiss.read_index(faiss_index_file))
+
+if __name__ == '__main__':
+    # Usage: python catalog_snapshot.py [dataframe.csv embeddings.npy index.faiss [snapshot_dir]]
+    args = sys.argv[1:] or ['diamond_dataframe.csv', 'diamond_embeddings.npy', 'diamond_faiss_index.faiss']
+    convert_legacy_files(*args)
@@ -4,39 +4,66 @@ from sentence_transformers import SentenceTransformer
 import faiss
 import re
 import os
+import time
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 from groq import Groq
 from dotenv import load_dotenv
+from search_index import DiamondSearchIndex
+from catalog_snapshot import (SNAPSHOT_DIR, DERIVED_COLUMNS, build_combined_text, write_snapshot, load_snapshot,
+                              snapshot_exists, read_manifest)
+from index_variants import build_index, index_variant_of, embedding_dtype, write_report, search_options as variant_search_options
+from query_analysis import analyze_query
+from metrics import span, observe_stage, SEARCH_OUTCOMES
+from llm_pipeline import generate_introduction, generate_chat_response, diamond_records, assemble_response, prompt_data
 
-# Global: Path for embeddings (used in temporary index building)
-EMBEDDING_FILE_PATH = 'diamond_embeddings.npy'
+# Columns stored as numbers in the catalog
+NUMERIC_COLUMNS = ["Length", "Height", "Breadth", "Depth", "Carat", "Price", "Ratio"]
+
+# Numeric columns served as float32 (physical dimensions); Carat and Price stay float64
+# so filters, ranking and the prompt see the feed's values exactly
+FLOAT32_COLUMNS = ["Length", "Height", "Breadth", "Depth", "Ratio"]
 
 # ------------------- Data Preparation & Embedding Generation -------------------
-def data_and_embedding(file_path, embedding_file, faiss_index_file, dataframe_file, model_path):
-    df = pd.read_csv(file_path)
+def prepare_catalog(df):
+    """
+    Normalizes a raw inventory feed: strips non-ASCII characters, lowercases every value,
+    adds combined_text and converts the numeric columns.
+    """
     df = df.replace({r'[^\x00-\x7F]+': ''}, regex=True)
     # Convert all data values to lowercase
     df = df.apply(lambda x: x.astype(str).str.lower())
 
-    print(f"Number of rows in dataset: {df.shape[0]}")
-    print(f"Column names in dataset: {df.columns.tolist()}")  # Print column names
+    # Ensure numeric columns (Carat, Price, ...) are numeric
+    for column in NUMERIC_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors="coerce")
 
-    # Create a combined text field that includes Style
-    df['combined_text'] = (
-        "Style: " + df['Style'].astype(str) + ", " +
-        "Carat: " + df['Carat'].astype(str) + ", " +
-        "Clarity: " + df['Clarity'].astype(str) + ", " +
-        "Color: " + df['Color'].astype(str) + ", " +
-        "Cut: " + df['Cut'].astype(str) + ", " +
-        "Shape: " + df['Shape'].astype(str) + ", " +
-        "Price: " + df['Price'].astype(str) + ", " +
-        "Lab: " + df['Lab'].astype(str) + ", " +
-        "Polish: " + df['Polish'].astype(str) + ", " +
-        "Symmetry: " + df['Symmetry'].astype(str)
-    )
-
-    # Ensure Carat is numeric
-    df["Carat"] = pd.to_numeric(df["Carat"], errors="coerce")
+    # Create a combined text field that includes Style, from the same values prompts use
+    df['combined_text'] = build_combined_text(df)
+    return df
 
+def compact_catalog(df):
+    """
+    The catalog as it is served: text columns as pandas categoricals (one code per row over
+    the normalized values), the dimension columns as float32, and no combined_text, which
+    build_combined_text derives for the few rows that reach an LLM prompt.
+    """
+    df = df.drop(columns=[column for column in DERIVED_COLUMNS if column in df.columns])
+    for column in df.columns:
+        dtype = df[column].dtype
+        if column in FLOAT32_COLUMNS:
+            df[column] = df[column].astype('float32')
+        elif not pd.api.types.is_numeric_dtype(dtype) and not isinstance(dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    return df
+
+def data_and_embedding(file_path, embedding_file, faiss_index_file, dataframe_file, model_path, snapshot_dir=SNAPSHOT_DIR, index_variant="flat", report=True):
+    df = prepare_catalog(pd.read_csv(file_path))
+
+    print(f"Number of rows in dataset: {df.shape[0]}")
+    print(f"Column names in dataset: {df.columns.tolist()}")  # Print column names
     print("First combined text:", df['combined_text'].iloc[0])
 
     # Generate embeddings using SentenceTransformer
@@ -44,28 +71,56 @@ def data_and_embedding(file_path, embedding_file, faiss_index_file, dataframe_fi
     embeddings = model.encode(df['combined_text'].tolist(), convert_to_numpy=True)
     print(f"Shape of embeddings: {embeddings.shape}")
 
-    # Build FAISS index using L2 distance
-    embedding_dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(embedding_dimension)
-    index.add(embeddings)
+    # Build the FAISS index (L2 distance) in the selected representation
+    index = build_index(embeddings, index_variant)
+    search_options = variant_search_options(index_variant)
+    if report:
+        write_report(df, embeddings, model)
 
     # Save embeddings, FAISS index, and dataframe to disk
+    embeddings = embeddings.astype(embedding_dtype(index_variant))
     np.save(embedding_file, embeddings)
     faiss.write_index(index, faiss_index_file)
     df.to_csv(dataframe_file, index=False)
     model.save(model_path)
+    df = compact_catalog(df)
+    write_snapshot(snapshot_dir, df, embeddings, index, search_options)
 
-    print("Model, embeddings, and FAISS index saved to disk.")
-    return df, embeddings, index, model
+    print(f"Model, embeddings, and FAISS index ({index_variant}) saved to disk.")
+    return df, embeddings, DiamondSearchIndex(df, index, embeddings, **search_options), model
 
 # ------------------- Load Data & FAISS Index -------------------
-def load_data_and_index(embedding_file, faiss_index_file, dataframe_file, model_path):
-    df = pd.read_csv(dataframe_file)
-    print(f"Column names in loaded dataset: {df.columns.tolist()}")  # Print column names
-    df["Carat"] = pd.to_numeric(df["Carat"], errors="coerce")
-    embeddings = np.load(embedding_file)
-    index = faiss.read_index(faiss_index_file)
-    model = SentenceTransformer(model_path)
+def load_catalog(embedding_file, faiss_index_file, dataframe_file, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Loads the catalog DataFrame, embeddings and search index. Uses the binary snapshot
+    (memory-mapped embeddings and index) when present; otherwise reads the CSV/.npy/.faiss
+    files and writes a snapshot so the next start is fast.
+    """
+    if snapshot_exists(snapshot_dir):
+        df, embeddings, index = load_snapshot(snapshot_dir)
+        df = compact_catalog(df)
+        search_options = read_manifest(snapshot_dir)['search']
+        print(f"Loaded catalog snapshot from {snapshot_dir}")
+    else:
+        df = pd.read_csv(dataframe_file)
+        print(f"Column names in loaded dataset: {df.columns.tolist()}")  # Print column names
+        df["Carat"] = pd.to_numeric(df["Carat"], errors="coerce")
+        df = compact_catalog(df)
+        embeddings = np.load(embedding_file)
+        index = faiss.read_index(faiss_index_file)
+        search_options = variant_search_options(index_variant_of(index))
+        try:
+            write_snapshot(snapshot_dir, df, embeddings, index, search_options)
+        except Exception as e:
+            print(f"Could not write catalog snapshot: {e}")
+    return df, embeddings, DiamondSearchIndex(df, index, embeddings, **search_options)
+
+def load_model(model_path):
+    return SentenceTransformer(model_path)
+
+def load_data_and_index(embedding_file, faiss_index_file, dataframe_file, model_path, snapshot_dir=SNAPSHOT_DIR):
+    df, embeddings, index = load_catalog(embedding_file, faiss_index_file, dataframe_file, snapshot_dir)
+    model = load_model(model_path)
     print("Loaded data, embeddings, FAISS index, and model from disk.")
     return df, embeddings, index, model
 
@@ -74,295 +129,375 @@ def extract_constraints_from_query(user_query):
     """
     Extracts constraints (Carat, Color, Clarity, Cut, Symmetry, Polish, Style, Shape, Budget)
     from the user's query. Non-numeric values are normalized to lowercase.
-    Returns a dictionary.
+    Returns a dictionary. See query_analysis.analyze_query for the full parse result.
     """
-    constraints = {}
+    return dict(analyze_query(user_query).constraints)
 
-    # Extract style (e.g., "lab grown", "lab", or "natural")
-    style_match = re.search(r'\b(lab\s*grown|lab|natural)\b', user_query, re.IGNORECASE)
-    if style_match:
-        style = style_match.group(1).lower()
-        # Normalize "lab" or "lab grown" to "labgrown"
-        if "lab" in style:
-            constraints["Style"] = "labgrown"
-        else:
-            constraints["Style"] = "natural"
-
-    # Extract Carat (e.g., "0.8 carat")
-    carat_match = re.search(r'(\d+(\.\d+)?)\s*-?\s*carat', user_query, re.IGNORECASE)
-    if carat_match:
-        constraints["Carat"] = float(carat_match.group(1))
-
-    # Extract Budget: try two patterns to handle both "price 2000$" and "2000$ price"
-    pattern1 = r'\b(?:under|at price|price)\s*\$?(\d+(?:,\d+)?)(?:\$)?\b'
-    pattern2 = r'\$?(\d+(?:,\d+)?)(?:\$)?\s*price\b'
-    budget_match = re.search(pattern1, user_query, re.IGNORECASE) or re.search(pattern2, user_query, re.IGNORECASE)
-    if budget_match:
-        budget_str = budget_match.group(1).replace(',', '')
-        constraints["Budget"] = float(budget_str)
-
-    # Extract Color (e.g., "E", "G") – normalized to lowercase
-    color_match = re.search(r'\b([a-j])\b', user_query, re.IGNORECASE)
-    if color_match:
-        constraints["Color"] = color_match.group(1).lower()
-
-    # Extract Clarity (e.g., "VS1", "VVS2", etc.) – normalized to lowercase
-    clarity_match = re.search(r'\b(if|vvs1|vvs2|vs1|vs2|si1|si2)\b', user_query, re.IGNORECASE)
-    if clarity_match:
-        constraints["Clarity"] = clarity_match.group(1).lower()
-
-    # Extract Cut: match either "cut is excellent" or "excellent cut"
-    cut_match = re.search(r'(?:cut\s*(?:is\s*)?(excellent|ideal|very good|good))|(?:(excellent|ideal|very good|good)\s*cut)', user_query, re.IGNORECASE)
-    if cut_match:
-        quality = cut_match.group(1) if cut_match.group(1) is not None else cut_match.group(2)
-        constraints["Cut"] = quality.lower()
-
-    # Extract Polish: match either "polish is very good" or "very good polish"
-    polish_match = re.search(r'(?:polish\s*(?:is\s*)?(excellent|ideal|very good|good))|(?:(excellent|ideal|very good|good)\s*polish)', user_query, re.IGNORECASE)
-    if polish_match:
-        quality = polish_match.group(1) if polish_match.group(1) is not None else polish_match.group(2)
-        constraints["Polish"] = quality.lower()
-
-    # Extract Symmetry: match either "symmetry is good" or "good symmetry"
-    symmetry_match = re.search(r'(?:symmetry\s*(?:is\s*)?(excellent|ideal|very good|good))|(?:(excellent|ideal|very good|good)\s*symmetry)', user_query, re.IGNORECASE)
-    if symmetry_match:
-        quality = symmetry_match.group(1) if symmetry_match.group(1) is not None else symmetry_match.group(2)
-        constraints["Symmetry"] = quality.lower()
-
-    # Extract Shape (e.g., "round", "princess", etc.) – normalized to lowercase
-    shape_match = re.search(r'\b(round|princess|emerald|asscher|cushion|marquise|radiant|oval|pear|heart|square radiant)\b', user_query, re.IGNORECASE)
-    if shape_match:
-        constraints["Shape"] = shape_match.group(1).lower()
-
-    # Optional: Extract price ordering preferences if no explicit budget is provided
-    lower_query = user_query.lower()
-    if "Budget" not in constraints:
-        if any(keyword in lower_query for keyword in ["cheapest", "lowest price", "affordable", "low budget"]):
-            constraints["PriceOrder"] = "asc"
-        elif any(keyword in lower_query for keyword in ["most expensive", "highest price", "priciest", "expensive", "high budget"]):
-            constraints["PriceOrder"] = "desc"
-
-    return constraints
+# ------------------- Composite Ranking -------------------
+# Penalties added to the composite score when a row does not match a requested attribute
+MISMATCH_PENALTIES = [("Clarity", 50), ("Color", 50), ("Cut", 20), ("Symmetry", 20), ("Polish", 20)]
 
-# ------------------- Hybrid Search (Semantic + Filter + Composite Ranking) -------------------
-def hybrid_search(user_query, df, faiss_index, model, top_k=200):
+def composite_scores(row_ids, distances, constraints, attributes, median_carat=None):
     """
-    1. Extract constraints from the query.
-    2. Filter the DataFrame based on style, shape, clarity, budget, and quality attributes.
-    3. If Carat is specified, pre-filter for near-exact matches using a tolerance and perform a FAISS search.
-    4. Compute a composite score (if needed) and return the top 5 results.
+    Computes the composite score (lower is better) for the candidate rows in one pass:
+    FAISS distance plus carat, budget/price and attribute-mismatch penalties.
+    median_carat is only used when the query has no Carat constraint.
+    Returns a float64 array aligned with row_ids.
+    """
+    scores = np.asarray(distances, dtype='float64').copy()
+    carats = attributes.numbers["Carat"][row_ids]
+    if "Carat" in constraints:
+        scores += 1000 * np.abs(carats - constraints["Carat"])
+    else:
+        scores += 100 * np.abs(carats - median_carat)
+    prices = attributes.numbers["Price"][row_ids]
+    if "Budget" in constraints:
+        scores += 0.05 * np.abs(prices - constraints["Budget"])
+    else:
+        # Unparseable prices count as 0, as before
+        scores += 0.1 * np.where(np.isnan(prices), 0.0, prices)
+    for attr, penalty in MISMATCH_PENALTIES:
+        if attr in constraints:
+            matching = np.isin(attributes.codes[attr][row_ids], attributes.value_codes(attr, constraints[attr]))
+            scores += np.where(matching, 0.0, penalty)
+    return scores
+
+def top_k_positions(values, k):
     """
-    constraints = extract_constraints_from_query(user_query)
+    Positions of the k smallest values (of each row, for a 2-D array) in ascending order,
+    ties in their original order. Rows are FAISS results (a few hundred at most), so a
+    stable sort is cheap and, unlike argpartition, picks the same rows for any k.
+    """
+    return np.argsort(values, axis=-1, kind='stable')[..., :k]
+
+def ranked_positions(result_ids, column, ascending, attributes, k):
+    """
+    Positions of the k results (of each row) ranked first by a numeric column, looked up in
+    the precomputed rank permutation instead of sorting the values (ties keep catalog order).
+    """
+    return top_k_positions(attributes.ranks[(column, ascending)][result_ids], k)
 
+def order_results(result_ids, distances, ids, parsed_query, attributes, k=5):
+    """
+    Picks the top k of the FAISS results: by price or carat when the query asks for an
+    ordering, otherwise by composite score. result_ids and distances are (queries, results)
+    arrays; every row is ranked with parsed_query's constraints.
+    Returns the (queries, k) positions into the results and their composite scores
+    (None when ordered by price or carat).
+    """
+    constraints = parsed_query.constraints
+
+    # Global Price Ordering Block: Check for explicit price keywords or extracted PriceOrder.
+    if parsed_query.price_asc or ("PriceOrder" in constraints and constraints["PriceOrder"] == "asc"):
+        return ranked_positions(result_ids, "Price", True, attributes, k), None
+    elif parsed_query.price_desc or ("PriceOrder" in constraints and constraints["PriceOrder"] == "desc"):
+        return ranked_positions(result_ids, "Price", False, attributes, k), None
+
+    # Additional sorting for Carat if query mentions "highest", "largest", "maximum"
+    if parsed_query.carat_desc:
+        return ranked_positions(result_ids, "Carat", False, attributes, k), None
+    # Or if query mentions "minimum", "lowest", "smallest"
+    elif parsed_query.carat_asc:
+        return ranked_positions(result_ids, "Carat", True, attributes, k), None
+    else:
+        # Composite ranking if no explicit ordering keywords are detected
+        median_carat = None
+        if "Carat" not in constraints:
+            median_carat = np.nanmedian(attributes.numbers["Carat"] if ids is None else attributes.numbers["Carat"][ids])
+        scores = composite_scores(result_ids, distances, constraints, attributes, median_carat)
+        top = top_k_positions(scores, k)
+        return top, np.take_along_axis(scores, top, axis=-1)
+
+def results_frame(df, result_ids, distances, top, scores=None):
+    """The rows of df picked by order_results for one query, with their distance (and score)."""
+    results_df = df.iloc[result_ids[top]].copy()
+    results_df['distance'] = distances[top]
+    if scores is not None:
+        results_df['score'] = scores
+    return results_df.reset_index(drop=True)
+
+# ------------------- Candidate Filtering -------------------
+def filter_candidates(constraints, attributes, ids=None):
+    """
+    Resolves style, shape, clarity, budget, and quality attributes to candidate rows using
+    the attribute index, starting from `ids` (None means the whole catalog). Returns
+    (ids, message): the sorted positions into df (None for the whole catalog), or None and
+    the reason when nothing matches.
+    """
     # Restrict by Style if specified
     if "Style" in constraints:
-        style_val = constraints["Style"].lower()
-        df = df[df['Style'].str.lower().str.contains(style_val)]
-        if df.empty:
-            print("No diamonds found for the specified style.")
-            return pd.DataFrame()
-        
+        ids = attributes.match("Style", constraints["Style"], ids, exact=False)
+        if len(ids) == 0:
+            return None, "No diamonds found for the specified style."
+
     # Restrict by Shape if specified
     if "Shape" in constraints:
-        df = df[df["Shape"].str.lower().str.contains(constraints["Shape"].lower())]
-        if df.empty:
-            print(f"No {constraints['Shape']} diamonds found.")
-            return pd.DataFrame()
-        
+        ids = attributes.match("Shape", constraints["Shape"], ids, exact=False)
+        if len(ids) == 0:
+            return None, f"No {constraints['Shape']} diamonds found."
+
     # Filter by Clarity if specified (exact match)
     if "Clarity" in constraints:
-        clarity_regex = rf'^{re.escape(constraints["Clarity"].lower())}$'
-        df = df[df["Clarity"].str.lower().str.match(clarity_regex)]
-        if df.empty:
-            print(f"No diamonds found with clarity {constraints['Clarity']}.")
-            return pd.DataFrame()
+        ids = attributes.match("Clarity", constraints["Clarity"], ids)
+        if len(ids) == 0:
+            return None, f"No diamonds found with clarity {constraints['Clarity']}."
 
     # If Budget is specified, filter for diamonds under that price
     if "Budget" in constraints:
         user_budget = constraints["Budget"]
-        df = df[df["Price"] <= user_budget]
-        if df.empty:
-            print(f"No diamonds found under price {user_budget}.")
-            return pd.DataFrame()
-        
+        ids = attributes.between("Price", high=user_budget, ids=ids)
+        if len(ids) == 0:
+            return None, f"No diamonds found under price {user_budget}."
+
     # Strict filtering for quality attributes if 2 or more are specified
     quality_attrs = ["Cut", "Polish", "Symmetry"]
     specified_quality = [attr for attr in quality_attrs if attr in constraints]
     if len(specified_quality) >= 2:
         for attr in specified_quality:
-            df = df[df[attr].str.lower() == constraints[attr].lower()]
-        if df.empty:
-            print(f"No diamonds found that exactly match the specified {', '.join(specified_quality)} criteria.")
-            return pd.DataFrame()
+            ids = attributes.match(attr, constraints[attr], ids)
+        if len(ids) == 0:
+            return None, f"No diamonds found that exactly match the specified {', '.join(specified_quality)} criteria."
+    return ids, None
+
+def carat_tolerance(constraints):
+    """Half-width of the window around the requested Carat, based on style."""
+    return 0.01 if constraints.get("Style", "").lower() == "labgrown" else 0.05
+
+def carat_window(constraints, tolerance, ids, attributes):
+    """The filtered rows within tolerance of the requested Carat."""
+    return attributes.between("Carat", constraints["Carat"] - tolerance, constraints["Carat"] + tolerance, ids)
+
+def carat_candidates(constraints, ids, attributes):
+    """
+    Narrows the filtered rows to a window around the requested Carat (tolerance based on
+    style, doubled if the window is empty). Falls back to the filtered rows when nothing
+    falls inside it.
+    """
+    tolerance = carat_tolerance(constraints)
+    carat_ids = carat_window(constraints, tolerance, ids, attributes)
+    if len(carat_ids) == 0:
+        carat_ids = carat_window(constraints, tolerance * 2, ids, attributes)
+    return carat_ids if len(carat_ids) > 0 else ids
+
+def sort_filtered(ids, parsed_query, attributes, k=5):
+    """
+    Fallback ordering of the filtered rows when no Carat is specified: the row ids of the
+    top k, read from the attribute index's rank permutations rather than sorting the rows.
+    """
+    constraints = parsed_query.constraints
+    if "PriceOrder" in constraints and constraints["PriceOrder"] == "asc":
+        return attributes.top_k("Price", k, ids, ascending=True)
+    elif parsed_query.carat_asc:
+        return attributes.top_k("Carat", k, ids, ascending=True)
+    else:
+        return attributes.top_k("Price", k, ids, ascending=False)
+
+# ------------------- Hybrid Search (Semantic + Filter + Composite Ranking) -------------------
+def hybrid_search(user_query, df, faiss_index, model, top_k=200, parsed_query=None):
+    """
+    1. Extract constraints from the query (or use the already parsed_query).
+    2. Resolve style, shape, clarity, budget, and quality attributes to candidate rows using the attribute index.
+    3. If Carat is specified, pre-filter for near-exact matches using a tolerance and perform a FAISS search.
+    4. Compute a composite score (if needed) and return the top 5 results.
+    """
+    if parsed_query is None:
+        parsed_query = analyze_query(user_query)
+    constraints = parsed_query.constraints
+    attributes = faiss_index.attributes
+    filter_start = time.perf_counter()
+
+    # Candidate rows as sorted positions into df; None means the whole catalog
+    ids, message = filter_candidates(constraints, attributes)
+    if message is not None:
+        observe_stage("filter", time.perf_counter() - filter_start)
+        print(message)
+        return pd.DataFrame()
 
     # If Carat is not specified, use fallback sorting:
     if "Carat" not in constraints:
-        if "PriceOrder" in constraints and constraints["PriceOrder"] == "asc":
-            results_df = df.sort_values(by="Price", ascending=True)
-        elif any(word in user_query.lower() for word in ["minimum", "lowest", "smallest"]):
-            results_df = df.sort_values(by="Carat", ascending=True)
-        else:
-            results_df = df.sort_values(by="Price", ascending=False)
-        return results_df.head(5).reset_index(drop=True)
-
-    # If Carat is specified, set tolerance based on style
-    tolerance = 0.01 if constraints.get("Style", "").lower() == "labgrown" else 0.05
-    df_carat = df[
-        (df['Carat'] >= constraints["Carat"] - tolerance) &
-        (df['Carat'] <= constraints["Carat"] + tolerance)
-    ]
-    if df_carat.empty:
-        relaxed_tolerance = tolerance * 2
-        df_carat = df[
-            (df['Carat'] >= constraints["Carat"] - relaxed_tolerance) &
-            (df['Carat'] <= constraints["Carat"] + relaxed_tolerance)
-        ]
-    if not df_carat.empty:
-        subset_indices = df_carat.index.tolist()
-        all_embeddings = np.load(EMBEDDING_FILE_PATH)
-        subset_embeddings = all_embeddings[subset_indices]
-        temp_index = faiss.IndexFlatL2(all_embeddings.shape[1])
-        temp_index.add(subset_embeddings)
-        new_top_k = min(top_k, len(df_carat))
-        query_embedding = model.encode(user_query, convert_to_numpy=True)
-        D, I = temp_index.search(np.array([query_embedding]), new_top_k)
-        valid_indices = [i for i in I[0] if 0 <= i < len(df_carat)]
-        valid_D = D[0][:len(valid_indices)]
-        results_df = df_carat.iloc[valid_indices].copy()
-        results_df['distance'] = valid_D
-    else:
+        observe_stage("filter", time.perf_counter() - filter_start)
+        with span("rank"):
+            return df.iloc[sort_filtered(ids, parsed_query, attributes)].reset_index(drop=True)
+
+    # Search the persistent index restricted to the carat window (or to the filtered rows
+    # if nothing falls inside it); row ids are positions shared by df and the index.
+    candidate_ids = carat_candidates(constraints, ids, attributes)
+    observe_stage("filter", time.perf_counter() - filter_start)
+    with span("encode"):
         query_embedding = model.encode(user_query, convert_to_numpy=True)
-        new_top_k = min(top_k, df.shape[0])
-        D, I = faiss_index.search(np.array([query_embedding]), new_top_k)
-        valid_indices = [i for i in I[0] if 0 <= i < df.shape[0]]
-        valid_D = D[0][:len(valid_indices)]
-        results_df = df.iloc[valid_indices].copy()
-        results_df['distance'] = valid_D
+    new_top_k = min(top_k, df.shape[0] if candidate_ids is None else len(candidate_ids))
+    with span("faiss_search"):
+        D, I = faiss_index.search(np.array([query_embedding]), new_top_k, candidate_ids=candidate_ids)
+    found = I[0] >= 0
+    result_ids, distances = I[:, found], D[:, found]
 
-    # Global Price Ordering Block: Check for explicit price keywords or extracted PriceOrder.
-    if any(word in user_query.lower() for word in ["cheapest", "lowest price", "affordable", "low budget"]) or ("PriceOrder" in constraints and constraints["PriceOrder"] == "asc"):
-        results_df = results_df.sort_values(by='Price', ascending=True)
-        return results_df.head(5).reset_index(drop=True)
-    elif any(word in user_query.lower() for word in ["most expensive", "highest price", "priciest", "expensive", "high budget"]) or ("PriceOrder" in constraints and constraints["PriceOrder"] == "desc"):
-        results_df = results_df.sort_values(by='Price', ascending=False)
-        return results_df.head(5).reset_index(drop=True)
-
-    # Additional sorting for Carat if query mentions "highest", "largest", "maximum"
-    if any(word in user_query.lower() for word in ["highest", "largest", "maximum"]):
-        results_df = results_df.sort_values(by='Carat', ascending=False)
-        return results_df.head(5).reset_index(drop=True)
-    # Or if query mentions "minimum", "lowest", "smallest"
-    elif any(word in user_query.lower() for word in ["minimum", "lowest", "smallest"]):
-        results_df = results_df.sort_values(by='Carat', ascending=True)
-        return results_df.head(5).reset_index(drop=True)
-    else:
-        # Composite ranking if no explicit ordering keywords are detected
-        def compute_score(row, constraints, df_filtered):
-            score = row['distance']
-            if "Carat" in constraints:
-                score += 1000 * abs(row["Carat"] - constraints["Carat"])
-            else:
-                median_carat = df_filtered['Carat'].median()
-                score += 100 * abs(row["Carat"] - median_carat)
-            if "Budget" in constraints:
-                user_budget = constraints["Budget"]
-                score += 0.05 * abs(row["Price"] - user_budget)
-            else:
-                try:
-                    price = float(row["Price"])
-                except:
-                    price = 0
-                score += 0.1 * price
-            for attr, penalty in [("Clarity", 50), ("Color", 50)]:
-                if attr in constraints and row[attr].lower() != constraints[attr].lower():
-                    score += penalty
-            for attr, penalty in [("Cut", 20), ("Symmetry", 20), ("Polish", 20)]:
-                if attr in constraints and row[attr].lower() != constraints[attr].lower():
-                    score += penalty
-            return score
-
-        results_df['score'] = results_df.apply(lambda row: compute_score(row, constraints, df), axis=1)
-        results_df = results_df.sort_values(by='score', ascending=True)
-        return results_df.head(5).reset_index(drop=True)
-
-# ------------------- Groq Integration -------------------
-def generate_groq_response(user_query, relevant_data, client):
-    prompt = f"""
-You are a friendly and knowledgeable shop assistant at a diamond store.
-Your goal is to help the customer find diamonds that best match their query.
-
-First, write a brief introduction responding to the user's query, explaining what you found.
-Then, return a structured JSON array of the top diamonds that match their criteria.
-
-Here's the specific format to use:
-1. A brief introduction paragraph, one or two sentences.
-2. A special marker <diamond-data> followed by a valid JSON array of diamond objects.
-3. Close with </diamond-data>
-
-Example format:
-"I found several diamonds matching your criteria. Here are the best options:
-<diamond-data>
-[
-  {{
-    "Carat": 1.01,
-    "Clarity": "VS1",
-    "Color": "F",
-    "Cut": "Excellent",
-    "Shape": "Round",
-    "Price": "5000",
-    "Style": "Natural",
-    "Polish": "Excellent",
-    "Symmetry": "Excellent"
-  }},
-  ...more diamonds...
-]
-</diamond-data>"
-
-Below are some diamond details that might be relevant:
-{relevant_data}
-
-Parse this data and create a proper JSON response as described above.
-Ensure the JSON is valid and can be parsed by JavaScript's JSON.parse() function.
-"""
-    chat_completion = client.chat.completions.create(
-        messages=[{"role": "system", "content": prompt}],
-        model="llama-3.3-70b-versatile",
-        temperature=0.7,
-        max_tokens=750
-    )
-    return chat_completion.choices[0].message.content
+    with span("rank"):
+        top, scores = order_results(result_ids, distances, ids, parsed_query, attributes)
+        return results_frame(df, result_ids[0], distances[0], top[0], None if scores is None else scores[0])
 
 # ------------------- Main Chatbot Logic -------------------
-def diamond_chatbot(user_query, df, faiss_index, model, client):
+GREETING_REPLY = "Hey there! I'm your diamond guru 😎. Ready to help you find that perfect sparkle? Tell me what you're looking for!"
+NEEDS_DETAIL_REPLY = "Hello! I'm your diamond assistant. Please let me know your preferred carat, clarity, color, cut, or budget so I can help you find the perfect diamond."
+NO_MATCH_REPLY = "No matching diamonds found. Please try a different query."
+
+def diamond_search(user_query, df, faiss_index, model, parsed_query=None):
     """
-    Handles the chatbot's logic and returns the chatbot's response as a string.
+    Runs the search part of the chatbot. Returns (reply, top_5): either a canned reply
+    (greeting, not enough detail, no matches) and None, or None and the top 5 matching diamonds.
+    parsed_query can be passed in when the caller has already analysed the query.
     """
+    if parsed_query is None:
+        parsed_query = analyze_query(user_query)
+
     # Handle greetings
-    if user_query.strip().lower() in ["hi", "hello"]:
-        return "Hey there! I'm your diamond guru 😎. Ready to help you find that perfect sparkle? Tell me what you're looking for!"
+    if parsed_query.is_greeting:
+        SEARCH_OUTCOMES.inc("greeting")
+        return GREETING_REPLY, None
 
-    # Extract constraints from the user query
-    constraints = extract_constraints_from_query(user_query)
-    
     # Only fall back if there are no constraints AND no ordering keywords in the query.
-    if not constraints and not any(keyword in user_query.lower() for keyword in ["maximum", "minimum", "lowest", "highest", "largest", "smallest"]):
-        return "Hello! I'm your diamond assistant. Please let me know your preferred carat, clarity, color, cut, or budget so I can help you find the perfect diamond."
+    if not parsed_query.constraints and not parsed_query.has_carat_ordering:
+        SEARCH_OUTCOMES.inc("needs_detail")
+        return NEEDS_DETAIL_REPLY, None
 
     # Proceed with searching for diamonds
-    results_df = hybrid_search(user_query, df, faiss_index, model, top_k=200)
+    with span("search"):
+        results_df = hybrid_search(user_query, df, faiss_index, model, top_k=200, parsed_query=parsed_query)
     if results_df.empty:
-        return "No matching diamonds found. Please try a different query."
+        SEARCH_OUTCOMES.inc("empty")
+        return NO_MATCH_REPLY, None
 
     # Select top 5 matching diamonds
-    top_5 = results_df.head(5)
-    relevant_data = "\n".join(top_5['combined_text'].tolist())
+    SEARCH_OUTCOMES.inc("results")
+    return None, results_df.head(5)
+
+def diamond_chatbot(user_query, df, faiss_index, model, client, parsed_query=None):
+    """
+    Handles the chatbot's logic and returns the chatbot's response as a string.
+    """
+    reply, top_5 = diamond_search(user_query, df, faiss_index, model, parsed_query)
+    if reply is not None:
+        return reply
 
-    # Generate response using Groq AI
-    groq_response = generate_groq_response(user_query, relevant_data, client)
+    # Generate the introduction using Groq AI; the diamond data is rendered from the rows
+    introduction = generate_introduction(user_query, prompt_data(top_5), client)
 
-    return groq_response
+    return assemble_response(introduction, diamond_records(top_5))
 
+# ------------------- Batch Search -------------------
+# Queries searched together by batch_search, and LLM calls in flight in batch_chatbot
+BATCH_SEARCH_SIZE = 256
+BATCH_LLM_CONCURRENCY = 8
 
+def _search_key(parsed_query):
+    """Queries with equal keys get the same candidates and ranking; only their embeddings differ."""
+    return (tuple(sorted(parsed_query.constraints.items())), parsed_query.price_asc,
+            parsed_query.price_desc, parsed_query.carat_desc, parsed_query.carat_asc)
+
+def _search_outcome(results_df):
+    if results_df.empty:
+        return NO_MATCH_REPLY, None
+    return None, results_df.head(5)
+
+def _search_batch(user_queries, df, faiss_index, model, top_k):
+    """diamond_search over a list of queries; returns the (reply, top_5) pairs in order."""
+    attributes = faiss_index.attributes
+    outcomes = [None] * len(user_queries)
+
+    # Group the queries that need a search by constraints and ordering
+    groups = {}
+    for position, user_query in enumerate(user_queries):
+        parsed_query = analyze_query(user_query)
+        if parsed_query.is_greeting:
+            outcomes[position] = (GREETING_REPLY, None)
+        elif not parsed_query.constraints and not parsed_query.has_carat_ordering:
+            outcomes[position] = (NEEDS_DETAIL_REPLY, None)
+        else:
+            groups.setdefault(_search_key(parsed_query), (parsed_query, []))[1].append(position)
+
+    # Filter once per group; groups without a Carat constraint are answered by sorting alone
+    searches = []
+    with span("filter"):
+        for parsed_query, positions in groups.values():
+            constraints = parsed_query.constraints
+            ids, message = filter_candidates(constraints, attributes)
+            if message is not None:
+                outcome = (NO_MATCH_REPLY, None)
+            elif "Carat" not in constraints:
+                outcome = _search_outcome(df.iloc[sort_filtered(ids, parsed_query, attributes)].reset_index(drop=True))
+            else:
+                searches.append((parsed_query, positions, ids, carat_candidates(constraints, ids, attributes)))
+                continue
+            for position in positions:
+                outcomes[position] = outcome
+    if not searches:
+        return outcomes
+
+    # One encode call for the whole batch, then one multi-query FAISS search per group
+    with span("encode"):
+        texts = [user_queries[position] for _, positions, _, _ in searches for position in positions]
+        embeddings = np.asarray(model.encode(texts, convert_to_numpy=True), dtype='float32')
+    offset = 0
+    for parsed_query, positions, ids, candidate_ids in searches:
+        queries = embeddings[offset:offset + len(positions)]
+        offset += len(positions)
+        new_top_k = min(top_k, df.shape[0] if candidate_ids is None else len(candidate_ids))
+        with span("faiss_search"):
+            D, I = faiss_index.search(queries, new_top_k, candidate_ids=candidate_ids)
+        # Missing results (-1) come last; rank the rows with the same number found together
+        found = (I >= 0).sum(axis=1)
+        with span("rank"):
+            for count in np.unique(found):
+                rows = np.flatnonzero(found == count)
+                result_ids, distances = I[rows, :count], D[rows, :count]
+                top, scores = order_results(result_ids, distances, ids, parsed_query, attributes)
+                for j, row in enumerate(rows):
+                    results_df = results_frame(df, result_ids[j], distances[j], top[j], None if scores is None else scores[j])
+                    outcomes[positions[row]] = _search_outcome(results_df)
+    return outcomes
+
+def batch_search(user_queries, df, faiss_index, model, top_k=200, batch_size=BATCH_SEARCH_SIZE):
+    """
+    Batch counterpart of diamond_search for offline jobs: yields (user_query, reply, top_5)
+    for every query of the iterable, in order, with the same results as diamond_search.
+    Each batch_size queries are parsed, grouped by constraints (filtered once per group),
+    encoded in a single model.encode call and searched with one FAISS search per group.
+    """
+    user_queries = iter(user_queries)
+    while True:
+        batch = list(islice(user_queries, batch_size))
+        if not batch:
+            return
+        yield from ((user_query, *outcome) for user_query, outcome in zip(batch, _search_batch(batch, df, faiss_index, model, top_k)))
+
+def batch_chatbot(user_queries, df, faiss_index, model, client=None, batch_size=BATCH_SEARCH_SIZE,
+                  llm_concurrency=BATCH_LLM_CONCURRENCY, **llm_options):
+    """
+    Yields one JSON-serialisable record per query, in order: {"query", "reply"} for canned
+    replies, otherwise {"query", "diamonds"}. With a Groq client the "response" and
+    "expert_analysis" of generate_chat_response (given llm_options) are added, with up to
+    llm_concurrency queries in flight; without one the LLM is skipped.
+    """
+    def record(user_query, reply, top_5):
+        if reply is not None:
+            return {"query": user_query, "reply": reply}
+        result = {"query": user_query, "diamonds": diamond_records(top_5)}
+        if client is not None:
+            result["response"], result["expert_analysis"] = generate_chat_response(
+                user_query, top_5, client, constraints=analyze_query(user_query).constraints, **llm_options)
+        return result
+
+    results = batch_search(user_queries, df, faiss_index, model, batch_size=batch_size)
+    if client is None:
+        yield from (record(*result) for result in results)
+        return
+    with ThreadPoolExecutor(max_workers=llm_concurrency) as pool:
+        pending = deque()
+        for result in results:
+            pending.append(pool.submit(record, *result))
+            if len(pending) >= llm_concurrency:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
 def convert_markdown_to_html(text):
     # Replace markdown bold (text) with HTML <strong>text</strong>
@@ -378,6 +513,7 @@ def main():
     dataframe_file = 'diamond_dataframe.csv'
     model_path = 'sentence_transformer_model'
     file_path = 'diamonds.csv'
+    index_variant = os.getenv("INDEX_VARIANT", "flat")  # flat, fp16, sq8 or ivfpq (see index_variants.py)
 
     try:
         df, embeddings, index, model = load_data_and_index(embedding_file, faiss_index_file, dataframe_file, model_path)
@@ -385,7 +521,7 @@ def main():
     except Exception as e:
         print("Error loading existing data:", e)
         print("Running first-time data load and creating index...")
-        df, embeddings, index, model = data_and_embedding(file_path, embedding_file, faiss_index_file, dataframe_file, model_path)
+        df, embeddings, index, model = data_and_embedding(file_path, embedding_file, faiss_index_file, dataframe_file, model_path, index_variant=index_variant)
     
     # Conversation loop
     while True:
@@ -401,8 +537,7 @@ def main():
             print("\n---\n")
             continue
 
-        constraints = extract_constraints_from_query(user_query)
-        if "Style" not in constraints:
+        if "Style" not in analyze_query(user_query).constraints:
             style_input = input("Please specify the style (LabGrown or Natural): ")
             user_query += " " + style_input
         
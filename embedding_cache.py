@@ -0,0 +1,114 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from query_analysis import normalize_query
+
+
+# ------------------- Query Embedding Cache -------------------
+class EmbeddingCache:
+    """
+    Bounded, thread-safe LRU cache of query embeddings keyed by normalized query text.
+    Entries older than `ttl` seconds (if set) are treated as misses. When `path` is given
+    the cache is loaded from it on creation and can be written back with save(), so a
+    restarted process comes back warm.
+    """
+
+    def __init__(self, maxsize=10000, ttl=None, path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (embedding, stored_at)
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                self.load(path)
+            except Exception as e:
+                print(f"Error loading embedding cache from {path}: {e}")
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expired(self, stored_at, now):
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry[1], time.time()):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, embedding, stored_at=None):
+        embedding = np.array(embedding, dtype='float32')
+        embedding.setflags(write=False)
+        with self._lock:
+            self._entries[key] = (embedding, time.time() if stored_at is None else stored_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def save(self, path=None):
+        """
+        Write the live entries to an .npz file, atomically via a temporary file of this
+        process (every gunicorn worker saves its own cache to the same path at exit).
+        """
+        path = path or self.path
+        if not path:
+            return
+        now = time.time()
+        with self._lock:
+            items = [(k, v, t) for k, (v, t) in self._entries.items() if not self._expired(t, now)]
+        if not items:
+            return
+        keys, vectors, stored_at = zip(*items)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, keys=np.array(keys), vectors=np.stack(vectors), stored_at=np.array(stored_at))
+        os.replace(tmp_path, path)
+        print(f"Saved {len(items)} cached query embeddings to {path}")
+
+    def load(self, path):
+        with np.load(path) as data:
+            for key, vector, stored_at in zip(data["keys"], data["vectors"], data["stored_at"]):
+                if not self._expired(float(stored_at), time.time()):
+                    self.put(str(key), vector, stored_at=float(stored_at))
+        print(f"Loaded {len(self)} cached query embeddings from {path}")
+
+
+class CachedEncoder:
+    """
+    Drop-in wrapper around a SentenceTransformer: single-query encode() calls are served
+    from an EmbeddingCache, batch calls go straight to the model.
+    """
+
+    def __init__(self, model, cache):
+        self.model = model
+        self.cache = cache
+
+    def encode(self, sentences, convert_to_numpy=True, **kwargs):
+        if not isinstance(sentences, str):
+            return self.model.encode(sentences, convert_to_numpy=convert_to_numpy, **kwargs)
+        key = normalize_query(sentences)
+        embedding = self.cache.get(key)
+        if embedding is None:
+            embedding = self.model.encode(sentences, convert_to_numpy=True, **kwargs)
+            self.cache.put(key, embedding)
+        return embedding
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
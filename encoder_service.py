@@ -0,0 +1,81 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+
+# ------------------- Micro-batching Query Encoder -------------------
+class BatchingEncoder:
+    """
+    Coalesces concurrent single-query encode() calls into batched model.encode() calls.
+    Callers submit their text and wait on a future; a background worker flushes a batch
+    once it holds `max_batch_size` queries or the oldest query has waited `max_wait_ms`.
+    List inputs (bulk encoding) bypass the queue and go straight to the model.
+    """
+
+    def __init__(self, model, max_batch_size=16, max_wait_ms=5.0):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.encoded = 0
+        self._lock = threading.Lock()
+        self._queue = None
+        self._worker = None
+        self._pid = None
+
+    def encode(self, sentences, convert_to_numpy=True, **kwargs):
+        if not isinstance(sentences, str) or kwargs:
+            return self.model.encode(sentences, convert_to_numpy=convert_to_numpy, **kwargs)
+        future = Future()
+        self._ensure_worker().put((sentences, future))
+        return future.result()
+
+    def _ensure_worker(self):
+        # The worker is started lazily, and restarted in a forked child (threads do not
+        # survive fork), so the encoder can be created before a pre-fork server starts.
+        if self._pid == os.getpid() and self._worker.is_alive():
+            return self._queue
+        with self._lock:
+            if self._pid != os.getpid() or not self._worker.is_alive():
+                self._queue = queue.Queue()
+                self._worker = threading.Thread(target=self._run, args=(self._queue,), name="batching-encoder", daemon=True)
+                self._worker.start()
+                self._pid = os.getpid()
+        return self._queue
+
+    def _run(self, requests):
+        while True:
+            batch = [requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = self.model.encode(texts, convert_to_numpy=True, batch_size=len(texts))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.encoded += len(batch)
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "encoded": self.encoded,
+            "mean_batch_size": self.encoded / self.batches if self.batches else 0.0,
+        }
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
@@ -0,0 +1,40 @@
+import os
+import gc
+import multiprocessing
+
+# Production entry point: `gunicorn app:app` (this file is picked up automatically).
+#
+# The app is preloaded: the master process loads the catalog, embeddings, FAISS index and
+# SentenceTransformer once, then forks the workers, which share those pages copy-on-write
+# (the snapshot embeddings and index are memory-mapped, so they are shared through the
+# page cache as well). Memory per extra worker stays roughly flat.
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5505")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_class = "gthread"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+preload_app = True
+
+# Threads do not survive fork, so the catalog has to be loaded before the workers start
+os.environ.setdefault("CATALOG_LOAD", "eager")
+
+# Each worker already runs on its own core; keep torch/FAISS from starting a thread per
+# core in every worker
+WORKER_COMPUTE_THREADS = int(os.getenv("WORKER_COMPUTE_THREADS", "1"))
+
+
+def when_ready(server):
+    # Move everything loaded so far out of the garbage collector's reach, so collections
+    # in the workers do not write to (and un-share) the preloaded objects
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import faiss
+    faiss.omp_set_num_threads(WORKER_COMPUTE_THREADS)
+    try:
+        import torch
+        torch.set_num_threads(WORKER_COMPUTE_THREADS)
+    except ImportError:
+        pass
@@ -0,0 +1,149 @@
+import sys
+import json
+import math
+import time
+
+import numpy as np
+import faiss
+
+from search_index import DiamondSearchIndex
+from catalog_snapshot import build_combined_text
+
+# Index representations selectable at build time (data_and_embedding(index_variant=...)):
+#   flat   exact float32 vectors (IndexFlatL2), ~3 KB per 768-dim stone
+#   fp16   float16 scalar quantizer, half the memory, near-exact
+#   sq8    8-bit scalar quantizer, a quarter of the memory
+#   ivfpq  inverted lists over product-quantized codes, tens of bytes per stone
+INDEX_VARIANTS = ["flat", "fp16", "sq8", "ivfpq"]
+
+# IVF-PQ parameters: subquantizers (must divide the dimension), bits per code, lists probed
+PQ_SUBQUANTIZERS = 48
+PQ_BITS = 8
+DEFAULT_NPROBE = 16
+
+# Compressed variants fetch RERANK_FACTOR * k neighbours and re-rank them exactly
+RERANK_FACTOR = 4
+
+REPORT_K = 10
+REPORT_QUERIES = 200
+REPORT_FILE = 'index_report.json'
+
+
+# ------------------- Index Construction -------------------
+def default_nlist(n):
+    """About 4 * sqrt(n) inverted lists, with enough training points (39) per list."""
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+def build_index(embeddings, variant="flat", nlist=None, pq_m=PQ_SUBQUANTIZERS, nbits=PQ_BITS):
+    """Build (and train, where needed) a FAISS index of the given variant over the embeddings."""
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    d = embeddings.shape[1]
+    if variant == "flat":
+        index = faiss.IndexFlatL2(d)
+    elif variant == "fp16":
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    elif variant == "sq8":
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+    elif variant == "ivfpq":
+        quantizer = faiss.IndexFlatL2(d)
+        index = faiss.IndexIVFPQ(quantizer, d, nlist or default_nlist(len(embeddings)), math.gcd(d, pq_m), nbits)
+    else:
+        raise ValueError(f"Unknown index variant {variant!r}; expected one of {INDEX_VARIANTS}")
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+    return index
+
+def index_variant_of(faiss_index):
+    """The INDEX_VARIANTS name of an index built by build_index()."""
+    if faiss.try_extract_index_ivf(faiss_index) is not None:
+        return "ivfpq"
+    if isinstance(faiss_index, faiss.IndexScalarQuantizer):
+        return "fp16" if faiss_index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "flat"
+
+def search_options(variant, rerank=None):
+    """DiamondSearchIndex options (stored in the snapshot manifest) for a variant."""
+    if variant == "flat":
+        return {"rerank": 1, "nprobe": None}
+    return {
+        "rerank": RERANK_FACTOR if rerank is None else rerank,
+        "nprobe": DEFAULT_NPROBE if variant == "ivfpq" else None,
+    }
+
+def embedding_dtype(variant):
+    """Stored embeddings (used for re-ranking) are float16 for every compressed variant."""
+    return 'float32' if variant == "flat" else 'float16'
+
+def index_bytes(faiss_index):
+    return len(faiss.serialize_index(faiss_index))
+
+# ------------------- Recall / Memory / Latency Report -------------------
+def report_queries(df, n=REPORT_QUERIES, seed=0):
+    """
+    Query-like texts for the report: the leading attributes (Style, Carat, Clarity, Color)
+    of randomly sampled stones, the way customers describe what they want.
+    """
+    sample = build_combined_text(df.sample(min(n, len(df)), random_state=seed))
+    return [", ".join(text.split(", ")[:4]) for text in sample]
+
+def index_report(df, embeddings, query_embeddings, variants=INDEX_VARIANTS, k=REPORT_K):
+    """
+    Compare each variant, without and with exact re-ranking, against the flat baseline:
+    recall@k of the exact top-k, resident index size, and single-query latency.
+    Returns a list of dicts, one per configuration.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    query_embeddings = np.ascontiguousarray(query_embeddings, dtype='float32')
+    _, truth = build_index(embeddings, "flat").search(query_embeddings, k)
+
+    rows = []
+    for variant in variants:
+        start = time.perf_counter()
+        index = build_index(embeddings, variant)
+        build_seconds = time.perf_counter() - start
+        stored = embeddings.astype(embedding_dtype(variant))
+        for rerank in sorted({1, search_options(variant)["rerank"]}):
+            options = search_options(variant, rerank)
+            search_index = DiamondSearchIndex(df, index, stored, **options)
+            latencies, hits = [], 0
+            for query, expected in zip(query_embeddings, truth):
+                start = time.perf_counter()
+                _, found = search_index.search(query[None], k)
+                latencies.append((time.perf_counter() - start) * 1000)
+                hits += len(np.intersect1d(found[0], expected))
+            size = index_bytes(index)
+            rows.append({
+                "variant": variant,
+                **options,
+                f"recall@{k}": round(hits / truth.size, 4),
+                "index_bytes": size,
+                "bytes_per_vector": round(size / len(embeddings), 1),
+                "rerank_embedding_bytes": stored.nbytes if rerank > 1 else 0,
+                "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+                "build_seconds": round(build_seconds, 2),
+            })
+    return rows
+
+def print_report(rows, k=REPORT_K):
+    print(f"{'variant':<8} {'rerank':>6} {f'recall@{k}':>10} {'bytes/vec':>10} {'index MB':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for row in rows:
+        print(f"{row['variant']:<8} {row['rerank']:>6} {row[f'recall@{k}']:>10.4f} {row['bytes_per_vector']:>10.1f} "
+              f"{row['index_bytes'] / 2 ** 20:>9.2f} {row['p50_ms']:>8.3f} {row['p95_ms']:>8.3f}")
+
+def write_report(df, embeddings, model, path=REPORT_FILE, variants=INDEX_VARIANTS):
+    """Run index_report on query-like texts encoded with the model; print it and save it as JSON."""
+    query_embeddings = model.encode(report_queries(df), convert_to_numpy=True)
+    rows = index_report(df, embeddings, query_embeddings, variants)
+    print_report(rows)
+    with open(path, 'w') as f:
+        json.dump(rows, f, indent=2)
+    print(f"Index report written to {path}")
+    return rows
+
+if __name__ == '__main__':
+    # Usage: python index_variants.py  (reports on the current catalog, e.g. before a rebuild)
+    from chatbot import load_catalog, load_model
+    df, embeddings, _ = load_catalog('diamond_embeddings.npy', 'diamond_faiss_index.faiss', 'diamond_dataframe.csv')
+    write_report(df, embeddings, load_model(sys.argv[1] if len(sys.argv) > 1 else 'sentence_transformer_model'))
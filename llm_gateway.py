@@ -0,0 +1,236 @@
+import time
+import random
+import threading
+import types
+
+import httpx
+import groq
+
+from metrics import LLM_CALLS
+
+# Upstream failures worth another attempt (connection problems, timeouts, 429 and 5xx)
+RETRYABLE_ERRORS = (groq.APIConnectionError, groq.RateLimitError, groq.InternalServerError,
+                    ConnectionError, TimeoutError)
+
+
+class LLMUnavailable(Exception):
+    """The gateway did not send the call: circuit open, queue full, or deadline passed."""
+
+
+def pooled_groq_client(max_connections=32, keepalive_expiry=30.0):
+    """
+    Groq client over a keep-alive connection pool. SDK retries are off; the gateway
+    retries within the call's deadline instead.
+    """
+    http_client = httpx.Client(limits=httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=keepalive_expiry,
+    ))
+    return groq.Groq(http_client=http_client, max_retries=0)
+
+
+# ------------------- Circuit Breaker -------------------
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failed calls; while open, calls are refused for
+    `reset_timeout` seconds, then a single trial call is let through (half-open) and its
+    outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failures=5, reset_timeout=30.0):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self._consecutive = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow(self):
+        """Whether a call may go ahead; "trial" for the single call let through half-open."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_running or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial_running = True
+            return "trial"
+
+    def abandon_trial(self):
+        """The trial call was not made after all (rejected, or its stream dropped)."""
+        with self._lock:
+            self._trial_running = False
+
+    def record(self, success):
+        with self._lock:
+            self._trial_running = False
+            if success:
+                self._consecutive = 0
+                self._opened_at = None
+                return
+            self._consecutive += 1
+            if self._opened_at is not None or self._consecutive >= self.failures:
+                if self._opened_at is None:
+                    print(f"LLM circuit opened after {self._consecutive} consecutive failures")
+                self._opened_at = time.monotonic()
+
+
+# ------------------- Gateway -------------------
+class LLMGateway:
+    """
+    Wraps a Groq client (same chat.completions.create interface) with:
+      - a per-call deadline (`timeout`, or the create(timeout=...) of the caller) covering
+        queueing, every attempt and the backoff between them;
+      - at most `max_in_flight` concurrent calls; up to `max_queue` more wait for a slot
+        (no longer than `queue_timeout`), beyond that calls are rejected right away;
+      - `retries` extra attempts on retryable errors, after a full-jitter exponential
+        backoff starting at `backoff` seconds (streams are only retried before the first chunk);
+      - a CircuitBreaker that refuses calls while the upstream keeps failing.
+    Refused calls raise LLMUnavailable; callers fall back to templated text.
+    """
+
+    def __init__(self, client, timeout=30.0, max_in_flight=32, max_queue=64, queue_timeout=2.0,
+                 retries=2, backoff=0.25, breaker=None):
+        self.client = client
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.in_flight = 0
+        self.queued = 0
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self.chat = types.SimpleNamespace(completions=self)
+
+    # Admission
+    def _acquire(self, deadline):
+        """Wait for a slot; returns the breaker's allow() for this call."""
+        allowed = self.breaker.allow()
+        if not allowed:
+            LLM_CALLS.inc("circuit_open")
+            raise LLMUnavailable("LLM circuit is open")
+        # Only calls that find every slot taken count against max_queue
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                queue_full = self.queued >= self.max_queue
+                if not queue_full:
+                    self.queued += 1
+            if queue_full:
+                self._reject(allowed, "LLM queue is full")
+            try:
+                wait = min(self.queue_timeout, deadline - time.monotonic())
+                acquired = wait > 0 and self._slots.acquire(timeout=wait)
+            finally:
+                with self._lock:
+                    self.queued -= 1
+            if not acquired:
+                self._reject(allowed, "Timed out waiting for an LLM slot")
+        with self._lock:
+            self.in_flight += 1
+        return allowed
+
+    def _reject(self, allowed, reason):
+        if allowed == "trial":
+            self.breaker.abandon_trial()
+        LLM_CALLS.inc("rejected")
+        raise LLMUnavailable(reason)
+
+    def _release(self, allowed, recorded):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+        if allowed == "trial" and not recorded:
+            self.breaker.abandon_trial()
+
+    def _record(self, success, outcome):
+        self.breaker.record(success)
+        LLM_CALLS.inc(outcome)
+
+    def _backoff(self, attempt, deadline):
+        """Sleep before the next attempt; False when it would not fit in the deadline."""
+        delay = random.uniform(0, self.backoff * 2 ** attempt)
+        if time.monotonic() + delay >= deadline:
+            return False
+        time.sleep(delay)
+        return True
+
+    # chat.completions.create
+    def create(self, timeout=None, stream=False, **kwargs):
+        deadline = time.monotonic() + (timeout or self.timeout)
+        if stream:
+            return self._stream(deadline, kwargs)
+        allowed = self._acquire(deadline)
+        recorded = False
+        try:
+            for attempt in range(self.retries + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    completion = self.client.chat.completions.create(timeout=remaining, **kwargs)
+                except RETRYABLE_ERRORS as e:
+                    print(f"LLM call failed (attempt {attempt + 1}): {e}")
+                    if attempt == self.retries or not self._backoff(attempt, deadline):
+                        recorded = True
+                        self._record(False, "error")
+                        raise
+                    LLM_CALLS.inc("retry")
+                    continue
+                except Exception:
+                    recorded = True
+                    self._record(False, "error")
+                    raise
+                recorded = True
+                self._record(True, "ok")
+                return completion
+            recorded = True
+            self._record(False, "timeout")
+            raise LLMUnavailable("LLM deadline exceeded")
+        finally:
+            self._release(allowed, recorded)
+
+    def _stream(self, deadline, kwargs):
+        allowed = self._acquire(deadline)
+        recorded = False
+        try:
+            for attempt in range(self.retries + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                started = False
+                try:
+                    for chunk in self.client.chat.completions.create(timeout=remaining, stream=True, **kwargs):
+                        started = True
+                        yield chunk
+                        if time.monotonic() > deadline:
+                            recorded = True
+                            self._record(False, "timeout")
+                            raise LLMUnavailable("LLM deadline exceeded mid-stream")
+                except RETRYABLE_ERRORS as e:
+                    print(f"LLM stream failed (attempt {attempt + 1}): {e}")
+                    if started or attempt == self.retries or not self._backoff(attempt, deadline):
+                        recorded = True
+                        self._record(False, "error")
+                        raise
+                    LLM_CALLS.inc("retry")
+                    continue
+                except LLMUnavailable:
+                    raise
+                except Exception:
+                    recorded = True
+                    self._record(False, "error")
+                    raise
+                recorded = True
+                self._record(True, "ok")
+                return
+            recorded = True
+            self._record(False, "timeout")
+            raise LLMUnavailable("LLM deadline exceeded")
+        finally:
+            self._release(allowed, recorded)
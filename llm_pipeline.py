@@ -0,0 +1,377 @@
+import re
+import json
+import math
+import time
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from response_cache import make_cache_key
+from metrics import span, submit, LLM_CALLS, LLM_FALLBACKS
+from llm_gateway import LLMUnavailable
+from catalog_snapshot import build_combined_text
+
+# Groq model used for all completions
+LLM_MODEL = "llama-3.3-70b-versatile"
+
+# Bump whenever a prompt changes so cached completions from older prompts are not reused
+PROMPT_VERSION = 2
+
+# Attributes rendered into <diamond-data> (and passed to the expert analysis) for each diamond
+DIAMOND_FIELDS = ["Carat", "Clarity", "Color", "Cut", "Shape", "Price", "Style", "Polish", "Symmetry"]
+NUMERIC_FIELDS = {"Carat", "Price"}
+UPPERCASE_FIELDS = {"Clarity", "Color"}
+DISPLAY_VALUES = {"labgrown": "Lab Grown"}
+
+EXPERT_ANALYSIS_FALLBACK = "These diamonds match your criteria and offer excellent value. Consider factors like cut quality and color which significantly impact a diamond's brilliance."
+
+# Shared pool for issuing the completions of a request concurrently, with a thread for every
+# call the LLM gateway may run or queue (see configure_executor)
+LLM_THREADS = 16
+_executor = ThreadPoolExecutor(max_workers=LLM_THREADS, thread_name_prefix="llm")
+_threads = threading.BoundedSemaphore(LLM_THREADS)
+
+def configure_executor(threads):
+    """
+    Size the LLM pool for `threads` concurrent calls: the gateway's max_in_flight + max_queue,
+    so calls are admitted, queued and refused by the gateway's limits rather than waiting
+    for a thread of a smaller pool.
+    """
+    global _executor, _threads
+    _executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="llm")
+    _threads = threading.BoundedSemaphore(threads)
+
+def _submit(fn, timeout=None):
+    """
+    Run fn(remaining) on the LLM pool, where remaining is what is left of the caller's
+    `timeout` when it starts (None without one), and return its Future. A call is only
+    submitted when a thread is free for it, so nothing waits in the pool's queue: otherwise
+    the Future fails at once with LLMUnavailable. A call whose caller has already fallen
+    back is skipped the same way.
+    """
+    threads = _threads
+    if not threads.acquire(blocking=False):
+        LLM_CALLS.inc("rejected")
+        future = Future()
+        future.set_exception(LLMUnavailable("No LLM thread free"))
+        return future
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    def run():
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            raise LLMUnavailable("Caller already fell back")
+        return fn(remaining)
+
+    future = submit(_executor, run)
+    future.add_done_callback(lambda _: threads.release())
+    return future
+
+# ------------------- Diamond Data Rendering -------------------
+def _display_value(field, value):
+    if field in NUMERIC_FIELDS:
+        value = float(value)
+        return None if math.isnan(value) else value
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    value = str(value)
+    if field in UPPERCASE_FIELDS:
+        return value.upper()
+    return DISPLAY_VALUES.get(value, value.title())
+
+def diamond_records(top_5):
+    """
+    Top diamonds as a list of dicts with stable field names and display casing
+    (e.g. {"Carat": 1.01, "Clarity": "VS1", "Cut": "Excellent", ...}).
+    """
+    columns = {field: top_5[field].tolist() for field in DIAMOND_FIELDS}
+    return [
+        {field: _display_value(field, columns[field][i]) for field in DIAMOND_FIELDS}
+        for i in range(len(top_5))
+    ]
+
+def prompt_data(top_5):
+    """The combined_text lines of the top diamonds, as given to the LLM."""
+    return "\n".join(build_combined_text(top_5).tolist())
+
+def render_diamond_data(records):
+    """Serialize diamond records to compact JSON for the <diamond-data> block."""
+    return json.dumps(records, separators=(",", ":"), ensure_ascii=False, allow_nan=False)
+
+def assemble_response(introduction, records):
+    """
+    Build the chat response: the LLM-written introduction followed by the diamond data,
+    which is serialized here rather than regenerated by the LLM.
+    """
+    return f"{introduction.strip()}\n<diamond-data>\n{render_diamond_data(records)}\n</diamond-data>"
+
+# ------------------- Templated Fallbacks -------------------
+# Data-only texts used when a completion fails, times out, or the LLM gateway refuses the call
+def templated_introduction(records):
+    text = f"Here {'is' if len(records) == 1 else 'are'} {len(records)} diamond{'' if len(records) == 1 else 's'} matching your search"
+    carats = [record["Carat"] for record in records if record["Carat"] is not None]
+    prices = [record["Price"] for record in records if record["Price"] is not None]
+    if carats:
+        text += f", {min(carats):g} carat" if min(carats) == max(carats) else f", from {min(carats):g} to {max(carats):g} carat"
+    if prices:
+        text += f", priced at ${min(prices):,.0f}" if min(prices) == max(prices) else f", priced from ${min(prices):,.0f} to ${max(prices):,.0f}"
+    return text + "."
+
+def templated_analysis(records):
+    best = records[0]
+    attributes = ", ".join(f"{field}: {best[field]}" for field in ["Carat", "Clarity", "Color", "Cut"] if best[field] is not None)
+    price = f" at ${best['Price']:,.0f}" if best["Price"] is not None else ""
+    return f"The top match is a {best['Style']} {best['Shape']} diamond ({attributes}){price}. {EXPERT_ANALYSIS_FALLBACK}"
+
+def _fallback_reason(error):
+    if isinstance(error, FutureTimeoutError):
+        return "timeout"
+    if isinstance(error, LLMUnavailable):
+        return "unavailable"
+    return "error"
+
+def _result_or_fallback(future, timeout, text, fallback):
+    """The completion of `future`, or `fallback` (counted by reason) if it failed or ran out of time."""
+    try:
+        return future.result(timeout=timeout)
+    except Exception as e:
+        print(f"Error generating {text}: {e!r}")
+        LLM_FALLBACKS.inc(text, _fallback_reason(e))
+        return fallback
+
+# ------------------- Prompts -------------------
+def build_introduction_prompt(user_query, relevant_data, with_analysis=False):
+    analysis_instructions = ""
+    if with_analysis:
+        analysis_instructions = """
+After the introduction, add a 2-3 line expert recommendation between <expert-analysis> and
+</expert-analysis>. Highlight the important attributes such as Carat, Clarity, Color, Cut, etc.
+and what makes these particular diamonds a good match for the customer's needs.
+Be concise but insightful.
+"""
+    return f"""
+You are a friendly and knowledgeable shop assistant at a diamond store.
+Your goal is to help the customer find diamonds that best match their query.
+
+Write a brief introduction (one or two sentences) responding to the user's query and
+explaining what you found. The diamonds themselves are shown to the customer separately,
+so do not list them or output any JSON.
+{analysis_instructions}
+User Query: {user_query}
+
+Diamonds found:
+{relevant_data}
+"""
+
+def build_expert_analysis_prompt(user_query, diamond_data):
+    diamond_str = "\n".join([str(diamond) for diamond in diamond_data])
+    return f"""
+    You are a diamond expert with years of experience in the industry.
+    Based on the user query and the diamonds found, provide a brief 2-3 line expert recommendation.
+    Please highlight the important attributes such as Carat, Clarity, Color, Cut, etc.
+    Focus on what makes these particular diamonds a good match for the customer's needs.
+    Be concise but insightful.
+
+    User Query: {user_query}
+
+    Diamonds Found:
+    {diamond_str}
+
+    Your expert analysis (2-3 lines only):
+    """
+
+# ------------------- Groq Completions -------------------
+def _complete(client, prompt, max_tokens, timeout=None):
+    kwargs = {"timeout": timeout} if timeout else {}
+    chat_completion = client.chat.completions.create(
+        messages=[{"role": "system", "content": prompt}],
+        model=LLM_MODEL,
+        temperature=0.7,
+        max_tokens=max_tokens,
+        **kwargs
+    )
+    return chat_completion.choices[0].message.content
+
+def _stream(client, prompt, max_tokens, timeout=None):
+    """Yield the completion text in pieces as Groq produces them."""
+    kwargs = {"timeout": timeout} if timeout else {}
+    stream = client.chat.completions.create(
+        messages=[{"role": "system", "content": prompt}],
+        model=LLM_MODEL,
+        temperature=0.7,
+        max_tokens=max_tokens,
+        stream=True,
+        **kwargs
+    )
+    for chunk in stream:
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+def generate_introduction(user_query, relevant_data, client, timeout=None):
+    """
+    Ask Groq for the short introduction to the diamonds found.
+    """
+    with span("llm_introduction"):
+        return _complete(client, build_introduction_prompt(user_query, relevant_data), 120, timeout)
+
+def generate_expert_analysis(user_query, diamond_data, client, timeout=None):
+    """
+    Generate expert analysis using Groq. Errors propagate; callers fall back to
+    templated_analysis().
+    """
+    with span("llm_analysis"):
+        return _complete(client, build_expert_analysis_prompt(user_query, diamond_data), 150, timeout)
+
+def generate_combined_response(user_query, relevant_data, client, timeout=None):
+    """
+    Single-call mode: one completion returns the introduction and the expert analysis.
+    Returns [introduction, expert_analysis]; the analysis is None if the model left it out.
+    """
+    prompt = build_introduction_prompt(user_query, relevant_data, with_analysis=True)
+    with span("llm_combined"):
+        text = _complete(client, prompt, 270, timeout)
+    analysis_match = re.search(r'<expert-analysis>([\s\S]*?)</expert-analysis>', text)
+    if not analysis_match:
+        return [text, None]
+    introduction = text[:analysis_match.start()] + text[analysis_match.end():]
+    return [introduction, analysis_match.group(1).strip()]
+
+# ------------------- Response Pipeline -------------------
+def response_cache_key(kind, records, constraints):
+    """
+    Cache key for a completion: prompt version, completion kind, the result set and the
+    normalized constraints. Rows are identified by their rendered content (row positions
+    are not stable across catalog reloads) and sorted, so any phrasing that resolves to
+    the same stones and constraints shares the entry.
+    """
+    rows = sorted(render_diamond_data([record]) for record in records)
+    return make_cache_key(PROMPT_VERSION, kind, rows, sorted((constraints or {}).items()))
+
+def generate_chat_response(user_query, top_5, client, mode="concurrent", timeout=None, cache=None, constraints=None):
+    """
+    Produce the chat response and expert analysis for the top diamonds from hybrid_search.
+    The <diamond-data> block is rendered from the rows; the LLM only writes the
+    introduction and the analysis. Both depend only on these rows, so in "concurrent"
+    mode they are requested in parallel (each bounded by `timeout` seconds); "single"
+    mode asks for both in one call. Completions are looked up in `cache` (a
+    ResponseCache) first when one is given. A completion that fails or times out is
+    replaced by templated text built from the rows, so the response never waits on the
+    LLM for more than `timeout`. Returns (response, expert_analysis).
+    """
+    relevant_data = prompt_data(top_5)
+    records = diamond_records(top_5)
+
+    def cached(kind, compute):
+        """compute(remaining) through the cache, as a function of the time remaining."""
+        if cache is None:
+            return compute
+        key = response_cache_key(kind, records, constraints)
+        return lambda remaining: cache.get_or_compute(key, lambda: compute(remaining))
+
+    if mode == "single":
+        combined_future = _submit(cached("combined", lambda remaining: generate_combined_response(
+            user_query, relevant_data, client, remaining)), timeout)
+        introduction, expert_analysis = _result_or_fallback(
+            combined_future, timeout, "introduction", [templated_introduction(records), templated_analysis(records)])
+        if not expert_analysis:
+            LLM_FALLBACKS.inc("analysis", "missing")
+            expert_analysis = templated_analysis(records)
+        return assemble_response(introduction, records), expert_analysis
+
+    introduction_future = _submit(cached("introduction", lambda remaining: generate_introduction(
+        user_query, relevant_data, client, remaining)), timeout)
+    analysis_future = _submit(cached("analysis", lambda remaining: generate_expert_analysis(
+        user_query, records, client, remaining)), timeout)
+    introduction = _result_or_fallback(introduction_future, timeout, "introduction", templated_introduction(records))
+    expert_analysis = _result_or_fallback(analysis_future, timeout, "analysis", templated_analysis(records))
+    return assemble_response(introduction, records), expert_analysis
+
+def stream_chat_response(user_query, top_5, client, timeout=None, cache=None, constraints=None):
+    """
+    Streaming counterpart of generate_chat_response. Yields (event, payload) pairs:
+    ("results", records) right away, then ("introduction", text) and ("analysis", text)
+    pieces as the two concurrent completions produce them, and finally
+    ("done", {"response": ..., "expert_analysis": ...}) with the complete texts.
+    Cached completions are sent as a single piece and shared with generate_chat_response.
+    A failed introduction that has not started is sent as templated text instead, a
+    failed analysis is replaced by templated text in the "done" event. Completions still
+    running after `timeout` seconds fail the same way.
+    """
+    relevant_data = prompt_data(top_5)
+    records = diamond_records(top_5)
+    yield "results", records
+
+    pieces = queue.Queue()  # (kind, text, error); text and error both None marks the end
+
+    def produce(kind, prompt, max_tokens, remaining):
+        key = response_cache_key(kind, records, constraints) if cache is not None else None
+        try:
+            text = cache.get(key) if key else None
+            if text is not None:
+                pieces.put((kind, text, None))
+            else:
+                parts = []
+                with span(f"llm_{kind}"):
+                    for delta in _stream(client, prompt, max_tokens, remaining):
+                        parts.append(delta)
+                        pieces.put((kind, delta, None))
+                if key:
+                    cache.put(key, "".join(parts))
+        except Exception as e:
+            pieces.put((kind, None, e))
+        finally:
+            pieces.put((kind, None, None))
+
+    def refused(kind):
+        """Ends `kind` with the error when _submit did not run it (produce itself never raises)."""
+        def done(future):
+            if future.exception() is not None:
+                pieces.put((kind, None, future.exception()))
+                pieces.put((kind, None, None))
+        return done
+
+    for kind, prompt, max_tokens in [("introduction", build_introduction_prompt(user_query, relevant_data), 120),
+                                     ("analysis", build_expert_analysis_prompt(user_query, records), 150)]:
+        _submit(lambda remaining, kind=kind, prompt=prompt, max_tokens=max_tokens:
+                produce(kind, prompt, max_tokens, remaining), timeout).add_done_callback(refused(kind))
+
+    def fall_back(kind, error):
+        print(f"Error generating {kind}: {error!r}")
+        LLM_FALLBACKS.inc(kind, _fallback_reason(error))
+        if kind == "analysis":
+            texts[kind] = [templated_analysis(records)]
+        elif not texts[kind]:
+            # Nothing shown yet: send the templated introduction instead
+            texts[kind] = [templated_introduction(records)]
+            yield kind, texts[kind][0]
+
+    texts = {"introduction": [], "analysis": []}
+    pending = {"introduction", "analysis"}
+    failed = set()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while pending:
+        try:
+            kind, text, error = pieces.get(timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
+        except queue.Empty:
+            # Out of time: stop waiting on a stalled stream and fall back for what is left
+            for kind in [kind for kind in texts if kind in pending - failed]:
+                yield from fall_back(kind, FutureTimeoutError(f"No {kind} within {timeout}s"))
+            break
+        if error is not None:
+            failed.add(kind)
+            yield from fall_back(kind, error)
+        elif text is None:
+            pending.discard(kind)
+        elif kind not in failed:
+            texts[kind].append(text)
+            yield kind, text
+
+    expert_analysis = "".join(texts["analysis"])
+    if not expert_analysis:
+        LLM_FALLBACKS.inc("analysis", "missing")
+        expert_analysis = templated_analysis(records)
+    yield "done", {
+        "response": assemble_response("".join(texts["introduction"]), records),
+        "expert_analysis": expert_analysis,
+    }
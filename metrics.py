@@ -0,0 +1,154 @@
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Latency histogram buckets (seconds)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+# ------------------- Metric Types -------------------
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[position] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                    cumulative += count
+                    bucket_labels = _format_labels(self.labelnames, labels, [("le", bound)])
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                label_text = _format_labels(self.labelnames, labels)
+                lines.append(f"{self.name}_sum{label_text} {series[-1]}")
+                lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Value read at scrape time from `collect`, a callable returning {labels tuple: value}."""
+
+    def __init__(self, name, help, collect, labelnames=(), type="gauge"):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.labelnames = labelnames
+        self.type = type
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for labels, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+# ------------------- Registry -------------------
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """Prometheus text exposition format of every registered metric."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "gemma_stage_seconds", "Time spent in each stage of the chat pipeline", ("stage",)))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "gemma_request_seconds", "Request latency by endpoint", ("endpoint", "status")))
+SEARCH_OUTCOMES = REGISTRY.register(Counter(
+    "gemma_search_outcomes_total", "Chat messages by outcome (results, empty, greeting, needs_detail, needs_style)", ("outcome",)))
+LLM_FALLBACKS = REGISTRY.register(Counter(
+    "gemma_llm_fallbacks_total", "LLM texts (introduction, analysis) replaced by templated fallbacks", ("text", "reason")))
+LLM_CALLS = REGISTRY.register(Counter(
+    "gemma_llm_calls_total", "LLM gateway calls by outcome (ok, retry, error, timeout, rejected, circuit_open)", ("outcome",)))
+SESSION_FOLLOW_UPS = REGISTRY.register(Counter(
+    "gemma_session_follow_ups_total", "Chat messages answered from the conversation's session (style, more, similar, refine)", ("kind",)))
+
+# ------------------- Stage Timing -------------------
+# Stage durations of the current request, for the Server-Timing header (None outside a request)
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+def start_request():
+    """Begin collecting the stage timings of the current request; returns the (live) dict."""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as a pipeline stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+def submit(executor, fn, *args):
+    """executor.submit() that carries the request context (and its timings) into the worker thread."""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+def server_timing_header(timings, total_seconds):
+    """Format stage timings as a Server-Timing header value (durations in milliseconds)."""
+    entries = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items()]
+    entries.append(f"total;dur={total_seconds * 1000:.2f}")
+    return ", ".join(entries)
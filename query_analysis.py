@@ -0,0 +1,151 @@
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Mapping
+
+# Number of distinct normalized queries whose parse results are kept
+QUERY_CACHE_SIZE = 4096
+
+GREETINGS = ("hi", "hello")
+
+# Ordering keywords (matched as substrings anywhere in the query)
+PRICE_ASC_KEYWORDS = ["cheapest", "lowest price", "affordable", "low budget"]
+PRICE_DESC_KEYWORDS = ["most expensive", "highest price", "priciest", "expensive", "high budget"]
+CARAT_DESC_KEYWORDS = ["highest", "largest", "maximum"]
+CARAT_ASC_KEYWORDS = ["minimum", "lowest", "smallest"]
+
+_QUALITY = r"excellent|ideal|very good|good"
+
+# Flag set by each ordering keyword family
+_KEYWORD_FAMILIES = [
+    ("price_asc", PRICE_ASC_KEYWORDS),
+    ("price_desc", PRICE_DESC_KEYWORDS),
+    ("carat_desc", CARAT_DESC_KEYWORDS),
+    ("carat_asc", CARAT_ASC_KEYWORDS),
+]
+
+# Families implied by each keyword, so a match on "lowest price" also counts as "lowest"
+_IMPLIED_FAMILIES = {
+    keyword: {family for family, words in _KEYWORD_FAMILIES if any(word in keyword for word in words)}
+    for _, words in _KEYWORD_FAMILIES for keyword in words
+}
+
+# One named alternative per field plus one for the ordering keywords, combined into a
+# single pattern that is scanned once. Queries are lowercased before matching, so the
+# pattern is case-sensitive (noticeably faster than IGNORECASE).
+_FIELD_PATTERNS = [
+    r"\b(?P<style>lab\s*grown|lab|natural)\b",
+    r"(?P<carat>\d+(?:\.\d+)?)\s*-?\s*carat",
+    r"\b(?:under|at price|price)\s*\$?(?P<budget>\d+(?:,\d+)?)(?:\$)?\b",
+    r"\$?(?P<budget_suffix>\d+(?:,\d+)?)(?:\$)?\s*price\b",
+    r"\b(?P<color>[a-j])\b",
+    r"\b(?P<clarity>if|vvs1|vvs2|vs1|vs2|si1|si2)\b",
+    rf"cut\s*(?:is\s*)?(?P<cut>{_QUALITY})",
+    rf"(?P<cut_prefix>{_QUALITY})\s*cut",
+    rf"polish\s*(?:is\s*)?(?P<polish>{_QUALITY})",
+    rf"(?P<polish_prefix>{_QUALITY})\s*polish",
+    rf"symmetry\s*(?:is\s*)?(?P<symmetry>{_QUALITY})",
+    rf"(?P<symmetry_prefix>{_QUALITY})\s*symmetry",
+    r"\b(?P<shape>round|princess|emerald|asscher|cushion|marquise|radiant|oval|pear|heart|square radiant)\b",
+    r"(?P<keyword>" + "|".join(sorted(_IMPLIED_FAMILIES, key=len, reverse=True)) + ")",
+]
+_QUERY_PATTERN = re.compile("|".join(_FIELD_PATTERNS))
+
+@dataclass(frozen=True)
+class ParsedQuery:
+    """
+    Result of analysing one user query. Instances are cached and shared between
+    requests, so the constraints mapping is read-only.
+    """
+    text: str
+    constraints: Mapping[str, object]
+    price_asc: bool = False
+    price_desc: bool = False
+    carat_desc: bool = False
+    carat_asc: bool = False
+
+    @property
+    def is_greeting(self):
+        return self.text in GREETINGS
+
+    @property
+    def has_carat_ordering(self):
+        return self.carat_desc or self.carat_asc
+
+    @property
+    def has_ordering_keywords(self):
+        return self.price_asc or self.price_desc or self.carat_desc or self.carat_asc
+
+def normalize_query(user_query):
+    """Lowercase the query and collapse whitespace."""
+    return " ".join(user_query.lower().split())
+
+def analyze_query(user_query):
+    """
+    Extracts constraints (Carat, Color, Clarity, Cut, Symmetry, Polish, Style, Shape, Budget,
+    PriceOrder) and ordering keywords from the user's query in one pass.
+    Identical normalized queries are served from an LRU cache.
+    """
+    return _analyze_normalized(normalize_query(user_query))
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _analyze_normalized(text):
+    # Leftmost value for each field and where its match started. The scan resumes one
+    # character after each match start rather than at its end, so fields whose matches
+    # overlap (e.g. "under 1 carat", "cut excellent polish") are all found, which keeps
+    # the results identical to searching each pattern separately.
+    found, starts = {}, {}
+    families = set()
+    position = 0
+    while True:
+        match = _QUERY_PATTERN.search(text, position)
+        if match is None:
+            break
+        name = match.lastgroup
+        if name == "keyword":
+            families |= _IMPLIED_FAMILIES[match.group(name)]
+        elif name not in found:
+            found[name] = match.group(name)
+            starts[name] = match.start()
+        position = match.start() + 1
+
+    constraints = {}
+    if "style" in found:
+        # Normalize "lab" or "lab grown" to "labgrown"
+        constraints["Style"] = "labgrown" if "lab" in found["style"] else "natural"
+    if "carat" in found:
+        constraints["Carat"] = float(found["carat"])
+    # "price 2000$" takes precedence over "2000$ price"
+    budget = found.get("budget") or found.get("budget_suffix")
+    if budget:
+        constraints["Budget"] = float(budget.replace(',', ''))
+    if "color" in found:
+        constraints["Color"] = found["color"]
+    if "clarity" in found:
+        constraints["Clarity"] = found["clarity"]
+    for name, key in [("cut", "Cut"), ("polish", "Polish"), ("symmetry", "Symmetry")]:
+        # "cut is excellent" and "excellent cut" are alternatives of one search: leftmost wins
+        candidates = [n for n in (name, name + "_prefix") if n in found]
+        if candidates:
+            constraints[key] = found[min(candidates, key=starts.get)]
+    if "shape" in found:
+        constraints["Shape"] = found["shape"]
+
+    price_asc = "price_asc" in families
+    price_desc = "price_desc" in families
+    # Price ordering preference only applies when no explicit budget is provided
+    if "Budget" not in constraints:
+        if price_asc:
+            constraints["PriceOrder"] = "asc"
+        elif price_desc:
+            constraints["PriceOrder"] = "desc"
+
+    return ParsedQuery(
+        text=text,
+        constraints=MappingProxyType(constraints),
+        price_asc=price_asc,
+        price_desc=price_desc,
+        carat_desc="carat_desc" in families,
+        carat_asc="carat_asc" in families,
+    )
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def make_cache_key(*parts):
+    """Stable hash of JSON-serializable key parts."""
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# ------------------- LLM Response Cache -------------------
+class ResponseCache:
+    """
+    LRU + TTL cache for LLM completions with an optional SQLite backend (`path`) that
+    survives restarts and can be shared by several worker processes on one host. Expired
+    rows are deleted from it at most every `prune_interval` seconds, when a value is put.
+    get_or_compute() deduplicates concurrent misses: only the first caller for a key runs
+    the computation, the others wait for its result.
+    Values must be JSON-serializable.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, path=None, prune_interval=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (value, stored_at)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.path = path
+        self.prune_interval = prune_interval
+        self._next_prune = 0.0
+        self._local = threading.local()
+
+    def _connection(self):
+        # SQLite connections must not cross fork() or be shared by threads, so each thread
+        # of each (pre-forked) worker process opens its own and queries run without the lock
+        if not self.path:
+            return None
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, stored_at REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS responses_stored_at ON responses (stored_at)")
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def _fresh(self, stored_at):
+        return self.ttl is None or time.time() - stored_at <= self.ttl
+
+    def _cached(self, key):
+        # Caller holds the lock
+        entry = self._entries.get(key)
+        if entry is not None:
+            if self._fresh(entry[1]):
+                self._entries.move_to_end(key)
+                return entry
+            del self._entries[key]
+        return None
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._cached(key)
+        if entry is not None:
+            return entry
+        db = self._connection()
+        if db is not None:
+            row = db.execute("SELECT value, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self._fresh(row[1]):
+                entry = (json.loads(row[0]), row[1])
+                with self._lock:
+                    self._store(key, entry)
+                return entry
+        return None
+
+    def _store(self, key, entry):
+        # Caller holds the lock
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        entry = self._lookup(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        entry = (value, time.time())
+        with self._lock:
+            self._store(key, entry)
+            prune = self.ttl is not None and entry[1] >= self._next_prune
+            if prune:
+                self._next_prune = entry[1] + self.prune_interval
+        db = self._connection()
+        if db is not None:
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, stored_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), entry[1])
+            )
+            if prune:
+                self.prune()
+
+    def prune(self):
+        """Delete the expired rows of the SQLite backend; returns how many were deleted."""
+        db = self._connection()
+        if db is None or self.ttl is None:
+            return 0
+        return db.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - self.ttl,)).rowcount
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached value for key, or run compute() once (across concurrent callers),
+        cache its result and return it. Exceptions are propagated and not cached.
+        """
+        entry = self._lookup(key)
+        with self._lock:
+            # Another caller may have stored the value since the lookup
+            entry = entry or self._cached(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            value = compute()
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            self.put(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
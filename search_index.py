@@ -0,0 +1,219 @@
+import numpy as np
+import pandas as pd
+import faiss
+
+# Attribute columns indexed at load time
+CATEGORICAL_COLUMNS = ["Style", "Shape", "Clarity", "Color", "Cut", "Polish", "Symmetry"]
+NUMERIC_COLUMNS = ["Price", "Carat"]
+
+# Candidate sets up to this size are searched exactly (from the stored embeddings) on IVF indexes
+EXACT_SEARCH_MAX_CANDIDATES = 16384
+
+
+# ------------------- Columnar Attribute Index -------------------
+def _lowercase_codes(series):
+    """(codes, values) of the lowercased column, lowercasing each distinct value once."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        row_codes, categories = series.cat.codes.to_numpy(), series.cat.categories
+    else:
+        row_codes, categories = pd.factorize(series)
+    categories = [str(value).lower() for value in categories]
+    if (row_codes < 0).any():
+        categories.append('nan')  # code -1 picks it, as astype(str) would
+    category_codes, values = pd.factorize(np.array(categories, dtype=object))
+    return category_codes[row_codes], values
+
+class AttributeIndex:
+    """
+    Precomputed columnar view of the catalog used to resolve query constraints without
+    rescanning the DataFrame. Categorical columns are stored as integer codes over their
+    lowercased values with a sorted row-id posting list per value; numeric columns are
+    kept as a sort order plus the sorted values so ranges are found by bisection, and as
+    rank permutations in both directions (ties in row order, NaN last) so ordered top-k
+    queries never sort the candidates.
+
+    Every lookup takes an optional `ids` array (sorted row positions) to narrow an
+    existing candidate set; with ids=None it starts from the whole catalog.
+    """
+
+    def __init__(self, df):
+        self.size = len(df)
+        self.codes = {}
+        self.values = {}
+        self.postings = {}
+        for column in CATEGORICAL_COLUMNS:
+            codes, values = _lowercase_codes(df[column])
+            codes = codes.astype(np.min_scalar_type(max(len(values) - 1, 0)))  # uint8 for typical columns
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+            self.codes[column] = codes
+            self.values[column] = list(values)
+            self.postings[column] = [order[bounds[i]:bounds[i + 1]] for i in range(len(values))]
+
+        self.numbers = {}
+        self.sorted_ids = {}
+        self.sorted_values = {}
+        self.rank_orders = {}  # (column, ascending) -> row ids in rank order
+        self.ranks = {}        # (column, ascending) -> rank of each row
+        for column in NUMERIC_COLUMNS:
+            numbers = pd.to_numeric(df[column], errors="coerce").to_numpy(dtype='float64')
+            order = np.argsort(numbers, kind='stable')  # NaN sorts last
+            self.numbers[column] = numbers
+            self.sorted_ids[column] = order
+            self.sorted_values[column] = numbers[order]
+            for ascending, rank_order in [(True, order), (False, np.argsort(-numbers, kind='stable'))]:
+                ranks = np.empty(self.size, dtype='int64')
+                ranks[rank_order] = np.arange(self.size)
+                self.rank_orders[(column, ascending)] = rank_order
+                self.ranks[(column, ascending)] = ranks
+
+    def value_codes(self, column, value, exact=True):
+        """Codes of the indexed values equal to (or, if not exact, containing) value."""
+        value = str(value).lower()
+        if exact:
+            return [code for code, v in enumerate(self.values[column]) if v == value]
+        return [code for code, v in enumerate(self.values[column]) if value in v]
+
+    def match(self, column, value, ids=None, exact=True):
+        """Row ids whose categorical column matches value."""
+        codes = self.value_codes(column, value, exact=exact)
+        if ids is None:
+            if not codes:
+                return np.empty(0, dtype='int64')
+            if len(codes) == 1:
+                return self.postings[column][codes[0]]
+            return np.sort(np.concatenate([self.postings[column][code] for code in codes]))
+        if len(codes) == 1:
+            return ids[self.codes[column][ids] == codes[0]]
+        return ids[np.isin(self.codes[column][ids], codes)]
+
+    def top_k(self, column, k, ids=None, ascending=True):
+        """
+        The k row ids (of ids, or of the whole catalog) with the smallest (largest if not
+        ascending) values of a numeric column, in that order; ties keep row order, NaN last.
+        """
+        rank_order = self.rank_orders[(column, ascending)]
+        if ids is None:
+            return rank_order[:k]
+        # Dense candidates are found by walking the rank order (about k * size / len(ids)
+        # rows); the walk gives up after visiting len(ids) rows and the candidates' ranks
+        # are partitioned instead, which is also the way for sparse candidates
+        if len(ids) ** 2 >= 4 * k * self.size:
+            found, count, start = [], 0, 0
+            step = 2 * k * self.size // len(ids) + 1
+            while count < k and start < min(len(ids), self.size):
+                block = rank_order[start:start + step]
+                positions = np.minimum(np.searchsorted(ids, block), len(ids) - 1)
+                block = block[ids[positions] == block]
+                found.append(block)
+                count += len(block)
+                start += step
+                step *= 2
+            if count >= k or start >= self.size:
+                return np.concatenate(found)[:k]
+        ranks = self.ranks[(column, ascending)][ids]
+        if len(ids) > k:
+            top = np.argpartition(ranks, k - 1)[:k]
+            return ids[top[np.argsort(ranks[top])]]
+        return ids[np.argsort(ranks)]
+
+    def between(self, column, low=None, high=None, ids=None):
+        """Row ids whose numeric column lies in [low, high] (either bound optional)."""
+        sorted_values = self.sorted_values[column]
+        start = 0 if low is None else np.searchsorted(sorted_values, low, side='left')
+        stop = np.searchsorted(sorted_values, np.inf, side='right') if high is None else np.searchsorted(sorted_values, high, side='right')
+        if start >= stop:
+            return np.empty(0, dtype='int64')
+        if ids is None or stop - start <= len(ids) // 8:
+            window = np.sort(self.sorted_ids[column][start:stop])
+            if ids is None:
+                return window
+            return window[np.isin(window, ids, assume_unique=True)]
+        numbers = self.numbers[column][ids]
+        keep = np.ones(len(ids), dtype=bool)
+        if low is not None:
+            keep &= numbers >= low
+        if high is not None:
+            keep &= numbers <= high
+        return ids[keep]
+
+
+# ------------------- Filtered Semantic Search -------------------
+class DiamondSearchIndex:
+    """
+    Wraps the persistent FAISS index built (or loaded) at startup so a semantic search
+    can be restricted to a set of candidate rows without touching the disk or building
+    a temporary index, together with the AttributeIndex used to find those candidates.
+    Row ids are positions in the catalog DataFrame, which match the order the embeddings
+    were added to the index.
+    """
+
+    def __init__(self, df, faiss_index, embeddings=None, rerank=1, nprobe=None):
+        self.faiss_index = faiss_index
+        self.attributes = AttributeIndex(df)
+        # Compressed indexes (see index_variants.py) can fetch rerank * k neighbours and
+        # re-rank them by exact distance over `embeddings` (typically memory-mapped)
+        self.embeddings = embeddings
+        self.rerank = rerank
+        self.nprobe = nprobe
+        self._is_ivf = faiss.try_extract_index_ivf(faiss_index) is not None
+
+    @property
+    def ntotal(self):
+        return self.faiss_index.ntotal
+
+    @property
+    def d(self):
+        return self.faiss_index.d
+
+    @property
+    def search_options(self):
+        return {"rerank": self.rerank, "nprobe": self.nprobe}
+
+    def _search_parameters(self, selector=None):
+        if self._is_ivf and self.nprobe:
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+        if selector is not None:
+            return faiss.SearchParameters(sel=selector)
+        return None
+
+    def search(self, query_embeddings, k, candidate_ids=None):
+        """
+        Search the resident index for the k nearest rows. When candidate_ids is given,
+        only those rows are considered (via an ID selector over the stored vectors).
+        Returns (D, I) like faiss; unused slots are padded with -1.
+        """
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype='float32')
+        exact = self.rerank > 1 and self.embeddings is not None
+        params = self._search_parameters()
+        if candidate_ids is not None and len(candidate_ids) < self.ntotal:
+            candidate_ids = np.ascontiguousarray(candidate_ids, dtype='int64')
+            k = min(k, len(candidate_ids))
+            if k == 0:
+                empty = np.empty((query_embeddings.shape[0], 0))
+                return empty.astype('float32'), empty.astype('int64')
+            # Small candidate sets are scored exactly: cheaper than the index, and an IVF
+            # index would miss candidates outside the probed lists
+            limit = EXACT_SEARCH_MAX_CANDIDATES if self._is_ivf else k * self.rerank
+            if self.embeddings is not None and len(candidate_ids) <= limit:
+                return self._exact_search(query_embeddings, [candidate_ids] * len(query_embeddings), k)
+            params = self._search_parameters(faiss.IDSelectorBatch(candidate_ids))
+
+        D, I = self.faiss_index.search(query_embeddings, k * self.rerank if exact else k, params=params)
+        if exact:
+            return self._exact_search(query_embeddings, [ids[ids >= 0] for ids in I], k)
+        return D, I
+
+    def _exact_search(self, query_embeddings, row_ids, k):
+        # Exact L2 distances from each query to its own list of rows
+        D = np.full((len(query_embeddings), k), np.inf, dtype='float32')
+        I = np.full((len(query_embeddings), k), -1, dtype='int64')
+        for i, (query, ids) in enumerate(zip(query_embeddings, row_ids)):
+            vectors = np.asarray(self.embeddings[ids], dtype='float32')
+            distances = ((vectors - query) ** 2).sum(axis=1)
+            n = min(k, len(ids))
+            top = np.argpartition(distances, n - 1)[:n] if n < len(ids) else np.arange(len(ids))
+            top = top[np.argsort(distances[top], kind='stable')]
+            D[i, :n] = distances[top]
+            I[i, :n] = ids[top]
+        return D, I
@@ -0,0 +1,333 @@
+import re
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from types import MappingProxyType
+
+import numpy as np
+
+from chatbot import (filter_candidates, carat_candidates, sort_filtered, order_results, results_frame,
+                     GREETING_REPLY, NEEDS_DETAIL_REPLY, NO_MATCH_REPLY)
+from metrics import span, SEARCH_OUTCOMES, SESSION_FOLLOW_UPS
+
+# Ranked rows kept per conversation (the FAISS top_k of hybrid_search), shown PAGE_SIZE at a time
+SESSION_RESULTS = 200
+PAGE_SIZE = 5
+
+NO_MORE_REPLY = "Those are all the diamonds matching your search. Try changing the carat, clarity, or budget to see others."
+
+# Follow-up messages (matched against the normalized query text)
+MORE_PATTERN = re.compile(r"^(?:show\s+)?(?:me\s+)?(?:some\s+)?(?:more|next)(?:\s+(?:results|diamonds|options|ones|page))?(?:\s+please)?$")
+SIMILAR_PATTERN = re.compile(r"\b(?:(?:more|something|anything)\s+like\s+(?:these|this|them|those)|similar)\b")
+CHEAPER_PATTERN = re.compile(r"\b(?:cheaper|less\s+expensive|lower\s+price)")
+PRICIER_PATTERN = re.compile(r"\b(?:pricier|more\s+expensive|higher\s+price)")
+
+ORDERING_FLAGS = ("price_asc", "price_desc", "carat_desc", "carat_asc")
+
+
+# ------------------- Session State -------------------
+@dataclass(frozen=True)
+class SearchSession:
+    """
+    The latest search of one conversation. Follow-up messages derive a new session from
+    it (narrowing the candidates, re-ranking or paging) instead of searching from the text.
+    Row ids refer to `index`; a session is only valid with that catalog.
+    """
+    index: object                 # DiamondSearchIndex the session was searched in
+    query: str                    # the conversation's query so far, given to the LLM
+    parsed_query: object          # ParsedQuery carrying the merged constraints and ordering
+    ids: object                   # filtered candidate rows (None means the whole catalog)
+    candidate_ids: object         # rows searched with FAISS (the carat window, else ids)
+    embedding: object             # query embedding (None when no FAISS search was needed)
+    result_ids: object            # rows found, in FAISS order (ranked order without a Carat)
+    distances: object             # FAISS distances of result_ids (None without a Carat)
+    order: object                 # ranked positions into result_ids
+    scores: object                # composite scores aligned with order (None when sorted)
+    offset: int = 0               # ranked rows already shown
+
+    def page(self, df):
+        """The PAGE_SIZE ranked diamonds starting at offset, as hybrid_search returns them."""
+        top = self.order[self.offset:self.offset + PAGE_SIZE]
+        if self.distances is None:
+            return df.iloc[self.result_ids[top]].reset_index(drop=True)
+        scores = None if self.scores is None else self.scores[self.offset:self.offset + PAGE_SIZE]
+        return results_frame(df, self.result_ids, self.distances, top, scores)
+
+    def shown_ids(self):
+        return self.result_ids[self.order[self.offset:self.offset + PAGE_SIZE]]
+
+
+@dataclass(frozen=True)
+class PendingSearch:
+    """
+    A search waiting for the answer to the style question: the message that was asked
+    about, merged with the Style of the answer instead of parsing the two again.
+    """
+    query: str                    # the message that had no Style
+    parsed_query: object          # its ParsedQuery
+
+
+# ------------------- Session Store -------------------
+class LRUEviction:
+    """Evict the conversation that has been idle longest."""
+
+    def touched(self, sessions, session_id):
+        sessions.move_to_end(session_id)
+
+
+class FIFOEviction:
+    """Evict the oldest conversation, however active."""
+
+    def touched(self, sessions, session_id):
+        pass
+
+
+EVICTION_POLICIES = {"lru": LRUEviction, "fifo": FIFOEviction}
+
+
+class SessionStore:
+    """
+    Bounded, thread-safe, in-process store of SearchSessions keyed by session id.
+    Sessions idle for more than `ttl` seconds (if set) are dropped. When full, the policy
+    picks the session to evict: "lru", "fifo", or any object with a
+    touched(sessions, session_id) method that moves session_id within the OrderedDict
+    (the first entry is evicted).
+    Sessions are per process: behind several workers, a follow-up that lands on another
+    worker is answered as a new search.
+    """
+
+    def __init__(self, maxsize=1000, ttl=1800, eviction="lru"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.policy = EVICTION_POLICIES[eviction]() if isinstance(eviction, str) else eviction
+        self._sessions = OrderedDict()  # session id -> (session, last_used)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def new_id(self):
+        return uuid.uuid4().hex
+
+    def get(self, session_id):
+        if not session_id:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if self.ttl is not None and now - entry[1] > self.ttl:
+                del self._sessions[session_id]
+                return None
+            self._sessions[session_id] = (entry[0], now)
+            self.policy.touched(self._sessions, session_id)
+            return entry[0]
+
+    def put(self, session_id, session):
+        with self._lock:
+            is_new = session_id not in self._sessions
+            self._sessions[session_id] = (session, time.time())
+            if is_new:
+                self._sessions.move_to_end(session_id)
+            else:
+                self.policy.touched(self._sessions, session_id)
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+
+    def clear(self):
+        """Drop every session, e.g. when the catalog is replaced and row ids change."""
+        with self._lock:
+            self._sessions.clear()
+
+
+# ------------------- Follow-ups -------------------
+def follow_up_kind(parsed_query, session):
+    """
+    How a message continues the conversation: "style" (a Style answering the style
+    question of a PendingSearch), "more" (next page), "similar" (more like the diamonds
+    shown), "refine" (constraints or ordering applied on top of the session's) or None
+    for a new search.
+    A refine only adds constraints or changes the value of a quality, clarity, color or
+    budget; a Style, a Carat or another Shape than the session's starts a new search.
+    """
+    if session is None or parsed_query.is_greeting:
+        return None
+    constraints = parsed_query.constraints
+    if isinstance(session, PendingSearch):
+        return "style" if set(constraints) == {"Style"} else None
+    text = parsed_query.text
+    if MORE_PATTERN.match(text):
+        return "more"
+    if SIMILAR_PATTERN.search(text):
+        return "similar"
+    if "Style" in constraints or "Carat" in constraints:
+        return None
+    shape = session.parsed_query.constraints.get("Shape")
+    if "Shape" in constraints and shape is not None and constraints["Shape"] != shape:
+        return None
+    if constraints or parsed_query.has_ordering_keywords or CHEAPER_PATTERN.search(text) or PRICIER_PATTERN.search(text):
+        return "refine"
+    return None
+
+def _refined_query(session_query, parsed_query):
+    """The session's ParsedQuery with the message's constraints and ordering applied on top."""
+    constraints = dict(session_query.constraints)
+    constraints.update(parsed_query.constraints)
+    text = parsed_query.text
+    if CHEAPER_PATTERN.search(text):
+        flags = {"price_asc": True}
+    elif PRICIER_PATTERN.search(text):
+        flags = {"price_desc": True}
+    elif parsed_query.has_ordering_keywords:
+        flags = {flag: getattr(parsed_query, flag) for flag in ORDERING_FLAGS}
+    else:
+        flags = None
+    if flags is not None:
+        flags = {flag: flags.get(flag, False) for flag in ORDERING_FLAGS}
+        constraints.pop("PriceOrder", None)
+        if flags["price_asc"]:
+            constraints["PriceOrder"] = "asc"
+        elif flags["price_desc"]:
+            constraints["PriceOrder"] = "desc"
+    # As in analyze_query, a price ordering only applies when no budget is given
+    if "Budget" in constraints:
+        constraints.pop("PriceOrder", None)
+    return replace(session_query, constraints=MappingProxyType(constraints), **(flags or {}))
+
+# ------------------- Conversation Search -------------------
+def _ranked_session(query, parsed_query, ids, candidate_ids, embedding, df, faiss_index, exclude=None):
+    """Search (when there is a Carat or an embedding) and rank; returns a SearchSession."""
+    attributes = faiss_index.attributes
+    if embedding is None:
+        with span("rank"):
+            rows = sort_filtered(ids, parsed_query, attributes, SESSION_RESULTS)
+        return SearchSession(faiss_index, query, parsed_query, ids, candidate_ids, None, rows, None,
+                             np.arange(len(rows)), None)
+
+    search_ids = candidate_ids
+    if exclude is not None:
+        search_ids = np.setdiff1d(np.arange(df.shape[0]) if search_ids is None else search_ids, exclude)
+    new_top_k = min(SESSION_RESULTS, df.shape[0] if search_ids is None else len(search_ids))
+    with span("faiss_search"):
+        D, I = faiss_index.search(np.asarray(embedding, dtype='float32')[None], new_top_k, candidate_ids=search_ids)
+    found = I[0] >= 0
+    result_ids, distances = I[:, found], D[:, found]
+    with span("rank"):
+        order, scores = order_results(result_ids, distances, ids, parsed_query, attributes, k=result_ids.shape[1])
+    return SearchSession(faiss_index, query, parsed_query, ids, candidate_ids, embedding, result_ids[0], distances[0],
+                         order[0], None if scores is None else scores[0])
+
+def new_session(user_query, parsed_query, df, faiss_index, model):
+    """
+    The search of diamond_search/hybrid_search (top_k=200), kept as a session.
+    Returns (reply, session): a no-match reply and None, or None and the session.
+    """
+    constraints = parsed_query.constraints
+    with span("filter"):
+        ids, message = filter_candidates(constraints, faiss_index.attributes)
+        candidate_ids = ids
+        if message is None and "Carat" in constraints:
+            candidate_ids = carat_candidates(constraints, ids, faiss_index.attributes)
+    if message is not None:
+        print(message)
+        return NO_MATCH_REPLY, None
+    if "Carat" not in constraints:
+        return None, _ranked_session(user_query, parsed_query, ids, candidate_ids, None, df, faiss_index)
+    with span("encode"):
+        embedding = model.encode(user_query, convert_to_numpy=True)
+    return None, _ranked_session(user_query, parsed_query, ids, candidate_ids, embedding, df, faiss_index)
+
+def _beyond_shown(text, session, ids, attributes):
+    """
+    For a "cheaper"/"pricier" message, the rows of ids priced below/above every diamond
+    shown, so the answer is not the page already seen; other messages keep ids.
+    Returns (ids, message) like filter_candidates.
+    """
+    cheaper = CHEAPER_PATTERN.search(text)
+    if not cheaper and not PRICIER_PATTERN.search(text):
+        return ids, None
+    prices = attributes.numbers["Price"][session.shown_ids()]
+    if cheaper:
+        ids = attributes.between("Price", high=np.nextafter(np.nanmin(prices), -np.inf), ids=ids)
+        return (ids, None) if len(ids) else (None, "No cheaper diamonds found.")
+    ids = attributes.between("Price", low=np.nextafter(np.nanmax(prices), np.inf), ids=ids)
+    return (ids, None) if len(ids) else (None, "No pricier diamonds found.")
+
+def continue_session(kind, user_query, parsed_query, session, df, embeddings, faiss_index, model):
+    """
+    Answers a follow_up_kind() message from the session: "style" runs the pending search
+    with the Style given; the others do not encode the text. "more" pages further down the
+    ranked rows, "similar" searches the session's candidates around the diamonds shown
+    (the mean of their embeddings), "refine" narrows or re-filters the candidates and
+    re-ranks them with the stored query embedding ("cheaper"/"pricier" beyond the prices
+    shown).
+    Returns (reply, session) like new_session; on no match the old session is kept.
+    """
+    if kind == "style":
+        refined = _refined_query(session.parsed_query, parsed_query)
+        return new_session(f"{session.query} {user_query}", refined, df, faiss_index, model)
+
+    if kind == "more":
+        offset = session.offset + PAGE_SIZE
+        if offset >= len(session.order):
+            return NO_MORE_REPLY, session
+        return None, replace(session, offset=offset)
+
+    if kind == "similar":
+        shown = session.shown_ids()
+        embedding = np.asarray(embeddings[np.sort(shown)], dtype='float32').mean(axis=0)
+        ranked = _ranked_session(session.query, session.parsed_query, session.ids, session.candidate_ids,
+                                 embedding, df, faiss_index, exclude=shown)
+        if len(ranked.order) == 0:
+            return NO_MORE_REPLY, session
+        return None, ranked
+
+    refined = _refined_query(session.parsed_query, parsed_query)
+    # Only new constraints: the session's candidates are already filtered by the others
+    narrowing = not any(key in session.parsed_query.constraints for key in parsed_query.constraints)
+    with span("filter"):
+        ids, message = filter_candidates(refined.constraints, faiss_index.attributes,
+                                         session.ids if narrowing else None)
+        if message is None:
+            ids, message = _beyond_shown(parsed_query.text, session, ids, faiss_index.attributes)
+        candidate_ids = ids
+        if message is None and "Carat" in refined.constraints:
+            candidate_ids = carat_candidates(refined.constraints, ids, faiss_index.attributes)
+    if message is not None:
+        print(message)
+        return NO_MATCH_REPLY, session
+    ranked = _ranked_session(f"{session.query} {user_query}", refined, ids, candidate_ids,
+                             session.embedding, df, faiss_index)
+    if len(ranked.order) == 0:
+        return NO_MATCH_REPLY, session
+    return None, ranked
+
+def conversation_search(kind, user_query, parsed_query, session, df, embeddings, faiss_index, model):
+    """
+    diamond_search for a chat conversation: a follow_up_kind() message is answered from
+    the session, anything else is searched from scratch. Returns (reply, top_5, session):
+    a canned reply and None, or None and the diamonds to show; plus the session to keep
+    for the next message (the previous one when nothing new was found).
+    """
+    if kind is None:
+        # Handle greetings
+        if parsed_query.is_greeting:
+            SEARCH_OUTCOMES.inc("greeting")
+            return GREETING_REPLY, None, session
+        if not parsed_query.constraints and not parsed_query.has_carat_ordering:
+            SEARCH_OUTCOMES.inc("needs_detail")
+            return NEEDS_DETAIL_REPLY, None, session
+        with span("search"):
+            reply, searched = new_session(user_query, parsed_query, df, faiss_index, model)
+    else:
+        SESSION_FOLLOW_UPS.inc(kind)
+        with span("search"):
+            reply, searched = continue_session(kind, user_query, parsed_query, session, df, embeddings, faiss_index, model)
+    if reply is not None:
+        SEARCH_OUTCOMES.inc("empty")
+        return reply, None, searched or session
+    SEARCH_OUTCOMES.inc("results")
+    return None, searched.page(df), searched
@@ -0,0 +1,206 @@
+import os
+import sys
+import json
+import shutil
+from dataclasses import replace
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from catalog_snapshot import write_snapshot, load_snapshot, read_manifest
+from chatbot import (compact_catalog, load_catalog, filter_candidates, carat_tolerance, carat_window, sort_filtered,
+                     order_results, results_frame)
+from index_variants import build_index, index_variant_of
+from search_index import AttributeIndex, DiamondSearchIndex
+from query_analysis import analyze_query
+from metrics import span
+
+SHARD_DIR = 'catalog_shards'
+SHARDS_FILE = 'shards.json'
+
+# Column added to every shard holding the row's position in the whole catalog
+CATALOG_ROW_COLUMN = 'CatalogRow'
+
+
+# ------------------- Partitioning -------------------
+def shard_assignment(df, shards, by=None):
+    """
+    Shard number of every catalog row: round robin over the rows, or a hash of the
+    column `by` (e.g. "Style" or "Shape") so all stones with one value share a shard.
+    """
+    if by is None:
+        return np.arange(len(df)) % shards
+    hashes = pd.util.hash_pandas_object(df[by].astype(str), index=False).to_numpy()
+    return (hashes % np.uint64(shards)).astype('int64')
+
+def write_shards(shard_dir, df, embeddings, faiss_index, shards, by=None):
+    """
+    Split the catalog into `shards` snapshots (shard_dir/shard-<i>), each with its rows,
+    their CatalogRow, embeddings and a FAISS index of the same variant built over them.
+    faiss_index is the catalog's DiamondSearchIndex; its search options carry over.
+    """
+    variant = index_variant_of(faiss_index.faiss_index)
+    assignment = shard_assignment(df, shards, by)
+    os.makedirs(shard_dir, exist_ok=True)
+    for shard in range(shards):
+        rows = np.flatnonzero(assignment == shard)
+        shard_df = df.iloc[rows].reset_index(drop=True)
+        shard_df[CATALOG_ROW_COLUMN] = rows
+        shard_embeddings = np.asarray(embeddings[rows])
+        index = build_index(shard_embeddings, variant)
+        write_snapshot(os.path.join(shard_dir, f'shard-{shard}'), shard_df, shard_embeddings, index,
+                       faiss_index.search_options)
+    with open(os.path.join(shard_dir, SHARDS_FILE), 'w') as f:
+        json.dump({'shards': shards, 'by': by, 'rows': int(len(df))}, f, indent=2)
+    # Drop shards of an earlier, larger split
+    for name in os.listdir(shard_dir):
+        if name.startswith('shard-') and name[len('shard-'):].isdigit() and int(name[len('shard-'):]) >= shards:
+            shutil.rmtree(os.path.join(shard_dir, name), ignore_errors=True)
+    print(f"Catalog of {len(df)} rows split into {shards} shards in {shard_dir}")
+
+# ------------------- Shard Worker -------------------
+# (df, DiamondSearchIndex) of the shard owned by this worker process
+_shard = None
+
+def _load_shard(shard_path):
+    global _shard
+    df, embeddings, index = load_snapshot(shard_path)
+    df = compact_catalog(df)
+    _shard = (df, DiamondSearchIndex(df, index, embeddings, **read_manifest(shard_path)['search']))
+
+def _shard_size():
+    return len(_shard[0])
+
+def _shard_rows(positions):
+    """The shard's rows at positions as {column: numpy array}, cheaper to send and merge than a DataFrame."""
+    return {name: np.asarray(column.array.take(positions)) for name, column in _shard[0].items()}
+
+def _shard_search(constraints, query_embedding, top_k):
+    """
+    The shard's part of hybrid_search with a Carat. Returns (level, rows): the FAISS top_k
+    of the filtered rows in the narrowest non-empty window (level 0: the carat window,
+    1: the doubled one, 2: all filtered rows) with a distance column; None when no row
+    passes the filters.
+    """
+    df, search_index = _shard
+    attributes = search_index.attributes
+    ids, message = filter_candidates(constraints, attributes)
+    if message is not None:
+        return None
+    tolerance = carat_tolerance(constraints)
+    level, candidate_ids = 2, ids
+    for window_level, window_tolerance in enumerate([tolerance, tolerance * 2]):
+        window = carat_window(constraints, window_tolerance, ids, attributes)
+        if len(window):
+            level, candidate_ids = window_level, window
+            break
+    new_top_k = min(top_k, len(df) if candidate_ids is None else len(candidate_ids))
+    D, I = search_index.search(query_embedding[None], new_top_k, candidate_ids=candidate_ids)
+    found = I[0] >= 0
+    rows = _shard_rows(I[0, found])
+    rows['distance'] = D[0, found]
+    return level, rows
+
+def _shard_sorted(parsed_query, k):
+    """The shard's part of hybrid_search without a Carat: its top k filtered rows by sort_filtered."""
+    _, search_index = _shard
+    ids, message = filter_candidates(parsed_query.constraints, search_index.attributes)
+    if message is not None:
+        return None
+    return _shard_rows(sort_filtered(ids, parsed_query, search_index.attributes, k))
+
+# ------------------- Coordinator -------------------
+def _merged_rows(shard_rows):
+    """The rows returned by several shards as one {column: numpy array}."""
+    return {name: np.concatenate([rows[name] for rows in shard_rows]) for name in shard_rows[0]}
+
+def _catalog_frame(rows, positions):
+    """DataFrame of the merged rows at positions, with the catalog's columns only."""
+    return pd.DataFrame({name: values[positions] for name, values in rows.items()
+                         if name not in (CATALOG_ROW_COLUMN, 'distance')})
+
+class ShardedSearch:
+    """
+    hybrid_search over a catalog split by write_shards. Every shard is owned by its own
+    worker process (its slice of the DataFrame, attribute index and FAISS index); the
+    coordinator encodes the query once, fans each step out to the shards and merges
+    their top rows with the single-process ranking (order_results / sort_filtered over
+    an AttributeIndex of the merged rows). For flat indexes the result is the same top 5
+    as hybrid_search over the whole catalog.
+
+    The carat window is chosen for the catalog as a whole, as carat_candidates does: each
+    shard searches its narrowest non-empty window and the coordinator keeps the results of
+    the narrowest one found, so a search takes one round.
+    """
+
+    def __init__(self, model, shard_dir=SHARD_DIR, mp_context=None):
+        with open(os.path.join(shard_dir, SHARDS_FILE)) as f:
+            self.layout = json.load(f)
+        self.model = model
+        self._workers = [
+            ProcessPoolExecutor(1, mp_context=mp_context, initializer=_load_shard,
+                                initargs=(os.path.join(shard_dir, f'shard-{shard}'),))
+            for shard in range(self.layout['shards'])
+        ]
+        self.sizes = self._gather(_shard_size)
+        print(f"Loaded {len(self._workers)} catalog shards ({sum(self.sizes)} rows) from {shard_dir}")
+
+    def __len__(self):
+        return sum(self.sizes)
+
+    def _gather(self, fn, *args):
+        futures = [worker.submit(fn, *args) for worker in self._workers]
+        return [future.result() for future in futures]
+
+    def close(self):
+        for worker in self._workers:
+            worker.shutdown()
+
+    def hybrid_search(self, user_query, top_k=200, parsed_query=None):
+        """hybrid_search(user_query, df, faiss_index, model, top_k, parsed_query) across the shards."""
+        if parsed_query is None:
+            parsed_query = analyze_query(user_query)
+        # Shards receive a picklable copy of the (read-only) constraints
+        parsed_query = replace(parsed_query, constraints=dict(parsed_query.constraints))
+        constraints = parsed_query.constraints
+
+        if "Carat" not in constraints:
+            with span("shard_search"):
+                shard_rows = [rows for rows in self._gather(_shard_sorted, parsed_query, 5) if rows is not None]
+            if not shard_rows:
+                return pd.DataFrame()
+            with span("rank"):
+                # Rank ties break by row: rank the merged rows in catalog order
+                rows = _merged_rows(shard_rows)
+                rows = _catalog_frame(rows, np.argsort(rows[CATALOG_ROW_COLUMN], kind='stable'))
+                return rows.iloc[sort_filtered(None, parsed_query, AttributeIndex(rows))].reset_index(drop=True)
+
+        with span("encode"):
+            query_embedding = np.asarray(self.model.encode(user_query, convert_to_numpy=True), dtype='float32')
+        with span("shard_search"):
+            results = [result for result in self._gather(_shard_search, constraints, query_embedding, top_k)
+                       if result is not None]
+        if not results:
+            return pd.DataFrame()
+
+        with span("rank"):
+            # The catalog-wide window is the narrowest any shard found rows in; shards that
+            # fell back to a wider one have no rows inside it
+            level = min(level for level, _ in results)
+            rows = _merged_rows([rows for row_level, rows in results if row_level == level])
+            # The catalog-wide top_k nearest (distance, then row) in FAISS order, ranked as
+            # hybrid_search does over an attribute index of just these rows in catalog order
+            nearest = np.lexsort((rows[CATALOG_ROW_COLUMN], rows['distance']))[:top_k]
+            by_row = np.argsort(rows[CATALOG_ROW_COLUMN][nearest], kind='stable')
+            result_ids = np.empty_like(by_row)
+            result_ids[by_row] = np.arange(len(by_row))
+            distances = rows['distance'][nearest]
+            rows = _catalog_frame(rows, nearest[by_row])
+            top, scores = order_results(result_ids[None], distances[None], None, parsed_query, AttributeIndex(rows))
+            return results_frame(rows, result_ids, distances, top[0], None if scores is None else scores[0])
+
+if __name__ == '__main__':
+    # Usage: python sharded_search.py SHARDS [COLUMN]  (splits the current catalog into shards)
+    df, embeddings, faiss_index = load_catalog('diamond_embeddings.npy', 'diamond_faiss_index.faiss', 'diamond_dataframe.csv')
+    write_shards(SHARD_DIR, df, embeddings, faiss_index, int(sys.argv[1]), sys.argv[2] if len(sys.argv) > 2 else None)
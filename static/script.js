@@ -5,6 +5,10 @@ window.closeModal = closeModal;
 // Global variable to hold the last search query
 let lastQuery = "";
 
+// Conversation id issued by the server (X-Session-Id), so follow-ups like "show more"
+// or "cheaper ones" refine the previous search
+let sessionId = null;
+
 /**
  * Close the diamond details modal
  */
@@ -98,6 +102,7 @@ function addMessage(message, isUser = false) {
   
   chatMessages.appendChild(msgDiv);
   chatMessages.scrollTop = chatMessages.scrollHeight;
+  return bubble;
 }
 
 /**
@@ -129,19 +134,10 @@ function selectStyle(style) {
   const pendingQuery = localStorage.getItem("pendingQuery");
   if (pendingQuery) {
     localStorage.removeItem("pendingQuery");
-    const newQuery = `${pendingQuery} ${style}`;
     addMessage(`Style preference: ${style}`, true);
     
-    fetch("/chat", {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ message: newQuery })
-    })
-    .then(res => res.json())
-    .then(data => {
-      addMessage(data.response, false);
-      handleDiamondData(data.response);
-    })
+    // The server answers from the message it asked about; pendingQuery is only a fallback
+    streamChat(style, pendingQuery)
     .catch(err => {
       console.error("Error:", err);
       addMessage("Sorry, there was an error processing your request.", false);
@@ -315,6 +311,115 @@ function openModalWithDetails(diamond) {
   modal.style.display = "flex";
 }
 
+/**
+ * Read a text/event-stream response body, calling onEvent(event, data) for each event.
+ */
+function readEventStream(res, onEvent) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  
+  function pump() {
+    return reader.read().then(({ done, value }) => {
+      if (done) return;
+      buffer += decoder.decode(value, { stream: true });
+      let boundary;
+      while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+        const block = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        let event = "message";
+        const data = [];
+        block.split("\n").forEach(line => {
+          if (line.startsWith("event:")) {
+            event = line.slice(6).trim();
+          } else if (line.startsWith("data:")) {
+            data.push(line.slice(5).trim());
+          }
+        });
+        if (data.length) {
+          onEvent(event, JSON.parse(data.join("\n")));
+        }
+      }
+      return pump();
+    });
+  }
+  return pump();
+}
+
+/**
+ * Show the expert analysis text streamed so far in a card above the diamond cards.
+ */
+function updateExpertAnalysis(text) {
+  const dynamicResults = document.getElementById("dynamic-results");
+  let content = dynamicResults.querySelector(".expert-analysis-content");
+  if (!content) {
+    const analysisCard = document.createElement("div");
+    analysisCard.classList.add("expert-analysis-card");
+    analysisCard.innerHTML = `
+      <h3><i class="fas fa-gem"></i> Expert Recommendation</h3>
+      <div class="expert-analysis-content"></div>
+    `;
+    dynamicResults.prepend(analysisCard);
+    content = analysisCard.querySelector(".expert-analysis-content");
+  }
+  content.textContent = text;
+}
+
+/**
+ * Send a query to /chat/stream and render the reply as it arrives: the diamond cards as
+ * soon as the search returns, then the introduction and expert analysis as they are written.
+ * pendingQuery is the message a style answer belongs to.
+ */
+function streamChat(message, pendingQuery = null) {
+  return fetch("/chat/stream", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ message, session_id: sessionId, pending_query: pendingQuery })
+  })
+  .then(res => {
+    sessionId = res.headers.get("X-Session-Id") || sessionId;
+    const contentType = res.headers.get("Content-Type") || "";
+    if (!contentType.includes("text/event-stream")) {
+      // Replies that need no LLM (style question, greeting, no matches) come back as JSON
+      return res.json().then(data => {
+        if (data.needs_style) {
+          localStorage.setItem("pendingQuery", message);
+          showStylePopup();
+          return;
+        }
+        addMessage(data.response, false);
+        handleDiamondData(data.response);
+      });
+    }
+    
+    let bubble = null;
+    let introduction = "";
+    let analysis = "";
+    return readEventStream(res, (event, data) => {
+      if (event === "results") {
+        handleDiamondData(`<diamond-data>${JSON.stringify(data)}</diamond-data>`);
+      } else if (event === "introduction") {
+        introduction += data;
+        if (!bubble) {
+          bubble = addMessage("", false);
+        }
+        bubble.textContent = introduction;
+      } else if (event === "analysis") {
+        analysis += data;
+        updateExpertAnalysis(analysis);
+      } else if (event === "done") {
+        if (!bubble) {
+          bubble = addMessage("", false);
+        }
+        bubble.innerHTML = processChatMessage(data.response);
+        handleDiamondData(data.response);
+      } else if (event === "error") {
+        addMessage(data.response, false);
+      }
+    });
+  });
+}
+
 /**
  * Send user message to server.
  */
@@ -331,21 +436,7 @@ function sendMessage() {
   addMessage(message, true);
   input.value = "";
   
-  fetch("/chat", {
-    method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ message })
-  })
-  .then(res => res.json())
-  .then(data => {
-    if (data.needs_style) {
-      localStorage.setItem("pendingQuery", message);
-      showStylePopup();
-      return;
-    }
-    addMessage(data.response, false);
-    handleDiamondData(data.response);
-  })
+  streamChat(message)
   .catch(err => {
     console.error("Error:", err);
     addMessage("Sorry, I encountered an error processing your request.", false);
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.stubs import StubEncoder
+from benchmarks.synthetic_catalog import synthesize_catalog
+from chatbot import prepare_catalog, compact_catalog
+from index_variants import build_index
+from search_index import DiamondSearchIndex
+
+CATALOG_ROWS = 3000
+# Rows repeated at the end of the catalog: same attributes, same embedding, so searches
+# and rankings meet exact ties
+DUPLICATE_ROWS = 300
+
+QUERY_FILES = [os.path.join(ROOT, 'benchmarks', 'queries.txt'), os.path.join(ROOT, 'tests', 'queries.txt')]
+
+
+def load_queries():
+    queries = []
+    for path in QUERY_FILES:
+        with open(path) as f:
+            queries.extend(line.strip() for line in f if line.strip())
+    return queries
+
+
+@pytest.fixture(scope='session')
+def queries():
+    """The recorded query set: the benchmark queries and tests/queries.txt."""
+    return load_queries()
+
+
+@pytest.fixture(scope='session')
+def model():
+    return StubEncoder()
+
+
+@pytest.fixture(scope='session')
+def prepared_catalog():
+    """The synthetic catalog as prepare_catalog leaves it (object columns, combined_text)."""
+    df = synthesize_catalog(pd.read_csv(os.path.join(ROOT, 'diamonds.csv')), CATALOG_ROWS)
+    df = pd.concat([df, df.iloc[:DUPLICATE_ROWS]], ignore_index=True)
+    return prepare_catalog(df)
+
+
+@pytest.fixture(scope='session')
+def catalog(prepared_catalog, model):
+    """(df, embeddings, DiamondSearchIndex) as the app serves them, over a flat index."""
+    embeddings = model.encode(prepared_catalog['combined_text'].tolist())
+    df = compact_catalog(prepared_catalog)
+    return df, embeddings, DiamondSearchIndex(df, build_index(embeddings, 'flat'), embeddings)
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from chatbot import batch_search, diamond_search, NO_MATCH_REPLY
+from query_analysis import analyze_query
+
+
+# Queries without a Carat, and queries no diamond matches
+EXTRA_QUERIES = [
+    "round natural vs1 under 3000", "cheapest oval lab grown", "largest emerald natural", "excellent cut g color",
+    "50 carat round natural", "1 carat heart lab under 10 price", "0.3 carat asscher natural if d", "hi", "diamond",
+]
+
+@pytest.mark.parametrize("batch_size", [1, 7, 256])
+def test_batch_search_matches_diamond_search(queries, catalog, model, batch_size):
+    df, _, search_index = catalog
+    all_queries = queries + EXTRA_QUERIES
+    assert any("Carat" not in analyze_query(query).constraints for query in all_queries)
+    results = list(batch_search(all_queries, df, search_index, model, batch_size=batch_size))
+    assert [query for query, _, _ in results] == all_queries
+    no_match = 0
+    for query, reply, top_5 in results:
+        expected_reply, expected = diamond_search(query, df, search_index, model)
+        assert reply == expected_reply, query
+        no_match += reply == NO_MATCH_REPLY
+        if expected is None:
+            assert top_5 is None, query
+            continue
+        assert list(top_5.columns) == list(expected.columns), query
+        assert top_5.index.tolist() == expected.index.tolist(), query
+        for column in expected.columns:
+            if column in ("distance", "score"):
+                # A batched FAISS search may sum a distance in another order (one float32 ulp apart)
+                np.testing.assert_allclose(top_5[column].to_numpy(float), expected[column].to_numpy(float),
+                                           rtol=1e-5, err_msg=query)
+            else:
+                assert top_5[column].astype(str).tolist() == expected[column].astype(str).tolist(), query
+    assert no_match >= 2
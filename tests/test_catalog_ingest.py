@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic_catalog import synthesize_catalog
+from catalog_ingest import ingest_feed
+from chatbot import prepare_catalog, compact_catalog
+from index_variants import build_index, search_options, embedding_dtype
+from search_index import DiamondSearchIndex
+
+from conftest import ROOT
+
+STORED_ROWS = 1500
+REMOVED_ROWS = 40
+CHANGED_ROWS = 40
+NEW_ROWS = 60
+
+
+def contents(df):
+    """Hash of each row's attributes: rows with equal contents have equal embeddings."""
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+def encode_catalog(raw, model):
+    prepared = prepare_catalog(raw)
+    return compact_catalog(prepared), model.encode(prepared['combined_text'].tolist())
+
+@pytest.fixture(scope='module')
+def raw_catalog():
+    return synthesize_catalog(pd.read_csv(os.path.join(ROOT, 'diamonds.csv')), STORED_ROWS)
+
+@pytest.fixture(scope='module')
+def feed(raw_catalog):
+    """The stored stones less REMOVED_ROWS, with CHANGED_ROWS repriced and NEW_ROWS added."""
+    rng = np.random.default_rng(1)
+    positions = rng.permutation(len(raw_catalog))
+    removed, changed = positions[:REMOVED_ROWS], positions[REMOVED_ROWS:REMOVED_ROWS + CHANGED_ROWS]
+    feed = raw_catalog.copy()
+    feed.loc[changed, 'Price'] = (feed.loc[changed, 'Price'] * 1.1).round(2)
+    new = synthesize_catalog(pd.read_csv(os.path.join(ROOT, 'diamonds.csv')), NEW_ROWS, seed=1)
+    feed = pd.concat([feed.drop(index=removed), new], ignore_index=True)
+    return feed, raw_catalog.iloc[removed]
+
+@pytest.mark.parametrize("variant", ["flat", "ivfpq"])
+def test_ingest_keeps_index_embeddings_and_rows_aligned(raw_catalog, feed, model, variant):
+    feed, removed = feed
+    df, embeddings = encode_catalog(raw_catalog, model)
+    embeddings = embeddings.astype(embedding_dtype(variant))
+    search_index_before = DiamondSearchIndex(df, build_index(embeddings, variant), embeddings, **search_options(variant))
+
+    new_df, new_embeddings, search_index, stats = ingest_feed(feed, df, embeddings, search_index_before, model, batch_size=32)
+    assert stats == {'unchanged': STORED_ROWS - REMOVED_ROWS - CHANGED_ROWS, 'added': NEW_ROWS,
+                     'changed': CHANGED_ROWS, 'removed': REMOVED_ROWS}
+    assert search_index.ntotal == len(new_df) == len(new_embeddings) == len(feed)
+    assert search_index_before.ntotal == len(df)
+
+    # Row i's embedding is the encoding of row i's stone, as in a catalog built from the feed
+    expected_df, expected_embeddings = encode_catalog(feed, model)
+    assert sorted(contents(new_df)) == sorted(contents(expected_df))
+    positions = pd.Series(np.arange(len(feed)), index=contents(expected_df))[contents(new_df)].to_numpy()
+    np.testing.assert_allclose(np.asarray(new_embeddings, dtype='float32'),
+                               expected_embeddings[positions].astype(new_embeddings.dtype).astype('float32'))
+    assert new_df['Price'].tolist() == expected_df['Price'].iloc[positions].tolist()
+
+    # Every row is found by its own vector: FAISS ids are DataFrame row positions
+    D, I = search_index.search(new_embeddings, 1)
+    np.testing.assert_allclose(D[:, 0], 0, atol=1e-4)
+    np.testing.assert_array_equal(np.asarray(new_embeddings[I[:, 0]]), np.asarray(new_embeddings))
+
+    # Removed stones are gone from the rows and from the index
+    removed_df, removed_embeddings = encode_catalog(removed, model)
+    assert not np.isin(contents(removed_df), contents(new_df)).any()
+    D, I = search_index.search(removed_embeddings, 10)
+    assert ((I >= 0) & (I < len(new_df))).all()
+    assert not np.isin(contents(removed_df), contents(new_df.iloc[I.ravel()])).any()
@@ -0,0 +1,30 @@
+import os
+import multiprocessing
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+
+def save_entries(path, worker):
+    cache = EmbeddingCache()
+    for i in range(200):
+        cache.put(f"query {worker} {i}", np.full(64, worker, dtype='float32'))
+    for _ in range(20):
+        cache.save(path)
+
+def test_workers_saving_to_one_path_leave_a_whole_file(tmp_path):
+    path = str(tmp_path / "embeddings.npz")
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=save_entries, args=(path, worker)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert all(worker.exitcode == 0 for worker in workers)
+
+    assert len(EmbeddingCache(path=path)) == 200
+    # Every entry comes from the same worker's save
+    with np.load(path) as data:
+        assert len(np.unique(data["vectors"])) == 1
+    assert os.listdir(tmp_path) == ["embeddings.npz"]
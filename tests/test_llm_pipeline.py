@@ -0,0 +1,125 @@
+import time
+import types
+import threading
+
+import pytest
+
+from chatbot import compact_catalog
+
+import llm_pipeline
+from llm_gateway import LLMGateway
+from llm_pipeline import configure_executor, generate_chat_response, stream_chat_response, prompt_data, templated_introduction, templated_analysis, diamond_records
+
+
+class SlowUpstream:
+    """Groq stand-in whose completions take `latency` seconds; records the calls made."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self.in_flight = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+        self.chat = types.SimpleNamespace(completions=self)
+
+    def create(self, timeout=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        time.sleep(self.latency)
+        with self._lock:
+            self.in_flight -= 1
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content="ok"))])
+
+
+class StalledStream:
+    """Groq stand-in whose streams send `first` and then hang until released."""
+
+    def __init__(self, first=None):
+        self.first = first
+        self.released = threading.Event()
+        self.chat = types.SimpleNamespace(completions=self)
+
+    def create(self, timeout=None, **kwargs):
+        if self.first:
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=self.first))])
+        self.released.wait()
+
+
+@pytest.fixture
+def top_5(catalog):
+    return catalog[0].head(5)
+
+@pytest.fixture
+def executor():
+    yield configure_executor
+    configure_executor(llm_pipeline.LLM_THREADS)
+
+def chat_in_threads(requests, top_5, client, timeout):
+    responses = []
+    def chat():
+        responses.append(generate_chat_response("1 carat round", top_5, client, timeout=timeout))
+    threads = [threading.Thread(target=chat) for _ in range(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+def test_pool_runs_every_call_the_gateway_admits(top_5, executor):
+    upstream = SlowUpstream(0.2)
+    executor(40)
+    chat_in_threads(20, top_5, LLMGateway(upstream, timeout=5, max_in_flight=40, max_queue=0), timeout=5)
+    assert upstream.calls == 40
+    assert upstream.peak > 16
+
+def test_calls_beyond_the_gateway_limits_are_refused(top_5, executor):
+    upstream = SlowUpstream(0.3)
+    executor(4 + 20)
+    gateway = LLMGateway(upstream, timeout=5, max_in_flight=4, max_queue=20, queue_timeout=0.45)
+    responses = chat_in_threads(20, top_5, gateway, timeout=5)
+    time.sleep(0.5)
+    # 4 calls run and 20 queue, of which 4 get a slot within queue_timeout; the other
+    # 16 queued calls time out and the 16 beyond the queue are refused at once
+    assert upstream.calls == 8
+    assert upstream.peak == 4
+    records = diamond_records(top_5)
+    fallbacks = sum(response.startswith(templated_introduction(records)) + (analysis == templated_analysis(records))
+                    for response, analysis in responses)
+    assert fallbacks == 32
+
+def test_calls_whose_caller_fell_back_are_not_sent(top_5, executor):
+    upstream = SlowUpstream(0.5)
+    executor(1 + 4)
+    gateway = LLMGateway(upstream, timeout=5, max_in_flight=1, max_queue=4, queue_timeout=5)
+    chat_in_threads(1, top_5, gateway, timeout=0.2)
+    time.sleep(0.6)
+    # The analysis waited for the introduction's slot past the caller's deadline
+    assert upstream.calls == 1
+
+@pytest.mark.parametrize("first", [None, "Here are"], ids=["silent", "partial"])
+def test_stalled_stream_falls_back_at_the_deadline(top_5, executor, first):
+    upstream = StalledStream(first)
+    started = time.monotonic()
+    try:
+        events = list(stream_chat_response("1 carat round", top_5, upstream, timeout=0.3))
+    finally:
+        upstream.released.set()
+    assert time.monotonic() - started < 1
+    records = diamond_records(top_5)
+    introduction = "".join(text for event, text in events if event == "introduction")
+    assert introduction == (first or templated_introduction(records))
+    assert [event for event, _ in events if event == "analysis"] == (["analysis"] if first else [])
+    event, done = events[-1]
+    assert event == "done"
+    assert done["response"].startswith(introduction)
+    assert done["expert_analysis"] == templated_analysis(records)
+
+def test_prompt_data_is_the_embedded_text(prepared_catalog):
+    df = compact_catalog(prepared_catalog)
+    assert prompt_data(df) == "\n".join(prepared_catalog['combined_text'])
+    # Whole prices stay integers when the Price column turns float (e.g. after an ingest)
+    whole = df.head(5).assign(Price=df['Price'].head(5).round().astype('int64'))
+    assert prompt_data(whole.astype({'Price': 'float64'})) == prompt_data(whole)
+    assert "Price: 2186," in prompt_data(whole.head(1).assign(Price=2186.0))
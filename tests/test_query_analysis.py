@@ -0,0 +1,100 @@
+import re
+import random
+
+from query_analysis import analyze_query
+
+
+# ------------------- Reference Extractor -------------------
+# The per-pattern extractor analyze_query replaced, searching the raw query once per field
+def extract_constraints_from_query(user_query):
+    constraints = {}
+
+    style_match = re.search(r'\b(lab\s*grown|lab|natural)\b', user_query, re.IGNORECASE)
+    if style_match:
+        style = style_match.group(1).lower()
+        if "lab" in style:
+            constraints["Style"] = "labgrown"
+        else:
+            constraints["Style"] = "natural"
+
+    carat_match = re.search(r'(\d+(\.\d+)?)\s*-?\s*carat', user_query, re.IGNORECASE)
+    if carat_match:
+        constraints["Carat"] = float(carat_match.group(1))
+
+    pattern1 = r'\b(?:under|at price|price)\s*\$?(\d+(?:,\d+)?)(?:\$)?\b'
+    pattern2 = r'\$?(\d+(?:,\d+)?)(?:\$)?\s*price\b'
+    budget_match = re.search(pattern1, user_query, re.IGNORECASE) or re.search(pattern2, user_query, re.IGNORECASE)
+    if budget_match:
+        budget_str = budget_match.group(1).replace(',', '')
+        constraints["Budget"] = float(budget_str)
+
+    color_match = re.search(r'\b([a-j])\b', user_query, re.IGNORECASE)
+    if color_match:
+        constraints["Color"] = color_match.group(1).lower()
+
+    clarity_match = re.search(r'\b(if|vvs1|vvs2|vs1|vs2|si1|si2)\b', user_query, re.IGNORECASE)
+    if clarity_match:
+        constraints["Clarity"] = clarity_match.group(1).lower()
+
+    cut_match = re.search(r'(?:cut\s*(?:is\s*)?(excellent|ideal|very good|good))|(?:(excellent|ideal|very good|good)\s*cut)', user_query, re.IGNORECASE)
+    if cut_match:
+        quality = cut_match.group(1) if cut_match.group(1) is not None else cut_match.group(2)
+        constraints["Cut"] = quality.lower()
+
+    polish_match = re.search(r'(?:polish\s*(?:is\s*)?(excellent|ideal|very good|good))|(?:(excellent|ideal|very good|good)\s*polish)', user_query, re.IGNORECASE)
+    if polish_match:
+        quality = polish_match.group(1) if polish_match.group(1) is not None else polish_match.group(2)
+        constraints["Polish"] = quality.lower()
+
+    symmetry_match = re.search(r'(?:symmetry\s*(?:is\s*)?(excellent|ideal|very good|good))|(?:(excellent|ideal|very good|good)\s*symmetry)', user_query, re.IGNORECASE)
+    if symmetry_match:
+        quality = symmetry_match.group(1) if symmetry_match.group(1) is not None else symmetry_match.group(2)
+        constraints["Symmetry"] = quality.lower()
+
+    shape_match = re.search(r'\b(round|princess|emerald|asscher|cushion|marquise|radiant|oval|pear|heart|square radiant)\b', user_query, re.IGNORECASE)
+    if shape_match:
+        constraints["Shape"] = shape_match.group(1).lower()
+
+    lower_query = user_query.lower()
+    if "Budget" not in constraints:
+        if any(keyword in lower_query for keyword in ["cheapest", "lowest price", "affordable", "low budget"]):
+            constraints["PriceOrder"] = "asc"
+        elif any(keyword in lower_query for keyword in ["most expensive", "highest price", "priciest", "expensive", "high budget"]):
+            constraints["PriceOrder"] = "desc"
+
+    return constraints
+
+def reference_flags(user_query):
+    """The ordering keyword checks hybrid_search and diamond_chatbot made on the raw query."""
+    lower_query = user_query.lower()
+    return {
+        "price_asc": any(word in lower_query for word in ["cheapest", "lowest price", "affordable", "low budget"]),
+        "price_desc": any(word in lower_query for word in ["most expensive", "highest price", "priciest", "expensive", "high budget"]),
+        "carat_desc": any(word in lower_query for word in ["highest", "largest", "maximum"]),
+        "carat_asc": any(word in lower_query for word in ["minimum", "lowest", "smallest"]),
+        "is_greeting": user_query.strip().lower() in ["hi", "hello"],
+    }
+
+
+# ------------------- Differential Check -------------------
+# Fragments that overlap, touch or repeat fields, in mixed case
+FRAGMENTS = [
+    "1 carat", "0.5-carat", "2.01 Carat", "3carat", "under 1 carat", "under 2,000", "price 500", "at price 1500$",
+    "$2,500 price", "1000$ price", "price", "under", "lab", "Lab Grown", "labgrown", "natural", "Natural lab",
+    "e", "G", "j", "k", "a", "vs1", "VVS2", "si2", "if", "vs1vvs2", "excellent cut", "cut is ideal",
+    "cut excellent polish", "very good polish", "polish is good", "good symmetry", "symmetry very good",
+    "excellent", "Round", "square radiant", "radiant", "pear", "heart", "ovals", "cheapest", "lowest price",
+    "Lowest", "highest price", "most expensive", "expensive", "priciest", "affordable", "low budget",
+    "high budget", "maximum", "minimum", "largest", "smallest", "diamond", "with", "and", "hi", "hello",
+]
+
+def generated_queries(count=3000, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 7))) for _ in range(count)]
+
+def test_analyze_query_matches_the_per_pattern_extractor(queries):
+    for query in queries + generated_queries() + ["hi", " Hello ", "HI", ""]:
+        parsed_query = analyze_query(query)
+        assert dict(parsed_query.constraints) == extract_constraints_from_query(query), query
+        flags = {name: getattr(parsed_query, name) for name in reference_flags(query)}
+        assert flags == reference_flags(query), query
@@ -0,0 +1,56 @@
+import time
+import sqlite3
+import threading
+
+from response_cache import ResponseCache
+
+
+def rows(path):
+    with sqlite3.connect(path) as db:
+        return dict(db.execute("SELECT key, stored_at FROM responses").fetchall())
+
+def expire_rows(path, seconds):
+    with sqlite3.connect(path) as db:
+        db.execute("UPDATE responses SET stored_at = stored_at - ?", (seconds,))
+
+def test_put_deletes_expired_rows(tmp_path):
+    path = str(tmp_path / "responses.db")
+    cache = ResponseCache(ttl=60, path=path, prune_interval=0)
+    cache.put("old", "text")
+    expire_rows(path, 120)
+    cache.put("new", "text")
+    assert set(rows(path)) == {"new"}
+
+def test_pruning_runs_every_prune_interval(tmp_path):
+    path = str(tmp_path / "responses.db")
+    cache = ResponseCache(ttl=60, path=path, prune_interval=3600)
+    cache.put("old", "text")
+    expire_rows(path, 120)
+    cache.put("new", "text")
+    assert set(rows(path)) == {"old", "new"}
+    assert cache.prune() == 1
+    assert set(rows(path)) == {"new"}
+
+def test_workers_share_the_sqlite_backend(tmp_path):
+    path = str(tmp_path / "responses.db")
+    ResponseCache(path=path).put("key", {"text": "cached"})
+    other = ResponseCache(path=path)
+    assert other.get("key") == {"text": "cached"}
+    assert other.get("missing") is None
+    assert other.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+def test_concurrent_misses_compute_once(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "responses.db"))
+    calls = []
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return "text"
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("key", compute))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["text"] * 8
+    assert len(calls) == 1
@@ -0,0 +1,93 @@
+import numpy as np
+
+from chatbot import filter_candidates, carat_candidates, order_results, top_k_positions
+from query_analysis import analyze_query
+
+
+# ------------------- Reference Ranking -------------------
+# The row-wise ranking hybrid_search used before order_results: a score per row with
+# DataFrame.apply, then sort_values and the first 5. Sorts are stable: score ties keep
+# FAISS order, price/carat ties catalog order (as the rank permutations do)
+def compute_score(row, constraints, df_filtered):
+    score = row['distance']
+    if "Carat" in constraints:
+        score += 1000 * abs(row["Carat"] - constraints["Carat"])
+    else:
+        median_carat = df_filtered['Carat'].median()
+        score += 100 * abs(row["Carat"] - median_carat)
+    if "Budget" in constraints:
+        user_budget = constraints["Budget"]
+        score += 0.05 * abs(row["Price"] - user_budget)
+    else:
+        try:
+            price = float(row["Price"])
+        except:
+            price = 0
+        score += 0.1 * price
+    for attr, penalty in [("Clarity", 50), ("Color", 50)]:
+        if attr in constraints and row[attr].lower() != constraints[attr].lower():
+            score += penalty
+    for attr, penalty in [("Cut", 20), ("Symmetry", 20), ("Polish", 20)]:
+        if attr in constraints and row[attr].lower() != constraints[attr].lower():
+            score += penalty
+    return score
+
+def reference_top5(results_df, parsed_query, df_filtered):
+    constraints = parsed_query.constraints
+    by_row = results_df.sort_index(kind='stable')
+    if parsed_query.price_asc or constraints.get("PriceOrder") == "asc":
+        return by_row.sort_values(by='Price', ascending=True, kind='stable').head(5)
+    elif parsed_query.price_desc or constraints.get("PriceOrder") == "desc":
+        return by_row.sort_values(by='Price', ascending=False, kind='stable').head(5)
+    if parsed_query.carat_desc:
+        return by_row.sort_values(by='Carat', ascending=False, kind='stable').head(5)
+    elif parsed_query.carat_asc:
+        return by_row.sort_values(by='Carat', ascending=True, kind='stable').head(5)
+    results_df = results_df.copy()
+    results_df['score'] = results_df.apply(lambda row: compute_score(row, constraints, df_filtered), axis=1)
+    return results_df.sort_values(by='score', ascending=True, kind='stable').head(5)
+
+
+# ------------------- Parity -------------------
+def search_results(query, parsed_query, catalog, model):
+    """FAISS results of the query over its filtered rows (the carat window when it has a Carat)."""
+    df, _, search_index = catalog
+    constraints = parsed_query.constraints
+    ids, message = filter_candidates(constraints, search_index.attributes)
+    if message is not None:
+        return None
+    candidate_ids = carat_candidates(constraints, ids, search_index.attributes) if "Carat" in constraints else ids
+    top_k = min(200, len(df) if candidate_ids is None else len(candidate_ids))
+    D, I = search_index.search(model.encode(query)[None], top_k, candidate_ids=candidate_ids)
+    found = I[0] >= 0
+    return ids, I[:, found], D[:, found]
+
+def test_order_results_matches_row_wise_ranking(queries, prepared_catalog, catalog, model):
+    attributes = catalog[2].attributes
+    compared = 0
+    for query in queries:
+        parsed_query = analyze_query(query)
+        found = search_results(query, parsed_query, catalog, model)
+        if found is None:
+            continue
+        ids, result_ids, distances = found
+        top, scores = order_results(result_ids, distances, ids, parsed_query, attributes)
+
+        results_df = prepared_catalog.iloc[result_ids[0]].copy()
+        results_df['distance'] = distances[0]
+        df_filtered = prepared_catalog if ids is None else prepared_catalog.iloc[ids]
+        expected = reference_top5(results_df, parsed_query, df_filtered)
+
+        assert result_ids[0][top[0]].tolist() == expected.index.tolist(), query
+        if scores is not None:
+            np.testing.assert_allclose(scores[0], expected['score'].to_numpy(), rtol=1e-12, err_msg=query)
+        compared += 1
+    assert compared > 100
+
+def test_top_k_positions_keeps_ties_in_order():
+    values = np.array([[3.0, 1.0, 2.0, 1.0, 1.0, 0.5, 1.0]])
+    assert top_k_positions(values, 3).tolist() == [[5, 1, 3]]
+    # The first k positions are the same whatever k is
+    full = top_k_positions(values, values.shape[1])
+    for k in range(1, values.shape[1] + 1):
+        assert top_k_positions(values, k).tolist() == full[:, :k].tolist()
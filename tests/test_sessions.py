@@ -0,0 +1,191 @@
+import time
+
+import numpy as np
+
+from chatbot import diamond_search, NO_MATCH_REPLY
+from metrics import start_request
+from query_analysis import analyze_query
+from sessions import follow_up_kind, conversation_search, PendingSearch, SessionStore, NO_MORE_REPLY, PAGE_SIZE
+
+
+class CountingEncoder:
+    """Wraps the encoder and counts encode() calls."""
+
+    def __init__(self, model):
+        self.model = model
+        self.calls = 0
+
+    def encode(self, *args, **kwargs):
+        self.calls += 1
+        return self.model.encode(*args, **kwargs)
+
+def chat(message, session, catalog, model):
+    """One chat message as app.py handles it: returns (kind, reply, page, session)."""
+    df, embeddings, search_index = catalog
+    parsed_query = analyze_query(message)
+    kind = follow_up_kind(parsed_query, session)
+    reply, page, session = conversation_search(kind, message, parsed_query, session, df, embeddings, search_index, model)
+    return kind, reply, page, session
+
+def prices(page):
+    return page["Price"].to_numpy(float)
+
+
+def test_session_searches_time_the_filter_stage(catalog, model):
+    df, embeddings, search_index = catalog
+    timings = start_request()
+    parsed_query = analyze_query("1 carat round natural vs1")
+    _, _, session = conversation_search(None, parsed_query.text, parsed_query, None, df, embeddings, search_index, model)
+    assert "filter" in timings
+
+    timings = start_request()
+    parsed_query = analyze_query("excellent cut")
+    kind = follow_up_kind(parsed_query, session)
+    assert kind == "refine"
+    conversation_search(kind, parsed_query.text, parsed_query, session, df, embeddings, search_index, model)
+    assert "filter" in timings
+
+def test_first_page_matches_diamond_search(queries, catalog, model):
+    df, embeddings, search_index = catalog
+    for query in queries:
+        parsed_query = analyze_query(query)
+        reply, top_5 = diamond_search(query, df, search_index, model, parsed_query)
+        session_reply, page, _ = conversation_search(None, query, parsed_query, None, df, embeddings, search_index, model)
+        assert session_reply == reply, query
+        if top_5 is None:
+            assert page is None, query
+        else:
+            assert page.equals(top_5.reset_index(drop=True)), query
+
+def test_new_shape_starts_a_new_search(catalog, model):
+    _, _, _, session = chat("1 carat round natural vs1", None, catalog, model)
+    assert follow_up_kind(analyze_query("oval under 3000"), session) is None
+    assert follow_up_kind(analyze_query("round under 3000"), session) == "refine"
+    assert follow_up_kind(analyze_query("vs2 under 3000"), session) == "refine"
+    # Without a Shape in the session, a Shape narrows it
+    _, _, _, session = chat("1 carat natural vs1", None, catalog, model)
+    assert follow_up_kind(analyze_query("oval under 3000"), session) == "refine"
+
+def test_cheaper_shows_diamonds_below_the_prices_shown(catalog, model):
+    _, _, first, session = chat("1 carat round natural vs1", None, catalog, model)
+    for _ in range(2):
+        _, _, page, session = chat("show more", session, catalog, model)
+    kind, reply, cheaper, cheaper_session = chat("cheaper ones", session, catalog, model)
+    assert kind == "refine" and reply is None
+    assert prices(cheaper).max() < prices(page).min()
+    assert not np.isin(cheaper_session.shown_ids(), session.shown_ids()).any()
+
+    kind, reply, pricier, _ = chat("more expensive ones", session, catalog, model)
+    assert kind == "refine" and reply is None
+    assert prices(pricier).min() > prices(page).max()
+
+def test_style_answer_runs_the_pending_search(catalog, model):
+    df, _, search_index = catalog
+    query = "1 carat round vs1"
+    pending = PendingSearch(query, analyze_query(query))
+    kind, reply, page, session = chat("labgrown", pending, catalog, model)
+    assert kind == "style" and reply is None
+    _, top_5 = diamond_search(f"{query} labgrown", df, search_index, model)
+    assert page.equals(top_5.reset_index(drop=True))
+    assert session.query == f"{query} labgrown"
+    assert dict(session.parsed_query.constraints) == dict(analyze_query(f"{query} labgrown").constraints)
+    # Anything but a Style is a new search
+    assert follow_up_kind(analyze_query("2 carat oval natural"), pending) is None
+
+# ------------------- Follow-ups -------------------
+def test_more_pages_down_to_the_end(catalog, model):
+    df = catalog[0]
+    _, _, page, session = chat("1 carat round natural", None, catalog, model)
+    shown = [session.shown_ids()]
+    while True:
+        kind, reply, page, next_session = chat("show more", session, catalog, model)
+        assert kind == "more"
+        if reply is not None:
+            break
+        assert next_session.offset == session.offset + PAGE_SIZE
+        assert page.equals(df.iloc[next_session.shown_ids()].reset_index(drop=True).assign(
+            distance=page["distance"], score=page["score"]))
+        shown.append(next_session.shown_ids())
+        session = next_session
+    assert reply == NO_MORE_REPLY and page is None and next_session is session
+    shown = np.concatenate(shown)
+    assert len(shown) == len(session.order) == len(np.unique(shown))
+
+def test_similar_excludes_the_diamonds_shown(catalog, model):
+    encoder = CountingEncoder(model)
+    _, _, _, session = chat("1 carat round natural vs1", None, catalog, encoder)
+    calls = encoder.calls
+    kind, reply, page, similar = chat("more like these", session, catalog, encoder)
+    assert kind == "similar" and reply is None
+    assert not np.isin(similar.result_ids, session.shown_ids()).any()
+    assert np.isin(similar.result_ids, session.candidate_ids).all()
+    assert encoder.calls == calls
+
+def test_refine_narrows_the_session_candidates(catalog, model):
+    attributes = catalog[2].attributes
+    encoder = CountingEncoder(model)
+    _, _, _, session = chat("1 carat natural", None, catalog, encoder)
+    calls = encoder.calls
+    kind, reply, page, refined = chat("under 3000 excellent cut excellent polish", session, catalog, encoder)
+    assert kind == "refine" and reply is None
+    assert encoder.calls == calls
+    assert refined.parsed_query.constraints["Carat"] == 1.0
+    assert refined.parsed_query.constraints["Budget"] == 3000
+    # Only new constraints: the session's candidates are narrowed
+    assert np.isin(refined.ids, session.ids).all()
+    assert (attributes.numbers["Price"][refined.ids] <= 3000).all()
+    for column in ["Cut", "Polish"]:
+        assert set(np.asarray(attributes.values[column])[attributes.codes[column][refined.ids]]) == {"excellent"}
+    assert (prices(page) <= 3000).all()
+
+def test_refine_re_filters_a_changed_constraint(catalog, model):
+    attributes = catalog[2].attributes
+    encoder = CountingEncoder(model)
+    _, _, _, session = chat("1 carat natural vs1", None, catalog, encoder)
+    calls = encoder.calls
+    kind, reply, page, refined = chat("vs2", session, catalog, encoder)
+    assert kind == "refine" and reply is None
+    assert encoder.calls == calls
+    assert refined.parsed_query.constraints["Clarity"] == "vs2"
+    # A changed Clarity filters the catalog again rather than the vs1 candidates
+    assert not np.isin(refined.ids, session.ids).any()
+    assert set(np.asarray(attributes.values["Clarity"])[attributes.codes["Clarity"][refined.ids]]) == {"vs2"}
+    assert set(page["Clarity"].astype(str)) == {"vs2"}
+
+def test_refine_without_matches_keeps_the_session(catalog, model):
+    _, _, _, session = chat("1 carat natural", None, catalog, model)
+    kind, reply, page, kept = chat("under 1", session, catalog, model)
+    assert kind == "refine"
+    assert reply == NO_MATCH_REPLY and page is None and kept is session
+
+
+# ------------------- Session Store -------------------
+def test_lru_store_evicts_the_idlest_session():
+    store = SessionStore(maxsize=2, ttl=None, eviction="lru")
+    store.put("a", 1)
+    store.put("b", 2)
+    assert store.get("a") == 1
+    store.put("c", 3)
+    assert store.get("b") is None
+    assert (store.get("a"), store.get("c")) == (1, 3)
+
+def test_fifo_store_evicts_the_oldest_session():
+    store = SessionStore(maxsize=2, ttl=None, eviction="fifo")
+    store.put("a", 1)
+    store.put("b", 2)
+    assert store.get("a") == 1
+    store.put("a", 10)
+    store.put("c", 3)
+    assert store.get("a") is None
+    assert (store.get("b"), store.get("c")) == (2, 3)
+
+def test_store_drops_idle_sessions():
+    store = SessionStore(maxsize=10, ttl=0.05)
+    store.put("a", 1)
+    store.put("b", 2)
+    time.sleep(0.03)
+    assert store.get("a") == 1
+    time.sleep(0.03)
+    assert store.get("a") == 1
+    assert store.get("b") is None
+    assert len(store) == 1
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from chatbot import hybrid_search
+from sharded_search import write_shards, ShardedSearch
+
+
+@pytest.fixture(scope='module', params=[(2, None), (3, "Shape")], ids=["2-round-robin", "3-by-shape"])
+def sharded(request, catalog, model, tmp_path_factory):
+    shards, by = request.param
+    df, embeddings, search_index = catalog
+    shard_dir = str(tmp_path_factory.mktemp("shards"))
+    write_shards(shard_dir, df, embeddings, search_index, shards, by)
+    search = ShardedSearch(model, shard_dir)
+    yield search
+    search.close()
+
+def test_sharded_top_5_matches_single_process(sharded, queries, catalog, model):
+    df, _, search_index = catalog
+    for query in queries:
+        expected = hybrid_search(query, df, search_index, model).head(5)
+        found = sharded.hybrid_search(query).head(5)
+        assert list(found.columns) == list(expected.columns), query
+        assert found.shape == expected.shape, query
+        for column in expected.columns:
+            if column in ("distance", "score"):
+                # Shard indexes may sum a distance in another order (one float32 ulp apart)
+                np.testing.assert_allclose(found[column].to_numpy(float), expected[column].to_numpy(float),
+                                           rtol=1e-5, err_msg=query)
+            else:
+                assert found[column].astype(str).tolist() == expected[column].astype(str).tolist(), query